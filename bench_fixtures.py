@@ -0,0 +1,118 @@
+import math
+import numpy as np
+import vector_tile_pb2
+from geometry_utils import clip_line_array, clip_ring_array
+
+# synthetic geometry and vector tiles for benchmarks; everything is generated from a seed, hence
+# repeated runs work on identical data
+
+# extent of the synthetic tile set in map units (the origin is at (0, 0))
+WORLD_SIZE = 4096000.
+
+# densities of the fixtures: number of lines and polygons of the world and number of points per line
+DENSITIES = {
+  'sparse': (200, 50, 50),
+  'medium': (1000, 200, 200),
+  'dense' : (4000, 800, 400)
+}
+
+
+# random walks with the given number of points and step length, starting at random positions
+def random_lines(count, points, step, size=WORLD_SIZE, seed=0):
+  rng    = np.random.default_rng(seed)
+  starts = rng.uniform(0., size, (count, 1, 2))
+  angles = np.cumsum(rng.normal(0., .4, (count, points - 1)), axis=1) + rng.uniform(0., 2 * math.pi, (count, 1))
+  steps  = step * np.stack([np.cos(angles), np.sin(angles)], axis=2)
+  return list(np.clip(np.concatenate([starts, starts + np.cumsum(steps, axis=1)], axis=1), 0., size))
+
+
+# star-shaped polygon rings (not closed) with wiggly boundaries
+def random_polygons(count, points, radius, size=WORLD_SIZE, seed=0):
+  rng     = np.random.default_rng(seed)
+  centers = rng.uniform(radius, size - radius, (count, 1, 2))
+  angles  = np.linspace(0., 2 * math.pi, points, endpoint=False)
+  radii   = radius * rng.uniform(.3, 1., (count, 1)) * (1. + .2 * rng.uniform(-1., 1., (count, points)))
+  return list(centers + radii[:, :, None] * np.stack([np.cos(angles), np.sin(angles)], axis=1)[None])
+
+
+# lines as they appear in a single tile after clipping (e.g., coastlines): each line enters the box
+# on one side and leaves it on another, for polygonize_clipped_lines
+def clipped_tile_lines(count, points, bbox, seed=0):
+  rng   = np.random.default_rng(seed)
+  (x0, y0), (x1, y1) = bbox
+  width = x1 - x0
+  lines = []
+  for idx in range(count):
+    # horizontal bands across the box, such that the lines do not cross each other
+    y     = y0 + (y1 - y0) * (idx + .5) / count
+    xs    = np.linspace(x0 - .01 * width, x1 + .01 * width, points)
+    ys    = y + np.cumsum(rng.normal(0., .1 * (y1 - y0) / count / math.sqrt(points), points))
+    line  = np.stack([xs, ys], axis=1)
+    lines.append(list(map(tuple, (line if idx % 2 == 0 else line[::-1]).tolist())))
+  return lines
+
+
+# world geometry of a density: (lines, polygons)
+def world_fixture(density, seed=0):
+  line_cnt, poly_cnt, points = DENSITIES[density]
+  return (
+    random_lines(line_cnt, points, WORLD_SIZE / 2000., seed=seed),
+    random_polygons(poly_cnt, points, WORLD_SIZE / 200., seed=seed + 1)
+  )
+
+
+def _zigzag(values):
+  return (values << 1) ^ (values >> 63)
+
+
+# geometry commands of a vector tile feature for shapes in tile coordinates (integer arrays)
+def _encode_geometry(shapes, closed):
+  geometry = []
+  cursor   = np.zeros(2, dtype=np.int64)
+  for shape in shapes:
+    deltas = np.diff(np.concatenate([cursor[None], shape]), axis=0)
+    params = _zigzag(deltas).ravel().tolist()
+    geometry.append(1 | (1 << 3))
+    geometry.extend(params[:2])
+    geometry.append(2 | ((len(shape) - 1) << 3))
+    geometry.extend(params[2:])
+    if closed:
+      geometry.append(7 | (1 << 3))
+    cursor = shape[-1]
+  return geometry
+
+
+# encode the parts of the world geometry in a tile as a vector tile (with layers "roads" and
+# "water"); the geometry is clipped to the tile box plus a buffer and quantized to the tile grid,
+# just like real tiles
+def encode_tile(world, z, x, y, extent=4096, buffer=64):
+  tile_size = WORLD_SIZE / 2**z
+  scale     = extent / tile_size
+  orig      = np.array([x * tile_size, y * tile_size])
+  margin    = buffer / scale
+  bbox      = ((orig[0] - margin, orig[1] - margin), (orig[0] + tile_size + margin, orig[1] + tile_size + margin))
+  tile      = vector_tile_pb2.Tile()
+  for layer_name, shapes, feature_type in (('roads', world[0], 2), ('water', world[1], 3)):
+    layer         = tile.layers.add()
+    layer.name    = layer_name
+    layer.version = 2
+    layer.extent  = extent
+    layer.keys.append('class')
+    layer.values.add().string_value = 'main' if feature_type == 2 else 'lake'
+    for shape in shapes:
+      lo, hi = shape.min(axis=0), shape.max(axis=0)
+      if lo[0] > bbox[1][0] or lo[1] > bbox[1][1] or hi[0] < bbox[0][0] or hi[1] < bbox[0][1]:
+        continue
+      parts   = clip_line_array(shape, bbox) if feature_type == 2 else [clip_ring_array(shape, bbox)]
+      encoded = []
+      for part in parts:
+        part = np.rint((part - orig) * scale).astype(np.int64)
+        part = part[np.concatenate([[True], np.any(part[1:] != part[:-1], axis=1)])]
+        if len(part) >= (2 if feature_type == 2 else 3):
+          encoded.append(part)
+      if len(encoded) > 0:
+        feature      = layer.features.add()
+        feature.type = feature_type
+        feature.tags.extend([0, 0])
+        feature.geometry.extend(_encode_geometry(encoded, feature_type == 3))
+  return tile.SerializeToString()
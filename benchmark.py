@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import statistics
+import numpy as np
+import tilemap
+import map2svg
+import bench_fixtures
+from mock_tile_server import MockTileServer
+from geometry_utils import (
+  clip_line_array, close_line_pairs, close_point_pairs, convex_hull, dissolve_lines, polygonize_clipped_lines
+)
+
+# reproducible benchmarks of the tile decoding, the geometry functions, and complete map2svg runs
+# against a local mock tile server; the results are written as a json report, which can be compared
+# against an earlier report (e.g., python benchmark.py --baseline old_report.json)
+
+ZOOM     = 4
+VIEWPORT = ((200000., 300000.), (1700000., 1800000.))
+
+
+# run func repeat times (after one warm-up run) and return the timings
+def measure(func, repeat):
+  func()
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    timings.append(time.perf_counter() - start)
+  return timings
+
+
+# lines of the world fixture cut into the pieces found in the tiles at the given zoom level
+# (overlapping by the tile buffer), as input for dissolve_lines
+def tile_fragments(lines, zoom, buffer=.02):
+  tile_size = bench_fixtures.WORLD_SIZE / 2**zoom
+  fragments = []
+  for line in lines:
+    lo = np.floor(line.min(axis=0) / tile_size).astype(int)
+    hi = np.floor(line.max(axis=0) / tile_size).astype(int)
+    for x in range(lo[0], hi[0] + 1):
+      for y in range(lo[1], hi[1] + 1):
+        margin = buffer * tile_size
+        bbox   = ((x * tile_size - margin, y * tile_size - margin), ((x + 1) * tile_size + margin, (y + 1) * tile_size + margin))
+        fragments.extend(list(map(tuple, piece.tolist())) for piece in clip_line_array(line, bbox) if len(piece) > 1)
+  return fragments
+
+
+# benchmarks for a density as (name, number of items processed, function)
+def benchmarks(server, density):
+  lines, polygons = bench_fixtures.world_fixture(density)
+  points          = np.concatenate(lines)
+  line_lists      = [list(map(tuple, line.tolist())) for line in lines]
+  fragments       = tile_fragments(lines, 3)
+  tile_box        = ((0., 0.), (bench_fixtures.WORLD_SIZE / 16, bench_fixtures.WORLD_SIZE / 16))
+  coast_lines     = bench_fixtures.clipped_tile_lines(len(lines) // 10, len(lines[0]), tile_box)
+  tmap            = tilemap.VectorTileMap(server.url)
+  tiles           = list(tmap.query_tiles(ZOOM, VIEWPORT, ordered=True))
+  return [
+    ('query_shapes', len(tiles), lambda: sum(1 for _ in tilemap.VectorTileMap(server.url).query_shapes(ZOOM, VIEWPORT))),
+    ('decode_tile', len(tiles), lambda: [tilemap.decode_tile_store(*tile) for tile in tiles]),
+    ('convex_hull', len(points), lambda: convex_hull(points)),
+    ('close_point_pairs', len(points), lambda: sum(1 for _ in close_point_pairs(points[::2], points[1::2], 100.))),
+    ('close_line_pairs', len(line_lists), lambda: sum(1 for _ in close_line_pairs(line_lists, 100.))),
+    ('dissolve_lines', len(fragments), lambda: list(dissolve_lines([list(fragment) for fragment in fragments], 1.))),
+    ('polygonize_clipped_lines', len(coast_lines), lambda: polygonize_clipped_lines([list(line) for line in coast_lines], tile_box))
+  ]
+
+
+# complete map2svg run (in a temporary directory) rendering both layers of the mock server
+def map2svg_run(server, processes=0):
+  config = {
+    'viewport' : [VIEWPORT[0][0], VIEWPORT[0][1], VIEWPORT[1][0], VIEWPORT[1][1]],
+    'processes': processes,
+    'sources'  : [{'url': server.url, 'zoom': ZOOM, 'groups': [
+      {'layer': 'roads', 'filters': [], 'colour': '#f00', 'processing': {'dissolve_lines': {}, 'remove_small_shapes': {'mean_width': 5000}}},
+      {'layer': 'water', 'filters': [], 'colour': '#00f', 'processing': {'remove_small_shapes': {'mean_width': 5000}}}
+    ]}]
+  }
+  def run():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      with open(os.path.join(tmp_dir, 'map_config.json'), 'w') as cfg:
+        json.dump(config, cfg)
+      try:
+        os.chdir(tmp_dir)
+        map2svg.main()
+      finally:
+        os.chdir(cwd)
+  return run
+
+
+def environment():
+  try:
+    commit = subprocess.run(
+      ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    ).stdout.strip() or None
+  except OSError:
+    commit = None
+  return {
+    'created'   : time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    'git_commit': commit,
+    'python'    : platform.python_version(),
+    'numpy'     : np.__version__,
+    'platform'  : platform.platform(),
+    'cpu_count' : os.cpu_count()
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description="benchmark tile decoding, geometry processing, and map2svg")
+  parser.add_argument('--densities', nargs='+', choices=bench_fixtures.DENSITIES, default=['sparse', 'medium'])
+  parser.add_argument('--repeat', type=int, default=5)
+  parser.add_argument('--latency', type=float, default=0., help="delay of each response of the mock server in seconds")
+  parser.add_argument('--error-rate', type=float, default=0., help="share of tile requests failing with 429 or 5xx")
+  parser.add_argument('--processes', type=int, default=0, help="worker processes for the map2svg runs")
+  parser.add_argument('--only', nargs='+', help="names of the benchmarks to run")
+  parser.add_argument('--report', default='bench_report.json')
+  parser.add_argument('--baseline', help="earlier report to compare the results with")
+  args = parser.parse_args()
+
+  results = []
+  for density in args.densities:
+    with MockTileServer(density, args.latency, args.error_rate) as server:
+      cases = benchmarks(server, density) + [('map2svg', 1, map2svg_run(server, args.processes))]
+      for name, items, func in cases:
+        if args.only is not None and name not in args.only:
+          continue
+        # the functions under test may print progress information
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+          timings = measure(func, args.repeat)
+        result = {
+          'name'   : name,
+          'density': density,
+          'items'  : items,
+          'repeat' : args.repeat,
+          'min'    : min(timings),
+          'median' : statistics.median(timings),
+          'mean'   : statistics.mean(timings),
+          'stdev'  : statistics.stdev(timings) if len(timings) > 1 else 0.
+        }
+        results.append(result)
+        print(f"{name:>26} {density:>7}: median {result['median'] * 1000:10.2f} ms, min {result['min'] * 1000:10.2f} ms ({items} items)")
+      print(f"mock server responses by status for density {density}: {server.counts}")
+
+  report = {'environment': environment(), 'arguments': vars(args), 'results': results}
+  with open(args.report, 'w') as out:
+    json.dump(report, out, indent=2)
+
+  if args.baseline is not None:
+    with open(args.baseline) as base_file:
+      baseline = {(res['name'], res['density']): res for res in json.load(base_file)['results']}
+    print(f"compared to {args.baseline} (median time relative to baseline):")
+    for res in results:
+      base = baseline.get((res['name'], res['density']))
+      if base is not None:
+        print(f"{res['name']:>26} {res['density']:>7}: {res['median'] / base['median']:6.2f}x")
+
+
+if __name__ == '__main__':
+  main()
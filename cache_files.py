@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+
+# file handling shared by the on-disk caches (see tile_cache.TileCache and stage_cache.StageCache):
+# each entry is a json metadata file and a data file, kept in a subdirectory named after the first
+# two characters of its key; the access time of an entry is the mtime of its metadata file
+
+
+# metadata and data file of an entry
+def entry_files(path, key, data_ext):
+    subpath = os.path.join(path, key[:2])
+    return os.path.join(subpath, key + '.json'), os.path.join(subpath, key + data_ext)
+
+
+# access time and size (of both files) of all entries of a cache directory, by key
+def scan_entries(path, data_ext):
+    entries = {}
+    for subdir in os.listdir(path):
+        subpath = os.path.join(path, subdir)
+        if not os.path.isdir(subpath):
+            continue
+        for name in os.listdir(subpath):
+            if name.endswith('.json'):
+                key  = name[:-5]
+                data = os.path.join(subpath, key + data_ext)
+                try:
+                    meta = os.stat(os.path.join(subpath, name))
+                    size = meta.st_size + (os.path.getsize(data) if os.path.exists(data) else 0)
+                except OSError: # removed concurrently
+                    continue
+                entries[key] = (meta.st_mtime, size)
+    return entries
+
+
+# write a file through a temporary file such that concurrent readers never see a partial file;
+# write is called with the temporary file, opened in the given mode
+def write_atomic(file, write, mode='w'):
+    tmp_file = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, mode) as f:
+        write(f)
+    os.replace(tmp_file, file)
+
+
+# mark an entry as recently used, returns the new access time
+def touch(meta_file):
+    now = time.time()
+    try:
+        os.utime(meta_file, (now, now))
+    except OSError:
+        pass
+    return now
+
+
+# remove least recently used entries (a dictionary of key -> (access time, size), from which they
+# are deleted) while their total size exceeds max_size; evicts down to 90 % of max_size so that the
+# entries are not sorted again on every following insert; returns the remaining total size
+def evict_lru(entries, size, max_size, files):
+    if max_size is None or size <= max_size:
+        return size
+    for key, (_, entry_size) in sorted(entries.items(), key=lambda item: item[1][0]):
+        if size <= max_size * 0.9:
+            break
+        for fname in files(key):
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+        size -= entry_size
+        del entries[key]
+    return size
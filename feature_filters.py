@@ -0,0 +1,181 @@
+import operator
+
+# comparison operators of filter expressions; 'in' tests whether the first operand is contained in
+# the second one (legacy Mapbox filters of the form ["in", key, value1, value2, ...] are converted)
+COMPARISONS = {
+    '=='    : operator.eq,
+    '!='    : operator.ne,
+    '<'     : operator.lt,
+    '<='    : operator.le,
+    '>'     : operator.gt,
+    '>='    : operator.ge,
+    'in'    : lambda val1, val2: val1 in val2,
+    '!in'   : lambda val1, val2: val1 not in val2,
+    'not in': lambda val1, val2: val1 not in val2,
+}
+
+# geometry type names of the legacy Mapbox filter key "$type" by feature type (see vector_tile.proto)
+GEOMETRY_TYPES = {1: 'Point', 2: 'LineString', 3: 'Polygon'}
+
+
+# comparisons of incompatible values (e.g., a string and a number) do not match
+def _compare(func, val1, val2):
+    try:
+        return bool(func(val1, val2))
+    except TypeError:
+        return False
+
+
+# split an operand into a tag reference and a literal; a string operand refers to the tag of that
+# name if the feature has it and is a literal otherwise, ["get", key] always refers to a tag; the
+# legacy Mapbox key "$type" refers to the geometry type of the feature, "$id" is not supported
+# (shapes are grouped by their tags, their ids are not kept)
+def _operand(val):
+    if val == '$type':
+        return val, None
+    if val == '$id':
+        raise ValueError("unsupported filter key '$id'")
+    if isinstance(val, (list, tuple)) and len(val) == 2 and val[0] == 'get':
+        return val[1], None
+    if isinstance(val, str):
+        return val, val
+    return None, val
+
+
+# value of an operand for a dictionary of tags and a feature type
+def _getter(key, lit):
+    if key == '$type':
+        return lambda tags, shape_type: GEOMETRY_TYPES.get(shape_type)
+    if key is None:
+        return lambda tags, shape_type: lit
+    return lambda tags, shape_type: tags.get(key, lit)
+
+
+def _normalize(expr):
+    expr = list(expr)
+    if expr[0] in ('in', '!in') and not (len(expr) == 3 and isinstance(expr[2], (list, tuple))):
+        expr = [expr[0], expr[1], tuple(expr[2:])]
+    return expr
+
+
+# compile a filter expression into a predicate on a dictionary of tags and a feature type
+def _compile(expr):
+    expr = _normalize(expr)
+    op   = expr[0]
+    if op in ('all', 'any', 'none'):
+        preds = [_compile(sub) for sub in expr[1:]]
+        if op == 'all':
+            return lambda tags, shape_type: all(pred(tags, shape_type) for pred in preds)
+        if op == 'any':
+            return lambda tags, shape_type: any(pred(tags, shape_type) for pred in preds)
+        return lambda tags, shape_type: not any(pred(tags, shape_type) for pred in preds)
+    if op in ('has', '!has'):
+        key, negate = expr[1], op == '!has'
+        return lambda tags, shape_type: (key in tags) != negate
+    if op not in COMPARISONS:
+        raise ValueError(f"unsupported filter operator {op!r}")
+    func       = COMPARISONS[op]
+    get1, get2 = _getter(*_operand(expr[1])), _getter(*_operand(expr[2]))
+    return lambda tags, shape_type: _compare(func, get1(tags, shape_type), get2(tags, shape_type))
+
+
+# bind a filter expression to the key and value tables of a tile layer (see layer_tables.LayerTable);
+# the resulting predicate takes a dictionary mapping key indices to value indices of a feature and
+# its feature type, such that tag values never need to be decoded per feature; returns True or
+# False instead if the outcome is the same for all features of the layer
+def _bind(expr, table):
+    expr = _normalize(expr)
+    op   = expr[0]
+    if op in ('all', 'any', 'none'):
+        preds = [_bind(sub, table) for sub in expr[1:]]
+        # fold constant sub-expressions
+        if op == 'all':
+            if any(pred is False for pred in preds):
+                return False
+            preds = [pred for pred in preds if pred is not True]
+            if len(preds) == 0:
+                return True
+            return lambda itags, shape_type: all(pred(itags, shape_type) for pred in preds)
+        negate = op == 'none'
+        if any(pred is True for pred in preds):
+            return not negate
+        preds  = [pred for pred in preds if pred is not False]
+        if len(preds) == 0:
+            return negate
+        return lambda itags, shape_type: any(pred(itags, shape_type) for pred in preds) != negate
+    if op in ('has', '!has'):
+        negate = op == '!has'
+        if expr[1] not in table.key_idx:
+            return negate
+        key = table.key_idx[expr[1]]
+        return lambda itags, shape_type: (key in itags) != negate
+    if op not in COMPARISONS:
+        raise ValueError(f"unsupported filter operator {op!r}")
+    func                       = COMPARISONS[op]
+    (key1, lit1), (key2, lit2) = _operand(expr[1]), _operand(expr[2])
+    if '$type' in (key1, key2):
+        # comparison with the geometry type of the feature (legacy Mapbox key "$type")
+        get1, get2 = _bind_getter(key1, lit1, table), _bind_getter(key2, lit2, table)
+        return lambda itags, shape_type: _compare(func, get1(itags, shape_type), get2(itags, shape_type))
+    key1 = table.key_idx.get(key1) if key1 is not None else None
+    key2 = table.key_idx.get(key2) if key2 is not None else None
+    if key1 is None and key2 is None:
+        return _compare(func, lit1, lit2)
+    if key1 is not None and key2 is not None:
+        return lambda itags, shape_type: _compare(
+            func, table.value(itags[key1]) if key1 in itags else lit1,
+                  table.value(itags[key2]) if key2 in itags else lit2
+        )
+    # a single tag operand: evaluate the comparison at most once for every value of the layer
+    key    = key1 if key1 is not None else key2
+    absent = _compare(func, lit1, lit2)
+    truth  = {}
+    def pred(itags, shape_type):
+        val_idx = itags.get(key)
+        if val_idx is None:
+            return absent
+        result = truth.get(val_idx)
+        if result is None:
+            val    = table.value(val_idx)
+            result = truth[val_idx] = (
+                _compare(func, val, lit2) if key1 is not None else _compare(func, lit1, val)
+            )
+        return result
+    return pred
+
+
+# value of an operand for the key and value indices of a feature and its feature type, see _getter
+def _bind_getter(key, lit, table):
+    if key == '$type':
+        return lambda itags, shape_type: GEOMETRY_TYPES.get(shape_type)
+    key = table.key_idx.get(key) if key is not None else None
+    if key is None:
+        return lambda itags, shape_type: lit
+    return lambda itags, shape_type: table.value(itags[key]) if key in itags else lit
+
+
+# a set of filter expressions (either tuples of the form (op, val1, val2) or Mapbox-style filter
+# expressions) that matches a feature if any of the expressions matches; None or an empty set of
+# expressions matches all features
+class FeatureFilter:
+    def __init__(self, filters=None):
+        self.filters = [] if filters is None else list(filters)
+        self.preds   = [_compile(expr) for expr in self.filters]
+
+    # evaluate the filter on a dictionary of tags (and the feature type, for filters on "$type")
+    def __call__(self, tags, shape_type=None):
+        return len(self.preds) == 0 or any(pred(tags, shape_type) for pred in self.preds)
+
+    # bind the filter to the tables of a tile layer, see _bind
+    def bind(self, table):
+        if len(self.filters) == 0:
+            return True
+        return _bind(['any'] + self.filters, table)
+
+
+# convert nested lists of a filter expression (as loaded from json) into tuples, such that the
+# expression can be stored in a set
+def freeze_filter(expr):
+    if isinstance(expr, (list, tuple)):
+        return tuple(freeze_filter(sub) for sub in expr)
+    return expr
@@ -1,134 +1,99 @@
-from sortedcontainers import SortedList
-import math
+import logging
+import numpy as np
+import metrics
+from spatial_index import PointGrid, STRTree
+from shape_store import ShapeStore
 
-def convex_hull(points):
-  points = list(points) # ensure we have a list (and not an iterator)
-  # if the line has more than 100 points, try to eliminate as many as possible first
+logger = logging.getLogger(__name__)
+
+# half of a convex hull (Andrew's monotone chain) for points sorted lexicographically
+def _half_hull(points):
+  hull = []
+  for x, y in points:
+    while len(hull) >= 2 and (
+      (hull[-1][0] - hull[-2][0]) * (y - hull[-2][1]) - (hull[-1][1] - hull[-2][1]) * (x - hull[-2][0]) <= 0
+    ):
+      hull.pop()
+    hull.append((x, y))
+  return hull
+
+
+# convex hull of an (n, 2) array of points as an (h, 2) array (in counterclockwise order if the
+# y-axis points up), computed in O(n log n)
+def convex_hull_array(points):
+  points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+  # if the shape has more than 100 points, try to eliminate as many as possible first
   if len(points) > 100:
-    # find up to 8 points that are for sure part of the convex hull
-    pts_on_hull = [
-      min(points, key=lambda pt: pt[0]        ), # smallest x coordinate (leftmost)
-      min(points, key=lambda pt: pt[0] + pt[1]), # smallest x + y (most to the bottom-left)
-      min(points, key=lambda pt: pt[1]        ), # smallest y coordinate (bottom-most)
-      min(points, key=lambda pt: pt[1] - pt[0]), # smallest y - x (most to the bottom-right)
-      max(points, key=lambda pt: pt[0]        ), # largest  x coordinate (rightmost)
-      max(points, key=lambda pt: pt[0] + pt[1]), # largest  x + y (most to the top-right)
-      max(points, key=lambda pt: pt[1]        ), # largest  y coordinate (topmost)
-      max(points, key=lambda pt: pt[1] - pt[0])  # largest  y - x (most to the top-left)
-    ]
-    # remove duplicates (dict maintains insertion order since Python 3.7)
-    pts_on_hull = list(dict.fromkeys(pts_on_hull))
-    # remove all points that are inside these initial points by testing whether each point is to the
-    # right of any of the segments of our initial set of points (if it is to the right of any segment
-    # it lies outside and if it is to the left of all segments it lies inside)
-    points = [(x, y) for (x, y) in points if any(
-      # point (x, y) lies to the right of ((x0, y0),(x1, y1)) if the cosine sign is positive
-      (x, y) == (x0, y0) or (x1 - x0) * (y - y0) - (y1 - y0) * (x - x0) > 0 for (x0, y0), (x1, y1) in
-      zip(pts_on_hull, pts_on_hull[1:] + pts_on_hull[:1])
-    )]
-  # compute convex hull using Jarvis's march on the remaining points
-  hull = [min(points, key=lambda pt: pt[0])] # start with leftmost point
-  while True:
-    x0, y0 = hull[-1]
-    x1, y1 = next(pt for pt in points if pt != (x0, y0)) # choose some other point
-    for x, y in points:
-      if (x, y) != (x0, y0) and (x, y) != (x1, y1):
-        if (x1 - x0) * (y - y0) - (y1 - y0) * (x - x0) > 0:
-          x1, y1 = x, y
-    if (x1, y1) in hull:
-      return hull
-    hull.append((x1, y1))
+    # find up to 8 points that are for sure part of the convex hull (in counterclockwise order):
+    # leftmost, bottom-left, bottom-most, bottom-right, rightmost, top-right, topmost, top-left
+    x, y        = points[:, 0], points[:, 1]
+    pts_on_hull = points[[
+      np.argmin(x), np.argmin(x + y), np.argmin(y), np.argmax(x - y),
+      np.argmax(x), np.argmax(x + y), np.argmax(y), np.argmin(x - y)
+    ]]
+    # remove duplicates while maintaining the order
+    _, first    = np.unique(pts_on_hull, axis=0, return_index=True)
+    pts_on_hull = pts_on_hull[np.sort(first)]
+    if len(pts_on_hull) >= 3:
+      # a point lies outside of the polygon formed by these points if it lies to the right of any
+      # of its segments, i.e., if the cross product is negative
+      seg_start = pts_on_hull
+      seg_end   = np.roll(pts_on_hull, -1, axis=0)
+      cross     = (
+        (seg_end[:, 0:1] - seg_start[:, 0:1]) * (y[None, :] - seg_start[:, 1:2]) -
+        (seg_end[:, 1:2] - seg_start[:, 1:2]) * (x[None, :] - seg_start[:, 0:1])
+      )
+      points    = np.concatenate([pts_on_hull, points[(cross < 0).any(axis=0)]])
+  # sort the points lexicographically and remove duplicates
+  points = np.unique(points, axis=0)
+  if len(points) <= 2:
+    return points
+  pts   = list(map(tuple, points.tolist()))
+  lower = _half_hull(pts)
+  upper = _half_hull(pts[::-1])
+  return np.array(lower[:-1] + upper[:-1])
+
+
+def convex_hull(points):
+  return list(map(tuple, convex_hull_array(list(points)).tolist()))
+
+
+# perimeters of the convex hulls of a list of shapes, as an array; hulls of less than two points
+# (empty shapes and single points) have perimeter 0
+def hull_perimeters(shapes):
+  hulls      = [convex_hull_array(shape) for shape in shapes]
+  perimeters = np.zeros(len(hulls))
+  valid      = [idx for idx, hull in enumerate(hulls) if len(hull) >= 2]
+  if len(valid) == 0:
+    return perimeters
+  # compute all edge lengths at once, the edges of a hull connect each point with the next one
+  lengths = np.array([len(hulls[idx]) for idx in valid])
+  starts  = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+  pts     = np.concatenate([hulls[idx] for idx in valid])
+  nxt     = np.arange(1, len(pts) + 1)
+  nxt[starts + lengths - 1] = starts # last point of each hull connects to its first point
+  edges   = np.hypot(pts[nxt, 0] - pts[:, 0], pts[nxt, 1] - pts[:, 1])
+  perimeters[valid] = np.add.reduceat(edges, starts)
+  return perimeters
 
 
 def close_point_pairs(points_A, points_B, margin=1.):
-  points_A      = list(enumerate(points_A))
-  points_B      = list(enumerate(points_B))
-  # sort the points in A and B by ascending x coordinate
-  points_A.sort(key=lambda ept: ept[1][0])
-  points_B.sort(key=lambda ept: ept[1][0])
-  points_A      = iter(points_A)
-  points_B      = iter(points_B)
-  close_pts_A_x = SortedList(key=lambda ept: ept[1][0]) # close points from A sorted by x coordinate
-  close_pts_A_y = SortedList(key=lambda ept: ept[1][1]) # close points from A sorted by y coordinate
-  close_pts_B_x = SortedList(key=lambda ept: ept[1][0]) # close points from B sorted by x coordinate
-  close_pts_B_y = SortedList(key=lambda ept: ept[1][1]) # close points from B sorted by y coordinate
-  # repeatedly select the point with lowest x coordinate (either from A or B) to check next
-  idx_A, pt_A   = next(points_A)
-  idx_B, pt_B   = next(points_B)
-  while pt_A is not None or pt_B is not None:
-    if pt_A is not None and (pt_B is None or pt_A[0] < pt_B[0]):
-      # update lists of close points in B by removing all those whose x coordinate is out of range
-      for _ in range(close_pts_B_x.bisect_key_right(pt_A[0] - margin)):
-        close_pts_B_y.remove(close_pts_B_x.pop(0))
-      # find points from B that are close to the current point from A
-      for close_idx, close_pt in close_pts_B_y.irange_key(pt_A[1] - margin, pt_A[1] + margin):
-        if (pt_A[0] - close_pt[0])**2 + (pt_A[1] - close_pt[1])**2 < margin**2:
-          yield (idx_A, close_idx)
-      # add the current point from A to the lists of close points and fetch the next point from A
-      close_pts_A_x.add((idx_A, pt_A))
-      close_pts_A_y.add((idx_A, pt_A))
-      idx_A, pt_A = next(points_A, (None, None))
-    elif pt_B is not None:
-      # update lists of close points in A by removing all those whose x coordinate is out of range
-      for _ in range(close_pts_A_x.bisect_key_right(pt_B[0] - margin)):
-        close_pts_A_y.remove(close_pts_A_x.pop(0))
-      # find points from A that are close to the current point from B
-      for close_idx, close_pt in close_pts_A_y.irange_key(pt_B[1] - margin, pt_B[1] + margin):
-        if (pt_B[0] - close_pt[0])**2 + (pt_B[1] - close_pt[1])**2 < margin**2:
-          yield (close_idx, idx_B)
-      # add the current point from B to the lists of close points and fetch the next point from B
-      close_pts_B_x.add((idx_B, pt_B))
-      close_pts_B_y.add((idx_B, pt_B))
-      idx_B, pt_B = next(points_B, (None, None))
+  return PointGrid([points_A, points_B], margin).close_pairs(0, 1)
+
 
+# bounding boxes of lines as an (n, 4) array, with the minimum coordinates lowered by a margin
+def _line_bboxes(lines, margin=0.):
+  bboxes = np.empty((len(lines), 4))
+  for idx, line in enumerate(lines):
+    line        = np.asarray(line, dtype=np.float64)
+    bboxes[idx] = (*(line.min(axis=0) - margin), *line.max(axis=0))
+  return bboxes
 
+
+# indices of close line pairs (lines with overlapping bounding boxes)
 def close_line_pairs(lines, margin=1.):
-  # compute bounding boxes (with margin) for all lines
-  bboxes = [(
-    (min(x for x, y in line) - margin, min(y for x, y in line) - margin),
-    (max(x for x, y in line)         , max(y for x, y in line)         )
-  ) for line in lines]
-  # box boundaries in x direction, along with info about y extent of each box
-  bounds_x = (
-    [(x0, True , idx, (y0, y1)) for idx, ((x0, y0), (x1, y1)) in enumerate(bboxes)] + # start coords
-    [(x1, False, idx, (y0, y1)) for idx, ((x0, y0), (x1, y1)) in enumerate(bboxes)]   # end coords
-  )
-  # sort the box boundaries by x coordinate
-  bounds_x.sort(key=lambda bound: bound[0])
-  # return indices of close line pairs (lines with overlapping bounding boxes)
-  active_boxes_intervals = SortedList(key=lambda bound_y: bound_y[0])
-  for _, start, box_idx, range_y in bounds_x:
-    if start:
-      y0_idx            = active_boxes_intervals.bisect_key_left(range_y[0])
-      y1_idx            = active_boxes_intervals.bisect_key_right(range_y[1])
-      active_boxes_iter = active_boxes_intervals.islice(max(y0_idx - 1, 0), y1_idx + 1)
-      pre_active_boxes  = next(active_boxes_iter)[2] if y0_idx > 0 else set()
-      active_boxes_y0   = None
-      overlapping_boxes = set()
-      active_boxes      = set()
-      for _ in range(y1_idx - y0_idx):
-        active_boxes       = next(active_boxes_iter)[2]
-        overlapping_boxes |= active_boxes
-        if active_boxes_y0 is None:
-          active_boxes_y0 = pre_active_boxes & active_boxes
-        active_boxes.add(box_idx)
-      active_boxes_y1 = active_boxes & next(active_boxes_iter, (None, None, set()))[2]
-      active_boxes_intervals.add((range_y[0], box_idx, active_boxes_y0 | {box_idx} if active_boxes_y0 is not None else {box_idx}))
-      active_boxes_intervals.add((range_y[1], box_idx, active_boxes_y1 | {box_idx}))
-      for idx in overlapping_boxes:
-        yield (box_idx, idx) if box_idx < idx else (idx, box_idx)
-    else:
-      active_boxes_y0, active_boxes_y1 = None, None
-      for _, idx, active_boxes in active_boxes_intervals.irange_key(range_y[0], range_y[1]):
-        active_boxes.discard(box_idx)
-        if idx == box_idx:
-          if active_boxes_y0 is None:
-            active_boxes_y0 = active_boxes
-          else:
-            active_boxes_y1 = active_boxes
-      active_boxes_intervals.remove((range_y[0], box_idx, active_boxes_y0))
-      active_boxes_intervals.remove((range_y[1], box_idx, active_boxes_y1))
-  assert len(active_boxes_intervals) == 0
+  for idx1, idx2 in STRTree(_line_bboxes(lines, margin)).overlapping_pairs().tolist():
+    yield (idx1, idx2)
 
 
 def dissolve_lines(lines, equal_dist=1.):
@@ -139,9 +104,17 @@ def dissolve_lines(lines, equal_dist=1.):
       yield line
     else:
       open_lines.append(line)
-  # iterate through pairs of lines that are close to eachother and remember connections and overlaps
+  # index the points of all open lines once, for finding close points of pairs of lines
+  point_grid    = PointGrid(open_lines, equal_dist)
+  # find connections (the end point of one line equals the start point of another line) with an
+  # index of the line endpoints; ordered by line pair and direction
+  end_grid      = PointGrid([[line[-1] for line in open_lines], [line[0] for line in open_lines]], equal_dist)
+  connections   = sorted(
+    ((idx1, idx2) for idx1, idx2 in end_grid.close_pairs(0, 1) if idx1 != idx2),
+    key=lambda conn: (min(conn), max(conn), conn[0] > conn[1])
+  )
+  # iterate through pairs of lines that are close to eachother and remember overlaps
   covered_lines = []
-  connections   = []
   overlaps      = []
   pair_cnt      = 0
   for idx1, idx2 in close_line_pairs(open_lines, equal_dist):
@@ -151,13 +124,8 @@ def dissolve_lines(lines, equal_dist=1.):
     line1 = open_lines[idx1]
     line2 = open_lines[idx2]
     if line1 is not None and line2 is not None:
-      # special case: the end point of one line equals the start point of the other line
-      if (line2[0][0] - line1[-1][0])**2 + (line2[0][1] - line1[-1][1])**2 < equal_dist**2:
-        connections.append((idx1, idx2))
-      if (line1[0][0] - line2[-1][0])**2 + (line1[0][1] - line2[-1][1])**2 < equal_dist**2:
-        connections.append((idx2, idx1))
       # get pairs of close points between those lines
-      pairs = set(close_point_pairs(line1, line2, equal_dist))
+      pairs = set(point_grid.close_pairs(idx1, idx2))
       # search for runs of close points at the start of one and the end of the other line
       overlap_len_l1_l2 = 0     # length of longest overlap at end of line 1 and start of line 2
       overlap_len_l2_l1 = 0     # length of longest overlap at start of line 1 and end of line 2
@@ -191,88 +159,609 @@ def dissolve_lines(lines, equal_dist=1.):
         overlaps.append((overlap_len_l1_l2, idx1, idx2))
       if overlap_len_l2_l1 >= 3:
         overlaps.append((overlap_len_l2_l1, idx2, idx1))
-  print(f"iterated through {pair_cnt} pairs of lines and found {len(connections)} connections and {len(overlaps)} overlaps")
+  logger.debug(f"iterated through {pair_cnt} pairs of lines and found {len(connections)} connections and {len(overlaps)} overlaps")
+  metrics.count('dissolve_candidate_pairs', pair_cnt)
+  metrics.count('dissolve_connections', len(connections))
+  metrics.count('dissolve_overlaps', len(overlaps))
   # eliminate lines that are completely covered by another
+  alive = [True] * len(open_lines)
   for idx in covered_lines:
-    open_lines[idx] = None
+    alive[idx] = False
   # sort overlaps from largest to smallest
   overlaps.sort(key=lambda overlap: overlap[0], reverse=True)
+  # merged lines are kept as chains of lines: each chain is identified by its first line (head),
+  # parent links lead from each line to the head of its chain (union-find), the tail of a chain is
+  # its last line and links point from each line of a chain to the next one (along with the overlap
+  # length); the points of a chain are only materialized when it is returned
+  parent = list(range(len(open_lines)))
+  tail   = list(range(len(open_lines)))
+  links  = [None] * len(open_lines)
+  def find(idx):
+    root = idx
+    while parent[root] != root:
+      root = parent[root]
+    while parent[idx] != root:
+      parent[idx], idx = root, parent[idx]
+    return root
+  def materialize(head):
+    line, idx = list(open_lines[head]), head
+    while links[idx] is not None:
+      idx, overlap_len = links[idx]
+      line.pop()
+      line.extend(open_lines[idx][overlap_len-1:])
+    return line
   # merge connected lines first, then those with overlaps
-  line_end_redirects  = {}
   for overlap_len, idx1, idx2 in [(1, idx1, idx2) for idx1, idx2 in connections] + overlaps:
-    orig_idx1 = idx1
-    # if line 1 has been merged into another line, then its end is now the end of that other line
-    idx1  = line_end_redirects.get(idx1, idx1)
-    line1 = open_lines[idx1] if idx1 is not None else None
-    line2 = open_lines[idx2]
-    assert line2 is None or idx2 not in line_end_redirects or line_end_redirects[idx2] is None
-    if idx1 == idx2:
-      # line overlaps itself: close it and yield it (unless it would have 0 area after closing)
-      if line1 is not None and len(line1) > overlap_len + 2:
-        yield line1[:-overlap_len] + [line1[0]]
-      open_lines[idx1] = None
-    elif line1 is not None and line2 is not None:
-      # extend line 1 with line 2
-      line1.pop()
-      line1.extend(line2[overlap_len-1:])
-      # remove line 2
-      open_lines[idx2] = None
-      # the end of line 1 is now gone, hence all redirects to it are replaced with empty redirects
-      line_end_redirects.update(
-        [(old_idx, None) for old_idx, new_idx in line_end_redirects.items() if new_idx == idx1]
-      )
-      # an empty redirect is added for line 1 itself, as it might still be referenced in other overlaps
-      line_end_redirects[idx1] = None
-      # the former end of line 2 is now the end of line 1
-      line_end_redirects[idx2] = idx1
-      # update all redirects that currently point to line 2 to point to line 1 instead
-      line_end_redirects.update(
-        [(old_idx, idx1) for old_idx, new_idx in line_end_redirects.items() if new_idx == idx2]
-      )
+    # the end of line 1 is the end of a chain only if line 1 is the tail of its chain
+    head1 = find(idx1)
+    head1 = head1 if tail[head1] == idx1 else None
+    # line 2 can only be appended if it is the head of a chain
+    live1 = head1 is not None and alive[head1]
+    live2 = parent[idx2] == idx2 and alive[idx2]
+    if head1 == idx2:
+      # line overlaps itself: close it and yield it right away (unless it would have 0 area after closing)
+      if live1:
+        line1 = materialize(head1)
+        if len(line1) > overlap_len + 2:
+          yield line1[:-overlap_len] + [line1[0]]
+      alive[head1] = False
+    elif live1 and live2:
+      # extend the chain of line 1 with the chain of line 2
+      links[idx1]   = (idx2, overlap_len)
+      parent[idx2]  = head1
+      tail[head1]   = tail[idx2]
   # return remaining lines
-  for line in open_lines:
-    if line is not None:
-      yield line
+  for idx in range(len(open_lines)):
+    if parent[idx] == idx and alive[idx]:
+      yield materialize(idx)
+
 
+# position of points outside of boxes along the boundaries of the boxes, as a parameter t in (0, 8]
+# that increases counterclockwise (if the y-axis points up) starting from the middle of the left
+# side; the corners are at t = 1 (bottom left), 3 (bottom right), 5 (top right), and 7 (top left);
+# the parameter is that of the intersection of the boundary with the ray from the center of the box
+# through the point, computed without trigonometry by scaling the box to a square of side length 2
+def _perimeter_params(points, boxes):
+  center = (boxes[:, 0] + boxes[:, 1]) / 2.
+  half   = np.maximum((boxes[:, 1] - boxes[:, 0]) / 2., 1e-12)
+  rel    = (points - center) / half
+  rel   /= np.abs(rel).max(axis=1)[:, None]
+  u, v   = rel[:, 0], rel[:, 1]
+  horiz  = np.abs(u) >= np.abs(v) # on the left or right side
+  return np.where(
+    horiz,
+    np.where(u < 0, np.where(v < 0, -v, 8. - v), 4. + v),
+    np.where(v < 0, 2. + u, 6. - u)
+  )
 
+
+# close lines clipped to a bounding box into polygons: the ends of lines outside of the box are
+# connected to the next starts of lines outside of the box in counterclockwise order along the
+# boundary (if the y-axis points up), passing the corners of the box (moved outwards by
+# corner_outset) in between; lines that are already closed and lines that cannot be connected are
+# returned as they are
 def polygonize_clipped_lines(lines, bbox, corner_outset=1.):
-  lines = list(lines) # ensure we have a list (and not an iterator)
-  # gather line endpoints outside bounding box
-  outside_endpoints = [
-    (math.atan2(pt[1] - (bbox[0][1] + bbox[1][1]) / 2., pt[0] - (bbox[0][0] + bbox[1][0]) / 2), line_idx, start)
-    for line_idx, line in enumerate(lines) if line[0] != line[-1]
-    for pt, start in [(line[0], True), (line[-1], False)] if pt[0] < bbox[0][0] or pt[0] > bbox[1][0] or pt[1] < bbox[0][1] or pt[1] > bbox[1][1]
+  return polygonize_clipped_tiles([(bbox, lines)], corner_outset)[0]
+
+
+# polygonize_clipped_lines for the lines of many tiles at once; tiles is a list of pairs of a
+# bounding box and the lines clipped to it, returns the list of polygons of each tile; the
+# endpoints of the lines of all tiles are ordered along the boundaries of their boxes at once and
+# chains of connected lines are resolved with a union-find structure whose roots are the first
+# lines of the chains
+def polygonize_clipped_tiles(tiles, corner_outset=1.):
+  lines    = [line for _, tile_lines in tiles for line in tile_lines]
+  tile_of  = np.repeat(np.arange(len(tiles)), [len(tile_lines) for _, tile_lines in tiles])
+  # endpoints of open lines (start and end of each line, in this order)
+  is_open  = [len(line) > 0 and tuple(line[0]) != tuple(line[-1]) for line in lines]
+  ep_line  = np.repeat(np.flatnonzero(is_open), 2)
+  ep_start = np.tile([True, False], len(ep_line) // 2)
+  ep_pts   = np.array([tuple(lines[idx][0 if start else -1]) for idx, start in zip(ep_line.tolist(), ep_start.tolist())], dtype=np.float64).reshape(-1, 2)
+  boxes    = np.array([bbox for bbox, _ in tiles], dtype=np.float64).reshape(-1, 2, 2)
+  ep_box   = boxes[tile_of[ep_line]]
+  outside  = np.any((ep_pts < ep_box[:, 0]) | (ep_pts > ep_box[:, 1]), axis=1)
+  ep_line, ep_start, ep_pts, ep_box = ep_line[outside], ep_start[outside], ep_pts[outside], ep_box[outside]
+  ep_tile  = tile_of[ep_line]
+  ep_param = _perimeter_params(ep_pts, ep_box)
+  # sort the endpoints by tile and along the boundary (stable, such that ties keep their order)
+  order    = np.lexsort((ep_param, ep_tile))
+  ep_line, ep_start, ep_tile, ep_param = ep_line[order], ep_start[order], ep_tile[order], ep_param[order]
+  # the endpoint following each endpoint along the boundary of its tile (the last one of a tile
+  # is followed by the first one, one turn further)
+  first    = np.searchsorted(ep_tile, ep_tile, side='left')
+  last     = np.searchsorted(ep_tile, ep_tile, side='right') - 1
+  wrapped  = np.arange(len(ep_tile)) == last
+  follower = np.where(wrapped, first, np.arange(len(ep_tile)) + 1)
+  links    = np.flatnonzero(~ep_start & ep_start[follower]) if len(ep_tile) > 0 else np.zeros(0, dtype=np.int64)
+  # the corners passed by each link are those with parameters between the end and the start (the
+  # corners of a box are at 1, 3, 5, and 7 and again at 9, 11, 13, and 15 one turn further)
+  end_par      = ep_param[links]
+  start_par    = ep_param[follower[links]] + np.where(wrapped[links], 8., 0.)
+  first_corner = np.floor((end_par + 1.) / 2.).astype(np.int64) # index of the first corner after the end
+  last_corner  = np.ceil((start_par - 1.) / 2.).astype(np.int64) # one past the last corner before the start
+  corner_pts   = [
+    [(x0 - corner_outset, y0 - corner_outset), (x1 + corner_outset, y0 - corner_outset),
+     (x1 + corner_outset, y1 + corner_outset), (x0 - corner_outset, y1 + corner_outset)]
+    for (x0, y0), (x1, y1) in boxes.tolist()
   ]
-  # sort endpoints outside bounding box in clockwise order (note: y-axis is inverted)
-  outside_endpoints.sort(key=lambda elem: elem[0])
-  # iterate through endpoints that are actually the end of a line (and not the start)
-  merged_lines = {}
-  for end_pt_idx, (end_angle, end_line_idx, _) in ((idx, pt) for idx, pt in enumerate(outside_endpoints) if not pt[2]):
-    start_pt_idx = end_pt_idx + 1
-    start_angle, start_line_idx, start_start = outside_endpoints[start_pt_idx % len(outside_endpoints)]
-    if start_start:
-      start_line_idx = merged_lines.get(start_line_idx, start_line_idx)
-      end_line_idx   = merged_lines.get(end_line_idx  , end_line_idx  )
-      line = lines[end_line_idx]
-      # insert corners into the line as needed
-      if start_pt_idx >= len(outside_endpoints):
-        start_angle += 2*math.pi
-      for corner_angle, corner_pt in [
-        (-( 3./4.)*math.pi, (bbox[0][0] - corner_outset, bbox[0][1] - corner_outset)),
-        (-( 1./4.)*math.pi, (bbox[1][0] + corner_outset, bbox[0][1] - corner_outset)),
-        (+( 1./4.)*math.pi, (bbox[1][0] + corner_outset, bbox[1][1] + corner_outset)),
-        (+( 3./4.)*math.pi, (bbox[0][0] - corner_outset, bbox[1][1] + corner_outset)),
-        (+( 5./4.)*math.pi, (bbox[0][0] - corner_outset, bbox[0][1] - corner_outset)),
-        (+( 7./4.)*math.pi, (bbox[1][0] + corner_outset, bbox[0][1] - corner_outset)),
-        (+( 9./4.)*math.pi, (bbox[1][0] + corner_outset, bbox[1][1] + corner_outset)),
-        (+(11./4.)*math.pi, (bbox[0][0] - corner_outset, bbox[1][1] + corner_outset))
-      ]:
-        if end_angle < corner_angle < start_angle:
-          line.append(corner_pt)
-      if start_line_idx == end_line_idx:
-        line.append(line[0])
-      else:
-        line.extend(lines[start_line_idx])
-        merged_lines[start_line_idx] = end_line_idx
-        merged_lines.update([(key, end_line_idx) for key, val in merged_lines.items() if val == start_line_idx])
-  return [line for idx, line in enumerate(lines) if idx not in merged_lines]
+  parent   = list(range(len(lines)))
+  succ     = {} # line -> (corners, next line)
+  def find(idx):
+    while parent[idx] != idx:
+      parent[idx] = parent[parent[idx]]
+      idx         = parent[idx]
+    return idx
+  for end_line, start_line, tile, lo, hi in zip(
+    ep_line[links].tolist(), ep_line[follower[links]].tolist(), ep_tile[links].tolist(), first_corner.tolist(), last_corner.tolist()
+  ):
+    succ[end_line] = ([corner_pts[tile][idx % 4] for idx in range(lo, hi)], start_line)
+    # the start line is the first line of its chain, it joins the chain of the end line (unless
+    # that is the same chain, which is thereby closed)
+    head = find(end_line)
+    if head != start_line:
+      parent[start_line] = head
+  # concatenate the lines of each chain, starting with its first line
+  polygons = [[] for _ in tiles]
+  for idx, line in enumerate(lines):
+    if parent[idx] != idx:
+      continue
+    chain = list(line)
+    cur   = idx
+    while cur in succ:
+      corners, cur = succ[cur]
+      chain.extend(corners)
+      if cur == idx:
+        chain.append(chain[0])
+        break
+      chain.extend(lines[cur])
+    polygons[tile_of[idx]].append(chain)
+  return polygons
+
+
+# sides of a box that a point lies on (0: left, 1: right, 2: top, 3: bottom), empty if the point is
+# not on the boundary of the box and two sides for the corners
+def _box_sides(pt, bbox, tol):
+  return {
+    side for side, dist in enumerate((pt[0] - bbox[0][0], bbox[1][0] - pt[0], pt[1] - bbox[0][1], bbox[1][1] - pt[1]))
+    if abs(dist) <= tol
+  }
+
+
+# outcodes of points with respect to a box (Cohen-Sutherland): 1 left, 2 right, 4 top, 8 bottom
+def _outcodes(points, bbox):
+  return (
+    (points[:, 0] < bbox[0][0]) * 1 | (points[:, 0] > bbox[1][0]) * 2 |
+    (points[:, 1] < bbox[0][1]) * 4 | (points[:, 1] > bbox[1][1]) * 8
+  )
+
+
+# clip a line (an (n, 2) array) to a box; returns the pieces of the line inside the box as arrays,
+# with the points where the line leaves or enters the box inserted (exactly on the boundary);
+# segments with both ends outside on the same side are rejected by their outcodes, the remaining
+# segments are clipped parametrically (Liang-Barsky), all segments at once
+def clip_line_array(line, bbox):
+  line  = np.asarray(line, dtype=np.float64).reshape(-1, 2)
+  codes = _outcodes(line, bbox)
+  if not np.any(codes):
+    return [line] if len(line) > 0 else []
+  if len(line) == 1 or np.bitwise_and.reduce(codes) != 0:
+    return []
+  pt_a, pt_b = line[:-1], line[1:]
+  delta      = pt_b - pt_a
+  t0         = np.zeros(len(delta))
+  t1         = np.where(codes[:-1] & codes[1:] != 0, -1., 1.)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    for p, q in (
+      (-delta[:, 0], pt_a[:, 0] - bbox[0][0]), (delta[:, 0], bbox[1][0] - pt_a[:, 0]),
+      (-delta[:, 1], pt_a[:, 1] - bbox[0][1]), (delta[:, 1], bbox[1][1] - pt_a[:, 1])
+    ):
+      t  = q / p
+      t0 = np.where(p < 0, np.maximum(t0, t), t0)
+      t1 = np.where(p > 0, np.minimum(t1, t), np.where((p == 0) & (q < 0), -1., t1))
+  visible = np.flatnonzero(t0 <= t1)
+  if len(visible) == 0:
+    return []
+  # a piece starts with a segment that does not continue the previous visible segment inside
+  # the box; each segment contributes its (clipped) end point, the first one of a piece also its
+  # (clipped) start point
+  first   = np.ones(len(visible), dtype=bool)
+  first[1:] = (visible[1:] != visible[:-1] + 1) | (t1[visible[:-1]] < 1.) | (t0[visible[1:]] > 0.)
+  lo, hi  = np.array(bbox[0], dtype=np.float64), np.array(bbox[1], dtype=np.float64)
+  starts  = np.where(
+    (t0[visible] > 0.)[:, None], np.clip(pt_a[visible] + t0[visible, None] * delta[visible], lo, hi), pt_a[visible]
+  )
+  ends    = np.where(
+    (t1[visible] < 1.)[:, None], np.clip(pt_a[visible] + t1[visible, None] * delta[visible], lo, hi), pt_b[visible]
+  )
+  counts  = 1 + first
+  pos     = np.cumsum(counts) - counts
+  clipped = np.empty((counts.sum(), 2))
+  clipped[pos[first]]      = starts[first]
+  clipped[pos + counts - 1] = ends
+  pieces  = np.split(clipped, pos[first][1:])
+  # drop pieces that only touch the box in a single point
+  return [piece for piece in pieces if np.any(piece != piece[0])]
+
+
+# clip a polygon ring (an (n, 2) array, optionally closed by repeating the first point) to a box
+# (Sutherland-Hodgman, with all edges clipped at once for each side of the box); points inserted on
+# the boundary lie exactly on it; returns an empty array if the ring lies outside of the box
+def clip_ring_array(ring, bbox):
+  ring   = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+  codes  = _outcodes(ring, bbox)
+  if not np.any(codes):
+    return ring
+  if len(ring) == 0 or np.bitwise_and.reduce(codes) != 0:
+    return np.zeros((0, 2))
+  closed = len(ring) > 1 and np.all(ring[0] == ring[-1])
+  if closed:
+    ring = ring[:-1]
+  for axis, bound, sign in ((0, bbox[0][0], 1.), (0, bbox[1][0], -1.), (1, bbox[0][1], 1.), (1, bbox[1][1], -1.)):
+    succ    = np.roll(ring, -1, axis=0)
+    inside  = sign * (ring[:, axis] - bound) >= 0.
+    cross   = inside != np.roll(inside, -1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      t     = (bound - ring[cross, axis]) / (succ[cross, axis] - ring[cross, axis])
+    # each point contributes itself if inside and the intersection with the edge to its
+    # successor if that edge crosses the side
+    counts  = inside.astype(np.int64) + cross
+    pos     = np.cumsum(counts) - counts
+    clipped = np.empty((counts.sum(), 2))
+    clipped[pos[inside]] = ring[inside]
+    clipped[(pos + counts - 1)[cross]] = ring[cross] + t[:, None] * (succ[cross] - ring[cross])
+    clipped[(pos + counts - 1)[cross], axis] = bound
+    ring    = clipped
+    if len(ring) == 0:
+      return ring
+  return np.concatenate([ring, ring[:1]]) if closed else ring
+
+
+# clip a shape of the given type (1: points, 2: line, 3: polygon ring) to a box; returns a list of
+# the clipped shapes (lines may be split into several pieces, the other types result in at most
+# one shape)
+def clip_shape_array(shape_type, coords, bbox):
+  if shape_type == 2:
+    return clip_line_array(coords, bbox)
+  if shape_type == 3:
+    ring = clip_ring_array(coords, bbox)
+  else:
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    ring   = coords[_outcodes(coords, bbox) == 0]
+  return [ring] if len(ring) > 0 else []
+
+
+# join lines that were clipped at tile borders; tile_lines maps tile boxes to the lines in the tile,
+# every line is clipped exactly to its tile box and the points where the pieces cross the boundary
+# are indexed (snapped to a grid of tol, by default a millionth of the tile size), such that a piece
+# leaving one tile is continued by the only piece entering a neighbouring tile at the same point
+def stitch_tile_lines(tile_lines, tol=None):
+  pieces  = []
+  entries = {} # snapped boundary point -> indices of pieces starting there
+  exits   = {} # snapped boundary point -> indices of pieces ending there
+  for tile_idx, (tile_box, lines) in enumerate(tile_lines.items()):
+    if tol is None:
+      tol = (tile_box[1][0] - tile_box[0][0]) * 1e-6
+    for line in lines:
+      for piece in clip_line_array(line, tile_box):
+        piece = list(map(tuple, piece.tolist()))
+        for pt, index in ((piece[0], entries), (piece[-1], exits)):
+          if len(_box_sides(pt, tile_box, tol)) > 0:
+            key = (round(pt[0] / tol), round(pt[1] / tol))
+            index.setdefault(key, []).append(len(pieces))
+        pieces.append((tile_idx, piece))
+  # link pieces that leave and enter tiles at the same point (unless that point is ambiguous)
+  succ     = [None] * len(pieces)
+  has_pred = [False] * len(pieces)
+  for key, exit_idx in exits.items():
+    entry_idx = entries.get(key, ())
+    if len(exit_idx) == 1 and len(entry_idx) == 1 and pieces[exit_idx[0]][0] != pieces[entry_idx[0]][0]:
+      succ[exit_idx[0]]      = entry_idx[0]
+      has_pred[entry_idx[0]] = True
+  # follow the links, first from pieces that are not continuing another one; pieces that remain
+  # after that form closed loops
+  visited = [False] * len(pieces)
+  def follow(idx):
+    line = list(pieces[idx][1])
+    visited[idx] = True
+    while succ[idx] is not None and not visited[succ[idx]]:
+      idx          = succ[idx]
+      visited[idx] = True
+      line.extend(pieces[idx][1][1:])
+    if succ[idx] is not None:
+      line[-1] = line[0]
+    return line
+  for idx in range(len(pieces)):
+    if not has_pred[idx]:
+      yield follow(idx)
+  for idx in range(len(pieces)):
+    if not visited[idx]:
+      yield follow(idx)
+
+
+# merge polygon rings that were clipped at tile borders; tile_rings maps tile boxes to the rings in
+# the tile, every ring is clipped exactly to its tile box and its segments along the sides of the
+# box are collected per side line (with endpoints snapped to a grid of tol, by default a millionth
+# of the tile size); along each line, the segments are reduced to the intervals they actually
+# cover, counting segments in one direction positive and in the other negative: the two sides of
+# a shared tile edge cutting through a polygon cancel, as do the bridges that clipping a concave
+# ring inserts along a side (which run back and forth over the same interval); the remaining
+# intervals (e.g., at the border of the tiles) and the pieces of the rings between the segments
+# along the sides are joined into rings again at their snapped endpoints; the rings are returned
+# closed (with the first point repeated at the end)
+def stitch_tile_polygons(tile_rings, tol=None):
+  nodes    = {} # snapped point -> point
+  pieces   = [] # pieces of rings between segments along sides, as lists of points
+  coverage = {} # side line -> snapped position along the line -> change of coverage
+  def snap(pt):
+    return (round(pt[0] / tol), round(pt[1] / tol))
+  for tile_box, tile_ring_list in tile_rings.items():
+    if tol is None:
+      tol = (tile_box[1][0] - tile_box[0][0]) * 1e-6
+    for ring in tile_ring_list:
+      # clip the ring and drop repeated points (including a closing point equal to the first one)
+      ring = list(map(tuple, clip_ring_array(ring, tile_box).tolist()))
+      ring = [pt for idx, pt in enumerate(ring) if pt != ring[idx - 1]]
+      if len(ring) < 3:
+        continue
+      # side of the box that each segment runs along (if any)
+      sides = [_box_sides(pt, tile_box, tol) for pt in ring]
+      sides = [min(sides_a & sides_b, default=None) for sides_a, sides_b in zip(sides, sides[1:] + sides[:1])]
+      # rotate the ring such that it starts with a segment along a side
+      start = next((idx for idx, side in enumerate(sides) if side is not None), None)
+      if start is None:
+        yield ring + [ring[0]]
+        continue
+      ring, sides = ring[start:] + ring[:start], sides[start:] + sides[:start]
+      piece       = None
+      for idx, side in enumerate(sides):
+        pt_u, pt_v = ring[idx], ring[(idx + 1) % len(ring)]
+        if side is None:
+          piece = [pt_u] if piece is None else piece
+          piece.append(pt_v)
+          continue
+        if piece is not None:
+          pieces.append(piece)
+          piece = None
+        # the left and right sides are lines of constant x, the top and bottom sides of constant y
+        fixed          = 0 if side < 2 else 1
+        key_u, key_v   = snap(pt_u), snap(pt_v)
+        nodes.setdefault(key_u, pt_u)
+        nodes.setdefault(key_v, pt_v)
+        line           = coverage.setdefault((fixed, key_u[fixed]), {})
+        direction      = 1 if key_u[1 - fixed] < key_v[1 - fixed] else -1
+        pos_lo, pos_hi = sorted((key_u[1 - fixed], key_v[1 - fixed]))
+        line[pos_lo]   = line.get(pos_lo, 0) + direction
+        line[pos_hi]   = line.get(pos_hi, 0) - direction
+      if piece is not None:
+        pieces.append(piece)
+  # directed edges (start node, end node, points, side line or None for pieces of rings): the
+  # pieces, and the intervals between consecutive positions along each line that remain covered
+  edges = [(snap(piece[0]), snap(piece[-1]), piece, None) for piece in pieces]
+  for (fixed, fixed_pos), line in coverage.items():
+    cover     = 0
+    positions = sorted(line)
+    for pos_a, pos_b in zip(positions, positions[1:]):
+      cover += line[pos_a]
+      key_a  = (fixed_pos, pos_a) if fixed == 0 else (pos_a, fixed_pos)
+      key_b  = (fixed_pos, pos_b) if fixed == 0 else (pos_b, fixed_pos)
+      if cover < 0:
+        key_a, key_b = key_b, key_a
+      edges.extend([(key_a, key_b, [nodes[key_a], nodes[key_b]], (fixed, fixed_pos))] * abs(cover))
+  # join the edges into rings; every node has as many outgoing as incoming edges, hence following
+  # unused edges from the end of an edge leads back to its start; consecutive edges along the same
+  # side line are merged
+  outgoing = {}
+  for idx in reversed(range(len(edges))):
+    outgoing.setdefault(edges[idx][0], []).append(idx)
+  used = [False] * len(edges)
+  for first in range(len(edges)):
+    if used[first]:
+      continue
+    used[first] = True
+    ring, last  = list(edges[first][2][:-1]), first
+    node        = edges[first][1]
+    while node != edges[first][0]:
+      candidates = outgoing.get(node, [])
+      while len(candidates) > 0 and used[candidates[-1]]:
+        candidates.pop()
+      if len(candidates) == 0: # not closed (e.g., due to points snapped together)
+        break
+      idx       = candidates.pop()
+      used[idx] = True
+      pts       = edges[idx][2][:-1]
+      if edges[idx][3] is not None and edges[idx][3] == edges[last][3]:
+        pts = pts[1:]
+      ring.extend(pts)
+      node, last = edges[idx][1], idx
+    if edges[first][3] is not None and edges[first][3] == edges[last][3] and first != last:
+      ring = ring[1:]
+    if len(set(ring)) >= 3:
+      yield ring + [ring[0]]
+
+
+# index of the point farthest from the segment between the start and end point of each range of
+# points (only ranges with at least one point in between); returns the indices and distances
+def _farthest_points(points, starts, ends):
+  counts = ends - starts - 1
+  idx    = np.repeat(starts + 1, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+  rng    = np.repeat(np.arange(len(starts)), counts)
+  seg_a  = points[starts[rng]]
+  seg_d  = points[ends[rng]] - seg_a
+  rel    = points[idx] - seg_a
+  length = np.einsum('ij,ij->i', seg_d, seg_d)
+  t      = np.clip(np.einsum('ij,ij->i', rel, seg_d) / np.where(length > 0., length, 1.), 0., 1.)
+  dist   = np.hypot(*(rel - t[:, None] * seg_d).T)
+  # the first point with the largest distance of each range
+  first  = np.cumsum(counts) - counts
+  dmax   = np.maximum.reduceat(dist, first) if len(dist) > 0 else dist
+  hit    = np.flatnonzero(dist == dmax[rng])
+  hit    = hit[np.unique(rng[hit], return_index=True)[1]]
+  return idx[hit], dmax
+
+
+# Douglas-Peucker over the ranges between the given kept points, processing all ranges of all
+# shapes at once and splitting one level of ranges per iteration
+def _douglas_peucker(points, keep, starts, ends, tolerance):
+  while len(starts) > 0:
+    inner         = ends - starts > 1
+    starts, ends  = starts[inner], ends[inner]
+    if len(starts) == 0:
+      break
+    mid, dist     = _farthest_points(points, starts, ends)
+    split         = dist > tolerance
+    keep[mid[split]] = True
+    starts, ends  = np.concatenate([starts[split], mid[split]]), np.concatenate([mid[split], ends[split]])
+
+
+# Visvalingam-Whyatt in rounds: in each round all points whose triangle with their neighbours has an
+# area below the threshold and smaller than that of their neighbours are removed at once (a point
+# and its neighbour are never removed in the same round, hence the links stay consistent)
+def _visvalingam(points, keep, pred, succ, max_area):
+  alive = np.flatnonzero((pred >= 0) & (succ >= 0))
+  while len(alive) > 0:
+    pt_p, pt, pt_n = points[pred[alive]], points[alive], points[succ[alive]]
+    area     = np.abs((pt_p[:, 0] - pt[:, 0]) * (pt_n[:, 1] - pt[:, 1]) - (pt_n[:, 0] - pt[:, 0]) * (pt_p[:, 1] - pt[:, 1])) / 2.
+    rank     = np.full(len(points), np.inf)
+    rank[alive] = area
+    # ties are broken by the index of the point
+    smaller  = lambda other: (area < rank[other]) | ((area == rank[other]) & (alive < other))
+    remove   = alive[(area < max_area) & smaller(pred[alive]) & smaller(succ[alive])]
+    if len(remove) == 0:
+      break
+    keep[remove]       = False
+    succ[pred[remove]] = succ[remove]
+    pred[succ[remove]] = pred[remove]
+    alive    = alive[keep[alive]]
+
+
+# segments (as pairs of point indices) that properly cross another segment
+def _crossing_segments(points, seg_a, seg_b):
+  pt_a, pt_b = points[seg_a], points[seg_b]
+  boxes      = np.concatenate([np.minimum(pt_a, pt_b), np.maximum(pt_a, pt_b)], axis=1)
+  pairs      = STRTree(boxes).overlapping_pairs()
+  if len(pairs) == 0:
+    return np.zeros(0, dtype=np.int64)
+  p1, p2, p3, p4 = pt_a[pairs[:, 0]], pt_b[pairs[:, 0]], pt_a[pairs[:, 1]], pt_b[pairs[:, 1]]
+  orient = lambda a, b, c: np.sign((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0]))
+  cross  = (orient(p3, p4, p1) * orient(p3, p4, p2) < 0) & (orient(p1, p2, p3) * orient(p1, p2, p4) < 0)
+  return np.unique(pairs[cross])
+
+
+# simplify shapes with a tolerance in map units, either by Douglas-Peucker or by Visvalingam-Whyatt
+# (removing points spanning a triangle smaller than the tolerance squared); the first and last
+# point of each shape are kept; rings additionally keep at least three points and are refined
+# (by splitting the simplified segments at their farthest original point) until no simplified
+# segment crosses another one of any ring, such that rings neither self-intersect nor cross each
+# other unless the original rings do; shapes is a list of shapes or a shape store (see
+# shape_store.ShapeStore), the result is of the same kind
+def simplify_shapes(shapes, tolerance, method='douglas_peucker', rings=False):
+  store   = shapes if isinstance(shapes, ShapeStore) else ShapeStore.from_shapes(shapes)
+  points  = store.coords.astype(np.float64, copy=False)
+  lengths = store.lengths
+  opened  = np.zeros(0, dtype=np.int64)
+  if rings:
+    # rings are simplified as closed lines, a closing point is appended to rings that are not closed
+    opened  = np.flatnonzero(~store.closed() & (lengths > 0) | (lengths == 1))
+    points  = np.insert(points, store.offsets[opened + 1], points[store.offsets[opened]], axis=0)
+    lengths = lengths + np.isin(np.arange(len(lengths)), opened)
+  if lengths.sum() == 0:
+    return shapes if isinstance(shapes, ShapeStore) else [[] for _ in shapes]
+  firsts  = np.cumsum(lengths) - lengths
+  lasts   = firsts + lengths - 1
+  nonzero = lengths > 0
+  keep    = np.zeros(len(points), dtype=bool)
+  keep[firsts[nonzero]] = True
+  keep[lasts[nonzero]]  = True
+  if method == 'visvalingam':
+    keep[:] = True
+    pred    = np.arange(len(points)) - 1
+    succ    = np.arange(len(points)) + 1
+    pred[firsts[nonzero]] = -1
+    succ[lasts[nonzero]]  = -1
+    _visvalingam(points, keep, pred, succ, tolerance**2)
+  else:
+    _douglas_peucker(points, keep, firsts[nonzero], lasts[nonzero], tolerance)
+  if rings:
+    ring_of = np.repeat(np.arange(len(lengths)), lengths)
+    while True:
+      kept         = np.flatnonzero(keep)
+      seg_a, seg_b = kept[:-1], kept[1:]
+      within       = ring_of[seg_a] == ring_of[seg_b]
+      seg_a, seg_b = seg_a[within], seg_b[within]
+      # segments of rings with fewer than three distinct points and segments crossing others are
+      # split (if they are not original segments)
+      small        = np.bincount(ring_of[kept], minlength=len(lengths)) < 4
+      refine       = np.zeros(len(seg_a), dtype=bool)
+      refine[small[ring_of[seg_a]]] = True
+      refine[_crossing_segments(points, seg_a, seg_b)] = True
+      refine      &= seg_b - seg_a > 1
+      if not np.any(refine):
+        break
+      keep[_farthest_points(points, seg_a[refine], seg_b[refine])[0]] = True
+  # the closing points appended to rings are removed again
+  keep[lasts[opened]] = False
+  kept_lengths = np.bincount(np.repeat(np.arange(len(lengths)), lengths)[keep], minlength=len(lengths))
+  if isinstance(shapes, ShapeStore):
+    return store.with_coords(points[keep], kept_lengths)
+  coords = list(map(tuple, points[keep].tolist()))
+  ends   = np.cumsum(kept_lengths).tolist()
+  return [coords[end - length:end] for end, length in zip(ends, kept_lengths.tolist())]
+
+
+# smooth shapes with an FIR filter (the coefficients are applied to the points centered around each
+# point); all shapes are filtered at once by gathering the points of each shape together with its
+# padding into one array; rings are padded circularly, whereas the first and last points of lines
+# that the filter cannot be centered on are kept as they are; shapes that are not longer than the
+# filter are not changed; shapes is a list of shapes or a shape store, the result is of the same kind
+def fir_filter_shapes(shapes, coefficients, rings=False):
+  store   = shapes if isinstance(shapes, ShapeStore) else ShapeStore.from_shapes(shapes)
+  coeff   = np.asarray(coefficients, dtype=np.float64)
+  order   = len(coeff)
+  half    = order // 2
+  lead    = (order - 1) // 2 # points before the center of the filter
+  closed  = rings & store.closed() & (store.lengths > 1)
+  # number of distinct points of each shape (the closing point of a ring is restored afterwards)
+  lengths = store.lengths - closed
+  active  = np.flatnonzero(lengths > order)
+  if len(active) == 0:
+    return shapes if isinstance(shapes, ShapeStore) else list(shapes)
+  counts  = lengths[active]
+  firsts  = np.cumsum(counts) - counts
+  # positions of the distinct points of the active shapes in the coordinates of the store
+  src_pos = np.repeat(store.offsets[active] - firsts, counts) + np.arange(counts.sum())
+  points  = store.coords[src_pos].astype(np.float64)
+  # indices into points of the padded shapes, from lead points before the first point to
+  # order - 1 - lead points after the last point
+  padded  = counts + order - 1
+  shape_of = np.repeat(np.arange(len(active)), padded)
+  offset  = np.arange(padded.sum()) - np.repeat(np.cumsum(padded) - padded, padded) - lead
+  if rings:
+    offset %= counts[shape_of]
+  else:
+    offset = np.clip(offset, 0, counts[shape_of] - 1)
+  gathered = points[firsts[shape_of] + offset]
+  # position of each output point in the padded array
+  out_pos = np.repeat(np.cumsum(padded) - padded, counts) + np.arange(counts.sum()) - np.repeat(firsts, counts)
+  result  = np.zeros((len(out_pos), 2))
+  for idx, fval in enumerate(coeff.tolist()):
+    result += fval * gathered[out_pos + idx]
+  if not rings:
+    # keep the ends of lines (half the filter length at either end)
+    pos_in_shape = np.arange(counts.sum()) - np.repeat(firsts, counts)
+    ends         = (pos_in_shape < half) | (pos_in_shape >= np.repeat(counts, counts) - half)
+    result[ends] = points[ends]
+  if isinstance(shapes, ShapeStore):
+    coords          = store.coords.astype(np.float64)
+    coords[src_pos] = result
+    # closing points of rings
+    rings_closed    = active[closed[active]]
+    coords[store.offsets[rings_closed + 1] - 1] = coords[store.offsets[rings_closed]]
+    return store.with_coords(coords, store.lengths)
+  filtered = list(shapes)
+  closed   = closed.tolist()
+  for idx, first, count in zip(active.tolist(), firsts.tolist(), counts.tolist()):
+    shape = list(map(tuple, result[first:first + count].tolist()))
+    if closed[idx]:
+      shape.append(shape[0])
+    filtered[idx] = shape
+  return filtered
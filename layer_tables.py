@@ -0,0 +1,61 @@
+from collections.abc import Mapping
+
+_UNDECODED = object()
+
+# key and value tables of a tile layer; the key index is built once per layer and values are
+# decoded on first access only, such that each value is decoded at most once per layer
+class LayerTable:
+    def __init__(self, layer):
+        self.layer   = layer
+        self.keys    = layer.keys
+        self.key_idx = {key: idx for idx, key in enumerate(layer.keys)}
+        self.values  = [_UNDECODED] * len(layer.values)
+
+    def value(self, idx):
+        val = self.values[idx]
+        if val is _UNDECODED:
+            val = self.values[idx] = self.layer.values[idx].ListFields()[0][1]
+        return val
+
+    # lazy tags of a feature of this layer
+    def tags(self, feature):
+        return FeatureTags(self, feature.tags)
+
+
+# read-only mapping from tag names to tag values of a feature; the pairs of key and value indices
+# are only collected when the first tag is read, and values are only decoded when they are read
+class FeatureTags(Mapping):
+    __slots__ = ('table', 'raw', 'itags')
+
+    def __init__(self, table, raw):
+        self.table = table
+        self.raw   = raw  # flat list of key and value indices
+        self.itags = None # key indices mapped to value indices
+
+    def indices(self):
+        if self.itags is None:
+            self.itags = dict(zip(self.raw[::2], self.raw[1::2]))
+        return self.itags
+
+    def __getitem__(self, key):
+        key_idx = self.table.key_idx.get(key)
+        if key_idx is None or key_idx not in self.indices():
+            raise KeyError(key)
+        return self.table.value(self.itags[key_idx])
+
+    def __contains__(self, key):
+        key_idx = self.table.key_idx.get(key)
+        return key_idx is not None and key_idx in self.indices()
+
+    def __iter__(self):
+        return (self.table.keys[key_idx] for key_idx in self.indices())
+
+    def __len__(self):
+        return len(self.indices())
+
+    # decode all tags into a regular dictionary
+    def materialize(self):
+        return {self.table.keys[key_idx]: self.table.value(val_idx) for key_idx, val_idx in self.indices().items()}
+
+    def __repr__(self):
+        return repr(self.materialize())
@@ -1,131 +1,421 @@
+import os
 import json
 import math
+import time
+import cProfile
+import contextlib
+import tracemalloc
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 import tilemap
-from geometry_utils import convex_hull, dissolve_lines, polygonize_clipped_lines
-
-map_config = None
-with open('map_config.json') as cfg:
-  map_config = json.load(cfg)
-
-viewport = (
-  (map_config['viewport'][0], map_config['viewport'][1]),
-  (map_config['viewport'][2], map_config['viewport'][3])
-)
-
-svg_scale = 1 / 1000
-svg_size  = (
-  (viewport[1][0] - viewport[0][0]) * svg_scale,
-  (viewport[1][1] - viewport[0][1]) * svg_scale
-)
-
-with open('test.svg', 'w') as svg:
-  svg.write(f"<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"no\"?>\n")
-
-  svg_attr = ' '.join(f"{key}=\"{val}\"" for key, val in map_config.get('attributes', {}).items())
-  svg.write(f"<svg width=\"{svg_size[0]}\" height=\"{svg_size[1]}\" xmlns=\"http://www.w3.org/2000/svg\" {svg_attr}>\n")
-
-  for src in map_config['sources']:
-    print(f"Data source: {src['url']}")
-    tmap    = tilemap.VectorTileMap(src['url'])
-    filters = {}
-    for grp in src['groups']:
-      filters[grp['layer']] = filters.get(grp['layer'], set()) | set([(flt[0], flt[1], flt[2]) for flt in grp['filters']])
-    for layer in filters:
-      if len(filters[layer]) == 0:
-        filters[layer] = None
-
-    # query shapes and store those of same type, layer, and with same tags in one list
-    shapes = {}
-    for shape_type, coords, layer_name, tags, tile_box in tmap.query_shapes(src['zoom'], viewport, filters):
-      shape_class = (shape_type, layer_name, tuple(tags.items()))
-      shapes[shape_class] = shapes.get(shape_class, []) + [(coords, tile_box)]
-
-    for shape_class in shapes:
-      shape_type, layer_name, tags = shape_class
-      print(f"  - shapes of type {shape_type} from layer {layer_name} with tags {dict(tags)}: {len(shapes[shape_class])} of which {sum(1 for coords, _ in shapes[shape_class] if coords[0] == coords[-1])} are closed")
-
-    for grp in src['groups']:
-      grp_attr = ' '.join(f"{key}=\"{val}\"" for key, val in grp.get('attributes', {}).items())
-      svg.write(f"  <g {grp_attr}>\n")
-
-      for shape_class in shapes:
-        if shape_class[1] == grp['layer']:
-          tags    = dict(shape_class[2])
-          filters = grp['filters']
-          if len(filters) == 0:
-            filters = [('==', 0, 0)] # dummy filter in case no filters are used
-          for flt in filters:
-            op, val1, val2 = flt[0], flt[1], flt[2]
-            if val1 in tags:
-              val1 = tags[val1]
-            if val2 in tags:
-              val2 = tags[val2]
-            if eval(f"{val1} {op} {val2}"):
-              if 'polygonize' in grp.get('processing', {}):
-                args = grp['processing']['polygonize']
-                tile_shapes = {}
-                for coords, tile_box in shapes[shape_class]:
-                  tile_shapes[tile_box] = tile_shapes.get(tile_box, []) + [coords]
-                shapes[shape_class] = [
-                  (coords, tile_box)
-                  for tile_box, shapes in tile_shapes.items()
-                  for coords in polygonize_clipped_lines(shapes, tile_box, args.get("corner_outset", 1.))
-                ]
-                #shapes[shape_class] = [(polygonize_clipped_lines(coords, tile_box, args.get("corner_margin", 1.)), tile_box) for coords, tile_box in shapes[shape_class]]
-
-              shape_list = [coords for coords, _ in shapes[shape_class]]
-
-              for proc, args in grp.get('processing', {}).items():
-
-                if proc == 'dissolve_lines' and shape_class[0] == 2:
-                  shape_list = dissolve_lines(shape_list)
-
-                if proc == 'remove_small_shapes' and shape_class[0] in (2, 3):
-                  large_shapes = []
-                  for shape in shape_list:
-                    hull = convex_hull(shape)
-                    # a shape is considered small if its mean width (the perimter of its convex hull divided by pi) is below a threshold
-                    if sum(
-                      math.sqrt((x1 - x0)**2 + (y1 - y0)**2) for (x0, y0), (x1, y1) in zip(hull, hull[1:] + hull[:1])
-                    ) / math.pi >= args.get("mean_width", 1000.):
-                      large_shapes.append(shape)
-                  shape_list = large_shapes
-
-                if proc == 'coord_fir_filter' and shape_class[0] in (2, 3):
-                  coeff           = args['coefficients']
-                  filter_order    = len(coeff)
-                  filtered_shapes = []
-                  for shape in shape_list:
-                    if len(shape) > filter_order:
-                      filtered_shape = []
-                      # last point is skipped for feature type 2 because it is assumed to be equal to first point
-                      window_x       = [x for x, y in (shape[-filter_order:] if shape_class[0] == 3 else shape[-filter_order-1:-1])]
-                      window_y       = [y for x, y in (shape[-filter_order:] if shape_class[0] == 3 else shape[-filter_order-1:-1])]
-                      for next_pt in shape:
-                        window_x.pop(0)
-                        window_y.pop(0)
-                        window_x.append(next_pt[0])
-                        window_y.append(next_pt[1])
-                        filtered_shape.append((
-                          sum(x * fval for x, fval in zip(window_x, coeff)),
-                          sum(y * fval for y, fval in zip(window_y, coeff))
-                        ))
-                      # rotate points of filtered shape back into position for lines (for polygons it does not matter)
-                      if shape_class[0] == 2:
-                        end_len = filter_order // 2
-                        filtered_shape = shape[0:end_len] + filtered_shape[2*end_len:] + shape[-end_len:]
-                        assert len(filtered_shape) == len(shape)
-                    else:
-                      filtered_shape = shape
-                    filtered_shapes.append(filtered_shape)
-
-              for shape in shape_list:
-                coords = [f"{(x - viewport[0][0]) * svg_scale:.3f} {(y - viewport[0][1]) * svg_scale:.3f}" for x, y in shape]
-                if shape_class[0] == 2:
-                  svg.write(f"    <path d=\"M {' L '.join(coords)}\" style=\"fill:none;stroke:{grp['colour']}\" />\n")
-                if shape_class[0] == 3:
-                  svg.write(f"    <path d=\"M {' L '.join(coords)} Z\" style=\"fill:{grp['colour']};stroke:none\" />\n")
-
-      svg.write(f"  </g>\n")
-
-  svg.write("</svg>\n")
+from tile_cache import TileCache, DEFAULT_MAX_AGE
+from stage_cache import StageCache
+from request_scheduler import RequestScheduler
+from feature_filters import FeatureFilter, freeze_filter
+from parallel import maybe_parallel_map
+from shape_processing import process_shape_class
+from shape_store import ShapeStore
+from svg_writer import SvgWriter
+import metrics
+
+# record metrics of the run (see metrics) and write them as a json report next to the svg (unless
+# "report" is false in the config); "profile" names a file for cProfile statistics of the run and
+# with "trace_memory" the peak memory allocated by python is traced for each stage
+@contextlib.contextmanager
+def instrumented(map_config, output):
+  profiler = cProfile.Profile() if 'profile' in map_config else None
+  if map_config.get('trace_memory', False):
+    tracemalloc.start()
+  started = time.time()
+  with metrics.collect() as run_metrics:
+    if profiler is not None:
+      profiler.enable()
+    try:
+      with run_metrics.stage('run'):
+        yield run_metrics
+    finally:
+      if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(map_config['profile'])
+      if tracemalloc.is_tracing():
+        tracemalloc.stop()
+  if map_config.get('report', True):
+    report = {
+      'created': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(started)),
+      'output' : output,
+      'config' : map_config,
+      'seconds': time.time() - started,
+      # of the main process, worker processes are not included
+      'peak_rss_bytes': metrics.peak_rss_bytes(),
+      **run_metrics.report()
+    }
+    with open(os.path.splitext(output)[0] + '.report.json', 'w') as out:
+      json.dump(report, out, indent=2)
+
+
+# shape class from its json representation (type, layer, tags as list of pairs, ...)
+def _shape_class(entry):
+  return (entry[0], entry[1], tuple(tuple(tag) for tag in entry[2]))
+
+
+# decode the tiles of a zoom level in the view port (in tile order, such that the result does not
+# depend on which tile is fetched or decoded first) and collect the shapes of same type, layer, and
+# with same tags in one shape store (see shape_store.ShapeStore) per shape class; the time spent
+# fetching is excluded from the decode stage; tiles that could not be fetched are appended to
+# unresolved (see VectorTileMap.query_tiles)
+def decode_shapes(run_metrics, pool, processes, tmap, zoom, viewport, filters, clip_box, dtype, unresolved=None):
+  shapes = {}
+  tiles  = run_metrics.timed_iter('fetch', tmap.query_tiles(zoom, viewport, ordered=True, unresolved=unresolved))
+  for decoded, decode_report in run_metrics.timed_iter('decode', maybe_parallel_map(
+    pool, tilemap.decode_tile_with_metrics,
+    ((content, tile_box, tile_size, filters, clip_box, dtype) for content, tile_box, tile_size in tiles),
+    window=2 * processes
+  )):
+    run_metrics.merge(decode_report)
+    for shape_class, indices in decoded.shape_classes().items():
+      store = shapes.get(shape_class)
+      if store is None:
+        store = shapes[shape_class] = ShapeStore(dtype)
+      store.extend(decoded.subset(indices))
+  return shapes
+
+
+# store decoded shapes in the stage cache, one bucket per shape class and tile
+def store_decoded(stage_cache, key, resolution, shapes, class_cnts):
+  classes    = list(shapes)
+  tile_boxes = list(dict.fromkeys(tile_box for shape_class in classes for tile_box in shapes[shape_class].tile_boxes))
+  tile_idx   = {tile_box: idx for idx, tile_box in enumerate(tile_boxes)}
+  buckets    = [
+    (cls_idx, tile_idx[tile_box], bucket)
+    for cls_idx, shape_class in enumerate(classes) for tile_box, bucket in shapes[shape_class].tile_buckets().items()
+  ]
+  stage_cache.put(key, {
+    'resolution': resolution,
+    'classes'   : [[*shape_class, *class_cnts[shape_class]] for shape_class in classes],
+    'tile_boxes': tile_boxes,
+    'buckets'   : [[cls_idx, tile] for cls_idx, tile, _ in buckets]
+  }, [bucket for _, _, bucket in buckets])
+
+
+def load_decoded(stage_cache, key):
+  meta, buckets = stage_cache.get(key)
+  if meta is None:
+    raise RuntimeError(f"decoded shapes {key} vanished from the stage cache")
+  classes    = [_shape_class(entry) for entry in meta['classes']]
+  tile_boxes = [tuple(map(tuple, tile_box)) for tile_box in meta['tile_boxes']]
+  shapes     = {}
+  for (cls_idx, tile), bucket in zip(meta['buckets'], buckets):
+    shapes.setdefault(classes[cls_idx], {})[tile_boxes[tile]] = bucket
+  return shapes
+
+
+# caches, request scheduler, and tile maps (see tile_map) of a configuration, shared by all renders
+# of a process; worker processes set up their own (connections must not be shared with the parent)
+_resources = {}
+
+def resources(map_config):
+  key = (os.getpid(), json.dumps([map_config.get(name) for name in ('cache', 'stage_cache', 'requests')], sort_keys=True))
+  if key not in _resources:
+    # optional persistent tile cache, e.g. "cache": {"path": "tile_cache", "offline": false}
+    tile_cache = None
+    if 'cache' in map_config:
+      tile_cache = TileCache(**map_config['cache'])
+
+    # optional cache of decoded and processed shapes, e.g. "stage_cache": {"path": "stage_cache"};
+    # a run that only changes the styling (colours and attributes) or the precision of the svg
+    # merely formats the cached shapes again; unless configured otherwise, its entries expire like
+    # those of the tile cache (cached shapes do not notice when the tiles change upstream), except in
+    # offline mode, where the tiles cannot change
+    stage_cache = None
+    if 'stage_cache' in map_config:
+      max_age     = DEFAULT_MAX_AGE if tile_cache is None else None if tile_cache.offline else tile_cache.max_age
+      stage_cache = StageCache(**{'max_age': max_age, **map_config['stage_cache']})
+
+    # optional settings of the request scheduler shared by all sources (rate limit per host,
+    # backoff, retry budget, and timeout), e.g. "requests": {"rate": 20, "max_retries": 5, "timeout": 10}
+    scheduler = RequestScheduler(**map_config.get('requests', {}))
+    _resources[key] = (tile_cache, stage_cache, scheduler, {})
+  return _resources[key]
+
+
+# close the tile maps of this process (their sessions and local tile sources)
+def close_resources():
+  for key in [key for key in _resources if key[0] == os.getpid()]:
+    for tmap in _resources.pop(key)[3].values():
+      tmap.close()
+
+
+# tile map of a source, loaded once per process (such that the tile index and the style are not
+# fetched again for each render)
+def tile_map(map_config, url):
+  tile_cache, _, scheduler, tile_maps = resources(map_config)
+  if url not in tile_maps:
+    tile_maps[url] = tilemap.VectorTileMap(url, cache=tile_cache, scheduler=scheduler)
+  return tile_maps[url]
+
+
+# render the view port into an svg, with svg_scale svg units per map unit; the sources are rendered
+# at their configured zoom levels unless zooms lists the zoom level of each source
+def render(map_config, viewport, svg_scale, output, run_metrics, pool=None, processes=0, zooms=None):
+  _, stage_cache, _, _ = resources(map_config)
+
+  # decoded shapes are kept in compact shape stores with coordinates of type float64, or float32
+  # (with "coordinates": "float32") to halve their memory at the cost of precision
+  dtype = np.dtype(map_config.get('coordinates', 'float64'))
+
+  svg_size  = (
+    (viewport[1][0] - viewport[0][0]) * svg_scale,
+    (viewport[1][1] - viewport[0][1]) * svg_scale
+  )
+
+  # shapes are clipped to the view port right after decoding, with a margin of one svg unit such
+  # that the clipped ends of lines are not visible (unless "clip" is false)
+  clip_box = None
+  if map_config.get('clip', True):
+    clip_box = (
+      (viewport[0][0] - 1 / svg_scale, viewport[0][1] - 1 / svg_scale),
+      (viewport[1][0] + 1 / svg_scale, viewport[1][1] + 1 / svg_scale)
+    )
+
+  # the svg is written while rendering, it is gzip-compressed if the output file ends in .svgz
+  with SvgWriter(output, svg_size, map_config.get('attributes')) as svg:
+    for src_idx, src in enumerate(map_config['sources']):
+      print(f"Data source: {src['url']}")
+      filters = {}
+      for grp in src['groups']:
+        filters[grp['layer']] = filters.get(grp['layer'], set()) | set([freeze_filter(flt) for flt in grp['filters']])
+      for layer in filters:
+        if len(filters[layer]) == 0:
+          filters[layer] = None
+
+      # decoded shapes are cached per source, zoom level, view port, layer filters, and coordinate
+      # type; when they are cached, they are only loaded if some shape class of a group needs to be
+      # processed
+      zoom       = src['zoom'] if zooms is None else zooms[src_idx]
+      decode_key = StageCache.fingerprint('decode', src['url'], zoom, viewport, clip_box, dtype.name, {
+        layer: None if flts is None else sorted(map(repr, flts)) for layer, flts in filters.items()
+      })
+      decode_meta = stage_cache.get_meta(decode_key) if stage_cache is not None else None
+      src_cache   = stage_cache
+      if decode_meta is not None:
+        resolution = decode_meta['resolution']
+        shapes     = {}
+        class_cnts = {_shape_class(entry): entry[3:] for entry in decode_meta['classes']}
+      else:
+        with run_metrics.stage('index'):
+          tmap  = tile_map(map_config, src['url'])
+        # size of a unit of the tile grid (assuming the usual tile extent of 4096)
+        resolution = next(size for level, size in tmap.lods if level == zoom) / 4096
+        unresolved = []
+        shapes     = decode_shapes(run_metrics, pool, processes, tmap, zoom, viewport, filters, clip_box, dtype, unresolved)
+        class_cnts = {shape_class: (len(store), int(store.closed().sum())) for shape_class, store in shapes.items()}
+        run_metrics.count('shape_store_bytes', sum(store.nbytes for store in shapes.values()))
+        # incomplete decoded shapes (e.g., with tiles missing from the cache in offline mode) and
+        # the shapes processed from them must not be reused by later runs
+        if len(unresolved) > 0:
+          print(f"  {len(unresolved)} tiles are not available, the map is incomplete")
+          run_metrics.count('tiles_unresolved', len(unresolved))
+          src_cache = None
+        elif stage_cache is not None:
+          with run_metrics.stage('store_decoded'):
+            store_decoded(stage_cache, decode_key, resolution, shapes, class_cnts)
+      # number of decimals of the svg coordinates; unless configured, just enough to resolve the
+      # tile grid
+      precision = map_config.get('precision', max(0, math.ceil(-math.log10(resolution * svg_scale))))
+
+      for shape_class, (shape_cnt, closed_cnt) in class_cnts.items():
+        shape_type, layer_name, tags = shape_class
+        print(f"  - shapes of type {shape_type} from layer {layer_name} with tags {dict(tags)}: {shape_cnt} of which {closed_cnt} are closed")
+
+      # shape classes of each group, and the last group using each class (after which the shapes
+      # of that class are released)
+      grp_classes = []
+      last_use    = {}
+      for grp_idx, grp in enumerate(src['groups']):
+        grp_filter = FeatureFilter(grp['filters'])
+        grp_classes.append([
+          shape_class for shape_class in class_cnts
+          if shape_class[1] == grp['layer'] and grp_filter(dict(shape_class[2]), shape_class[0])
+        ])
+        last_use.update((shape_class, grp_idx) for shape_class in grp_classes[-1])
+      for shape_class in [shape_class for shape_class in shapes if shape_class not in last_use]:
+        del shapes[shape_class]
+
+      # key of the input of each shape class; polygonizing replaces the input of later groups
+      input_keys = {shape_class: StageCache.fingerprint(decode_key, shape_class) for shape_class in last_use}
+      loaded     = decode_meta is None
+
+      for grp_idx, grp in enumerate(src['groups']):
+        # the shape classes of a group are processed independently of each other (in parallel if
+        # worker processes are used), the results are written in the order of the shape classes;
+        # shape classes whose processed shapes are cached are not processed again (the order of the
+        # processing steps matters, hence they are fingerprinted as a list)
+        classes    = grp_classes[grp_idx]
+        processing = grp.get('processing', {})
+        proc_keys  = {
+          shape_class: StageCache.fingerprint(
+            'process', input_keys[shape_class], shape_class, list(processing.items()), viewport, svg_scale, resolution, clip_box is not None
+          )
+          for shape_class in classes
+        }
+        cached = set()
+        if src_cache is not None:
+          cached = set(shape_class for shape_class in classes if src_cache.contains(proc_keys[shape_class]))
+          if not loaded and len(cached) < len(classes):
+            with run_metrics.stage('load_decoded'):
+              for shape_class, tile_shapes in load_decoded(src_cache, decode_key).items():
+                if last_use.get(shape_class, -1) >= grp_idx and shape_class not in shapes:
+                  shapes[shape_class] = tile_shapes
+            loaded = True
+          run_metrics.count('stage_cache_hits', len(cached))
+        results = maybe_parallel_map(pool, process_shape_class, (
+          (
+            shape_class[0], None if shape_class in cached else shapes[shape_class], processing, grp.get('colour'),
+            viewport, svg_scale, precision, resolution, clip_box is not None, src_cache, proc_keys[shape_class]
+          )
+          for shape_class in classes
+        ), window=len(classes))
+        if 'polygonize' in processing:
+          input_keys.update((shape_class, proc_keys[shape_class]) for shape_class in classes)
+        def group_paths():
+          for shape_class, (polygonized, paths, class_report) in zip(classes, run_metrics.timed_iter('process', results)):
+            run_metrics.merge(class_report)
+            if last_use[shape_class] == grp_idx:
+              shapes.pop(shape_class, None)
+            # polygonized shapes replace the original shapes of the class
+            elif polygonized is not None:
+              shapes[shape_class] = polygonized
+            yield paths
+        # the time spent processing is excluded from the write stage
+        with run_metrics.stage('write'):
+          svg.group(grp.get('attributes', {}), group_paths())
+
+
+# render one tile of a pyramid (see render_pyramid), in a worker process when rendering in parallel;
+# returns the output file and the report of the metrics recorded while rendering
+def render_pyramid_tile(map_config, viewport, svg_scale, output, zooms):
+  os.makedirs(os.path.dirname(output), exist_ok=True)
+  with metrics.collect() as collector:
+    render(map_config, viewport, svg_scale, output, collector, zooms=zooms)
+  return output, collector.report()
+
+
+# render the view port as a pyramid of svg tiles for several levels of detail, e.g. "pyramid":
+# {"path": "pyramid", "levels": [2, 3, 4], "tile_depth": 2, "tile_size": 1024}; the output tiles
+# follow the tile grid of the first source, a tile of a level covers 2**tile_depth by 2**tile_depth
+# source tiles of the zoom level given by the level and is tile_size svg units wide; the sources
+# are rendered at their configured zoom levels for the highest level and at correspondingly lower
+# zoom levels (as far as available) for the lower levels; each output tile is rendered
+# independently (in parallel if worker processes are used) from the source tiles it overlaps and
+# written to {path}/{level}/{x}/{y}.svg; a manifest ({path}/manifest.json) lists the tiles of each
+# level with their extents and a fingerprint of their inputs; tiles whose fingerprint did not
+# change since the last run are not rendered again, nor are tiles outside the optional "region"
+# ([x0, y0, x1, y1]), such that only changed regions need to be rendered again
+def render_pyramid(map_config, viewport, run_metrics, pool=None):
+  pyramid   = map_config['pyramid']
+  path      = pyramid.get('path', 'pyramid')
+  depth     = pyramid.get('tile_depth', 2)
+  tile_size = pyramid.get('tile_size', 1024)
+  suffix    = pyramid.get('format', 'svg')
+  sources   = map_config['sources']
+  levels    = sorted(pyramid.get('levels', [sources[0]['zoom']]))
+  region    = pyramid.get('region')
+  with run_metrics.stage('index'):
+    tmaps = [tile_map(map_config, src['url']) for src in sources]
+  grid      = tmaps[0]
+
+  # inputs of a tile besides its position (everything that affects the svg of a tile)
+  settings  = {name: map_config.get(name) for name in ('sources', 'attributes', 'precision', 'clip', 'coordinates')}
+  manifest_file = os.path.join(path, 'manifest.json')
+  previous  = {}
+  if os.path.exists(manifest_file):
+    with open(manifest_file) as f:
+      previous = {tile['file']: tile for level in json.load(f)['levels'] for tile in level['tiles']}
+
+  manifest  = {'viewport': map_config['viewport'], 'origin': list(grid.orig), 'tile_size': tile_size, 'tile_depth': depth, 'levels': []}
+  jobs      = []
+  rendered  = {} # output file -> manifest entry of the tiles to render
+  for level in levels:
+    # zoom level of each source for this level, the sources keep their zoom offsets to each other
+    zooms = []
+    for src, tmap in zip(sources, tmaps):
+      available = [lod[0] for lod in tmap.lods]
+      zooms.append(min(max(src['zoom'] + level - levels[-1], min(available)), max(available)))
+    extent    = next(size for lod_level, size in grid.lods if lod_level == level) * 2**depth
+    svg_scale = tile_size / extent
+    tiles     = []
+    for x in range(math.floor((viewport[0][0] - grid.orig[0]) / extent), math.ceil((viewport[1][0] - grid.orig[0]) / extent)):
+      for y in range(math.floor((viewport[0][1] - grid.orig[1]) / extent), math.ceil((viewport[1][1] - grid.orig[1]) / extent)):
+        box  = ((grid.orig[0] + x * extent, grid.orig[1] + y * extent), (grid.orig[0] + (x + 1) * extent, grid.orig[1] + (y + 1) * extent))
+        tile = {
+          'x'          : x,
+          'y'          : y,
+          'bbox'       : [box[0][0], box[0][1], box[1][0], box[1][1]],
+          'file'       : f"{level}/{x}/{y}.{suffix}",
+          'fingerprint': StageCache.fingerprint('pyramid', settings, level, x, y, zooms, tile_size, depth)
+        }
+        old    = previous.get(tile['file'])
+        output = os.path.join(path, tile['file'])
+        if region is not None and not (region[0] < box[1][0] and region[1] < box[1][1] and region[2] > box[0][0] and region[3] > box[0][1]):
+          # outside of the region to render, the tile is kept as it is (if it exists)
+          if old is not None and os.path.exists(output):
+            tiles.append(old)
+          continue
+        tiles.append(tile)
+        if old is not None and old['fingerprint'] == tile['fingerprint'] and os.path.exists(output):
+          continue
+        jobs.append((map_config, box, svg_scale, output, zooms))
+        rendered[output] = tile
+    manifest['levels'].append({'level': level, 'zooms': zooms, 'tile_extent': extent, 'svg_scale': svg_scale, 'tiles': tiles})
+
+  print(f"Rendering {len(jobs)} pyramid tiles ({sum(len(level['tiles']) for level in manifest['levels']) - len(jobs)} unchanged)")
+  run_metrics.count('pyramid_tiles_rendered', len(jobs))
+  for output, tile_report in run_metrics.timed_iter('render_tile', maybe_parallel_map(pool, render_pyramid_tile, jobs, ordered=False)):
+    run_metrics.merge(tile_report)
+    # incomplete tiles (with source tiles that were not available) are rendered again next time
+    if tile_report['counters'].get('tiles_unresolved', 0) > 0:
+      rendered[output]['fingerprint'] = None
+
+  # the manifest is replaced only once all tiles are written
+  os.makedirs(path, exist_ok=True)
+  tmp_file = manifest_file + '.tmp'
+  with open(tmp_file, 'w') as f:
+    json.dump(manifest, f, indent=2)
+  os.replace(tmp_file, manifest_file)
+
+
+def main():
+  map_config = None
+  with open('map_config.json') as cfg:
+    map_config = json.load(cfg)
+
+  viewport = (
+    (map_config['viewport'][0], map_config['viewport'][1]),
+    (map_config['viewport'][2], map_config['viewport'][3])
+  )
+
+  # optional number of worker processes for decoding tiles and processing shape classes in
+  # parallel (or for rendering the tiles of a pyramid); the output is identical to a serial run
+  processes = map_config.get('processes', 0)
+
+  # either a pyramid of svg tiles (see render_pyramid) or a single svg
+  if 'pyramid' in map_config:
+    output = os.path.join(map_config['pyramid'].get('path', 'pyramid'), 'manifest.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+  else:
+    output = map_config.get('output', 'test.svg')
+
+  try:
+    with instrumented(map_config, output) as run_metrics, (
+      ProcessPoolExecutor(processes) if processes > 0 else contextlib.nullcontext()
+    ) as pool:
+      if 'pyramid' in map_config:
+        render_pyramid(map_config, viewport, run_metrics, pool)
+      else:
+        render(map_config, viewport, 1 / 1000, output, run_metrics, pool, processes)
+  finally:
+    close_resources()
+
+
+if __name__ == '__main__':
+  main()
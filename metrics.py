@@ -0,0 +1,129 @@
+import sys
+import time
+import resource
+import threading
+import tracemalloc
+import contextlib
+
+# counters and per-stage timers of a run; the functions at the end of this module record into the
+# current collector (see collect), such that code deep down (e.g., in tilemap or geometry_utils)
+# can be instrumented without passing a collector around
+class Metrics:
+  def __init__(self):
+    self.lock     = threading.Lock()
+    self.counters = {}
+    self.stages   = {} # name -> calls, seconds (inclusive), self_seconds (without nested stages), memory peaks
+    self.local    = threading.local()
+
+  def count(self, name, value=1):
+    with self.lock:
+      self.counters[name] = self.counters.get(name, 0) + value
+
+  # time a stage; stages may be nested, the time of nested stages is excluded from the self time
+  # of the enclosing stage; the memory of a stage is the growth of the resident set size high-water
+  # mark of the process during the stage (zero unless the stage uses more memory than any stage
+  # before) and, while tracemalloc is tracing, the peak of the traced memory during the stage
+  @contextlib.contextmanager
+  def stage(self, name):
+    stack = getattr(self.local, 'stack', None)
+    if stack is None:
+      stack = self.local.stack = []
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+      if len(stack) > 0:
+        stack[-1][2] = max(stack[-1][2], tracemalloc.get_traced_memory()[1])
+      tracemalloc.reset_peak()
+    frame = [time.perf_counter(), 0., 0, peak_rss_bytes()] # start, time of nested stages, traced peak, rss peak
+    stack.append(frame)
+    try:
+      yield
+    finally:
+      stack.pop()
+      elapsed = time.perf_counter() - frame[0]
+      peak    = max(frame[2], tracemalloc.get_traced_memory()[1]) if tracing else None
+      if len(stack) > 0:
+        stack[-1][1] += elapsed
+        if tracing:
+          stack[-1][2] = max(stack[-1][2], peak)
+          tracemalloc.reset_peak()
+      self.merge({'stages': {name: {
+        'calls'            : 1,
+        'seconds'          : elapsed,
+        'self_seconds'     : elapsed - frame[1],
+        'rss_growth_bytes' : peak_rss_bytes() - frame[3],
+        'peak_traced_bytes': peak
+      }}})
+
+  # yield the items of an iterable, timing the production of each item as a stage
+  def timed_iter(self, name, iterable):
+    iterator = iter(iterable)
+    while True:
+      with self.stage(name):
+        try:
+          item = next(iterator)
+        except StopIteration:
+          return
+      yield item
+
+  # add the counters and stages of a report (see report) to this collector; times and calls are
+  # summed up, memory peaks are maximized
+  def merge(self, report):
+    with self.lock:
+      for name, value in report.get('counters', {}).items():
+        self.counters[name] = self.counters.get(name, 0) + value
+      for name, entry in report.get('stages', {}).items():
+        stage = self.stages.get(name)
+        if stage is None:
+          self.stages[name] = dict(entry)
+          continue
+        for key, value in entry.items():
+          if key.startswith('peak_'):
+            stage[key] = value if stage[key] is None else stage[key] if value is None else max(stage[key], value)
+          else:
+            stage[key] += value
+
+  # counters and stages as a dictionary that can be passed between processes or dumped as json
+  def report(self):
+    with self.lock:
+      return {
+        'counters': dict(sorted(self.counters.items())),
+        'stages'  : {name: dict(stage) for name, stage in self.stages.items()}
+      }
+
+
+# resident set size high-water mark of the process (ru_maxrss is in bytes on macOS and in
+# kilobytes elsewhere)
+def peak_rss_bytes():
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+
+_collectors = [Metrics()]
+
+# the collector that records are currently going to
+def current():
+  return _collectors[-1]
+
+
+# record into a fresh collector within the context (e.g., for sending the records of a call in a
+# worker process back to the main process)
+@contextlib.contextmanager
+def collect():
+  collector = Metrics()
+  _collectors.append(collector)
+  try:
+    yield collector
+  finally:
+    _collectors.remove(collector)
+
+
+def count(name, value=1):
+  current().count(name, value)
+
+
+def stage(name):
+  return current().stage(name)
+
+
+def timed_iter(name, iterable):
+  return current().timed_iter(name, iterable)
@@ -0,0 +1,105 @@
+import json
+import random
+import threading
+import time
+import http.server
+from functools import lru_cache
+import bench_fixtures
+
+# local stand-in for a vector tile server, serving synthetic tiles (see bench_fixtures) with a
+# TileJSON index at /index.json and tiles at /tile/{z}/{y}/{x}.pbf; each response is delayed by
+# latency seconds and a share of the tile requests (error_rate) fails with a 429 (with a
+# Retry-After header) or 5xx status; the failures are drawn from a seeded generator
+class MockTileServer:
+  def __init__(self, density='medium', latency=0., error_rate=0., max_zoom=8, port=0, seed=0):
+    self.latency    = latency
+    self.error_rate = error_rate
+    self.max_zoom   = max_zoom
+    self.counts     = {} # status -> number of responses
+    self.rng        = random.Random(seed)
+    self.lock       = threading.Lock()
+    world           = bench_fixtures.world_fixture(density, seed)
+    self.tile       = lru_cache(maxsize=4096)(lambda z, x, y: bench_fixtures.encode_tile(world, z, x, y))
+    self.httpd      = http.server.ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+    self.httpd.daemon_threads = True
+    self.thread     = None
+
+  @property
+  def url(self):
+    return f"http://127.0.0.1:{self.httpd.server_address[1]}/index.json"
+
+  def __enter__(self):
+    self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+    self.thread.start()
+    return self
+
+  def __exit__(self, *exc):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+  def _index(self):
+    return json.dumps({
+      'tiles'        : ['tile/{z}/{y}/{x}.pbf'],
+      'minzoom'      : 0,
+      'maxzoom'      : self.max_zoom,
+      'extent'       : [0, 0, bench_fixtures.WORLD_SIZE, bench_fixtures.WORLD_SIZE],
+      'vector_layers': [{'id': 'roads'}, {'id': 'water'}]
+    }).encode()
+
+  # status, headers, and body of the response to a request for path
+  def respond(self, path):
+    if path == '/index.json':
+      return 200, {'Content-Type': 'application/json'}, self._index()
+    parts = path.split('/')
+    if len(parts) != 5 or parts[1] != 'tile' or not parts[4].endswith('.pbf'):
+      return 404, {}, b''
+    z, y, x = int(parts[2]), int(parts[3]), int(parts[4][:-4])
+    if not (0 <= z <= self.max_zoom and 0 <= x < 2**z and 0 <= y < 2**z):
+      return 404, {}, b''
+    with self.lock:
+      fail = self.rng.random() < self.error_rate
+      if fail:
+        status = self.rng.choice((429, 500, 502, 503))
+    if fail:
+      return status, {'Retry-After': '1'} if status == 429 else {}, b''
+    return 200, {'Content-Type': 'application/x-protobuf'}, self.tile(z, x, y)
+
+  def _handler(self):
+    server = self
+    class Handler(http.server.BaseHTTPRequestHandler):
+      def log_message(self, *args):
+        pass
+
+      def _send(self, with_body):
+        if server.latency > 0.:
+          time.sleep(server.latency)
+        status, headers, body = server.respond(self.path)
+        with server.lock:
+          server.counts[status] = server.counts.get(status, 0) + 1
+        self.send_response(status)
+        for key, val in headers.items():
+          self.send_header(key, val)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if with_body:
+          self.wfile.write(body)
+
+      def do_GET(self):
+        self._send(True)
+
+      def do_HEAD(self):
+        self._send(False)
+    return Handler
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description="serve synthetic vector tiles locally")
+  parser.add_argument('--port', type=int, default=8765)
+  parser.add_argument('--density', choices=bench_fixtures.DENSITIES, default='medium')
+  parser.add_argument('--latency', type=float, default=0.)
+  parser.add_argument('--error-rate', type=float, default=0.)
+  args = parser.parse_args()
+  with MockTileServer(args.density, args.latency, args.error_rate, port=args.port) as server:
+    print(f"serving {server.url}")
+    server.thread.join()
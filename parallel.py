@@ -0,0 +1,37 @@
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+
+# apply func to each tuple of arguments from args_iter on an executor, with at most window calls
+# in flight or waiting to be consumed at any time; results are yielded in the order of the
+# arguments if ordered is True and in order of completion otherwise
+def bounded_map(executor, func, args_iter, window=10, ordered=True):
+    window  = max(window, 1)
+    pending = deque() if ordered else set()
+    for args in args_iter:
+        # wait for a slot before submitting more work
+        while len(pending) >= window:
+            yield from _drain(pending, ordered)
+        future = executor.submit(func, *args)
+        if ordered:
+            pending.append(future)
+        else:
+            pending.add(future)
+    while len(pending) > 0:
+        yield from _drain(pending, ordered)
+
+
+def _drain(pending, ordered):
+    if ordered:
+        yield pending.popleft().result()
+    else:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            yield future.result()
+
+
+# like bounded_map, but calls func in the current process if executor is None
+def maybe_parallel_map(executor, func, args_iter, window=10, ordered=True):
+    if executor is None:
+        return (func(*args) for args in args_iter)
+    return bounded_map(executor, func, args_iter, window, ordered)
@@ -0,0 +1,173 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+import metrics
+
+# status codes that indicate a transient server condition worth retrying
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class _Host:
+    def __init__(self, rate, burst):
+        self.rate        = rate  # current rate (reduced while the host throttles us)
+        self.tokens      = burst
+        self.refilled    = time.monotonic()
+        self.requests    = 0     # requests and retries, for the retry budget
+        self.retries     = 0
+        self.failures    = 0     # consecutive failures, for the circuit breaker
+        self.open_until  = None  # end of the pause of an open circuit
+        self.trial       = False # a trial request of a half-open circuit is in flight
+
+
+# schedules the requests of all VectorTileMap instances that share it: each host gets a token
+# bucket that limits the request rate (halved whenever the host answers 429 and recovering
+# gradually with successful requests); failed requests are retried with exponential backoff with
+# full jitter (or after the delay given by Retry-After), as long as the retry budget of the host
+# allows it (retries may make up at most retry_ratio of its requests, plus min_retries); after
+# failure_threshold consecutive failures the circuit of the host opens and requests are held back
+# for reset_timeout seconds, then a single trial request decides whether it closes again; requests
+# time out after timeout seconds without an answer, which counts as a failure like a connection
+# error
+class RequestScheduler:
+    def __init__(self, rate=50., burst=None, base_delay=.5, max_delay=60., max_retries=8,
+                 retry_ratio=.2, min_retries=20, failure_threshold=10, reset_timeout=30.,
+                 timeout=30., logger=None):
+        self.logger = logging.getLogger(
+            RequestScheduler.__qualname__ if logger is None else logger
+        )
+        self.rate              = rate  # requests per second and host (None for no limit)
+        self.burst             = burst if burst is not None else max(1., rate or 1.)
+        self.base_delay        = base_delay
+        self.max_delay         = max_delay
+        self.max_retries       = max_retries
+        self.retry_ratio       = retry_ratio
+        self.min_retries       = min_retries
+        self.failure_threshold = failure_threshold
+        self.reset_timeout     = reset_timeout
+        self.timeout           = timeout # seconds (see the timeout argument of requests)
+        self.hosts             = {}
+        self.cond              = threading.Condition()
+        self.random            = random.Random()
+
+
+    # perform a request with send (a function returning a requests response) for url; returns the
+    # response, once retrying is given up the connection error (or timeout) or an HTTPError for
+    # the retryable status is raised (such that a render fails rather than silently missing tiles)
+    def request(self, url, send):
+        host    = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            trial = self._admit(host)
+            error, resp = None, None
+            try:
+                resp = send()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
+                error = exc
+            ok = resp is not None and resp.status_code not in RETRY_STATUSES
+            self._record(host, ok, resp is not None and resp.status_code == 429, trial)
+            if ok:
+                return resp
+            if not self._may_retry(host, attempt):
+                self.logger.warning(f"giving up on {url} after {attempt + 1} attempts")
+                if error is not None:
+                    raise error
+                resp.raise_for_status()
+            delay = self._backoff(attempt, None if resp is None else resp.headers.get('Retry-After'))
+            self.logger.info(
+                f"{'no answer' if error is not None else f'status {resp.status_code}'} "
+                f"for {url}, trying again in {delay:.1f} s"
+            )
+            metrics.count('http_retries')
+            time.sleep(delay)
+            attempt += 1
+
+
+    def _host(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = _Host(self.rate, self.burst)
+        return state
+
+
+    # wait until the circuit of the host lets a request pass and a token is available; returns
+    # whether the request is the trial request of a half-open circuit
+    def _admit(self, host):
+        with self.cond:
+            state = self._host(host)
+            trial = False
+            while True:
+                now = time.monotonic()
+                if state.open_until is not None:
+                    if now < state.open_until:
+                        self.cond.wait(state.open_until - now)
+                        continue
+                    # half open: only a single trial request until it succeeds or fails
+                    if state.trial and not trial:
+                        self.cond.wait()
+                        continue
+                    state.trial = trial = True
+                if state.rate is None:
+                    break
+                state.tokens   = min(self.burst, state.tokens + (now - state.refilled) * state.rate)
+                state.refilled = now
+                if state.tokens >= 1.:
+                    state.tokens -= 1.
+                    break
+                self.cond.wait((1. - state.tokens) / state.rate)
+            state.requests += 1
+            return trial
+
+
+    def _record(self, host, ok, throttled, trial):
+        with self.cond:
+            state = self._host(host)
+            if throttled and state.rate is not None:
+                state.rate = max(state.rate / 2., self.rate / 64.)
+                metrics.count('http_throttled')
+            elif ok and state.rate is not None:
+                state.rate = min(self.rate, state.rate + self.rate / 100.)
+            if ok:
+                state.failures   = 0
+                state.open_until = None
+            else:
+                state.failures += 1
+                if trial or (state.open_until is None and state.failures >= self.failure_threshold):
+                    self.logger.warning(f"{host} keeps failing, pausing requests for {self.reset_timeout} s")
+                    metrics.count('circuit_opened')
+                    state.open_until = time.monotonic() + self.reset_timeout
+            if trial:
+                state.trial = False
+            self.cond.notify_all()
+
+
+    def _may_retry(self, host, attempt):
+        with self.cond:
+            state = self._host(host)
+            if attempt >= self.max_retries or state.retries >= self.min_retries + self.retry_ratio * state.requests:
+                return False
+            state.retries += 1
+            return True
+
+
+    # exponential backoff with full jitter, unless the server asks for a specific delay
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                try:
+                    date = email.utils.parsedate_to_datetime(retry_after)
+                    return min(max(date.timestamp() - time.time(), 0.), self.max_delay)
+                except (TypeError, ValueError):
+                    pass
+        return self.random.uniform(0., min(self.max_delay, self.base_delay * 2**attempt))
+
+
+# scheduler shared by all VectorTileMap instances that are not given one explicitly
+default_scheduler = RequestScheduler()
@@ -0,0 +1,137 @@
+import math
+import numpy as np
+from geometry_utils import (
+  dissolve_lines, fir_filter_shapes, hull_perimeters, polygonize_clipped_tiles, simplify_shapes, stitch_tile_lines, stitch_tile_polygons
+)
+from svg_writer import path_data
+from shape_store import ShapeStore
+import metrics
+
+# fresh list of coordinate tuples for a shape (shapes are either lists of tuples or NumPy arrays)
+def _as_list(coords):
+  if isinstance(coords, np.ndarray):
+    return list(map(tuple, coords.tolist()))
+  return list(coords)
+
+
+# part of a tile box inside the view port; lines clipped to the view port end outside of it, just
+# like lines clipped to the tile end outside of the tile box
+def _visible_box(tile_box, viewport):
+  return (
+    (max(tile_box[0][0], viewport[0][0]), max(tile_box[0][1], viewport[0][1])),
+    (min(tile_box[1][0], viewport[1][0]), min(tile_box[1][1], viewport[1][1]))
+  )
+
+
+def is_closed(coords):
+  return tuple(coords[0]) == tuple(coords[-1])
+
+
+# process the shapes of one shape class for a group and format them as svg paths; tile_shapes is a
+# shape store (see shape_store.ShapeStore) or maps tile boxes to the shapes of the class in that
+# tile; runs in a worker process when rendering in
+# parallel, hence it only works on copies of the shapes; returns the polygonized shapes per tile
+# (None unless the group polygonizes its shapes), the svg paths (with coordinates rounded to the
+# given number of decimals), and the report of the metrics recorded while processing; resolution
+# is the size of a tile grid unit in map units and clipped tells whether the shapes were clipped to
+# the view port (with some margin); with a stage cache (see stage_cache), the processed shapes are
+# stored under key and, if tile_shapes is None, loaded from there instead of being processed again
+def process_shape_class(shape_type, tile_shapes, processing, colour, viewport, svg_scale, precision=3, resolution=0., clipped=False, cache=None, key=None):
+  with metrics.collect() as collector:
+    if tile_shapes is None:
+      with metrics.stage('load_processed'):
+        meta, buckets = cache.get(key)
+      if meta is None:
+        raise RuntimeError(f"processed shapes {key} vanished from the stage cache")
+      shape_list  = buckets[0]
+      polygonized = None
+      if meta['tile_boxes'] is not None:
+        polygonized = {tuple(map(tuple, tile_box)): bucket for tile_box, bucket in zip(meta['tile_boxes'], buckets[1:])}
+    else:
+      polygonized, shape_list = _process_shape_class(
+        shape_type, tile_shapes, processing, viewport, svg_scale, resolution, clipped
+      )
+      if cache is not None:
+        with metrics.stage('store_processed'):
+          cache.put(
+            key, {'tile_boxes': None if polygonized is None else list(polygonized)},
+            [shape_list] + ([] if polygonized is None else list(polygonized.values()))
+          )
+    with metrics.stage('svg_paths'):
+      paths = _svg_paths(shape_type, shape_list, colour, viewport, svg_scale, precision)
+  return polygonized, paths, collector.report()
+
+
+def _process_shape_class(shape_type, tile_shapes, processing, viewport, svg_scale, resolution, clipped):
+  # shapes are kept in a shape store unless processing steps that work on the shapes of each tile
+  # or on lists of coordinate tuples need them otherwise
+  if isinstance(tile_shapes, ShapeStore):
+    metrics.count('vertices_in', len(tile_shapes.coords))
+    if 'polygonize' not in processing and 'stitch_tiles' not in processing:
+      tile_shapes = {None: tile_shapes}
+    else:
+      tile_shapes = {tile_box: [_as_list(coords) for coords in bucket] for tile_box, bucket in tile_shapes.tile_buckets().items()}
+  else:
+    tile_shapes = {tile_box: [_as_list(coords) for coords in bucket] for tile_box, bucket in tile_shapes.items()}
+    metrics.count('vertices_in', sum(len(coords) for bucket in tile_shapes.values() for coords in bucket))
+
+  polygonized = None
+  if 'polygonize' in processing:
+    args        = processing['polygonize']
+    # the lines of all tiles are polygonized in one batch
+    with metrics.stage('polygonize'):
+      tile_shapes = polygonized = dict(zip(tile_shapes, polygonize_clipped_tiles([
+        (_visible_box(tile_box, viewport) if clipped else tile_box, bucket) for tile_box, bucket in tile_shapes.items()
+      ], args.get("corner_outset", 1.))))
+
+  # join shapes across tile borders (after polygonizing, since that works on the shapes of each tile)
+  if 'stitch_tiles' in processing and shape_type in (2, 3):
+    args       = processing['stitch_tiles']
+    stitch     = stitch_tile_lines if shape_type == 2 and 'polygonize' not in processing else stitch_tile_polygons
+    with metrics.stage('stitch_tiles'):
+      shape_list = list(stitch(tile_shapes, args.get("tolerance")))
+  elif None in tile_shapes:
+    shape_list = tile_shapes[None]
+  else:
+    shape_list = [coords for bucket in tile_shapes.values() for coords in bucket]
+
+  for proc, args in processing.items():
+    with metrics.stage(proc):
+      if proc == 'dissolve_lines' and shape_type == 2:
+        shape_list = list(dissolve_lines([_as_list(coords) for coords in shape_list]))
+
+      if proc == 'simplify' and shape_type in (2, 3):
+        # the tolerance is given in svg units (half a unit by default), but simplifying below the
+        # resolution of the tiles has no effect
+        tolerance  = max(args.get("tolerance", .5) / svg_scale, resolution)
+        shape_list = simplify_shapes(
+          shape_list, tolerance, args.get("method", "douglas_peucker"), rings=shape_type == 3 or 'polygonize' in processing
+        )
+
+      if proc == 'remove_small_shapes' and shape_type in (2, 3):
+        # a shape is considered small if its mean width (the perimter of its convex hull divided by pi) is below a threshold
+        large      = hull_perimeters(shape_list) / math.pi >= args.get("mean_width", 1000.)
+        if isinstance(shape_list, ShapeStore):
+          shape_list = shape_list.subset(large)
+        else:
+          shape_list = [shape for shape, is_large in zip(shape_list, large) if is_large]
+
+      if proc == 'coord_fir_filter' and shape_type in (2, 3):
+        shape_list = fir_filter_shapes(shape_list, args['coefficients'], rings=shape_type == 3 or 'polygonize' in processing)
+
+  metrics.count('vertices_out', sum(len(shape) for shape in shape_list))
+  metrics.count('paths', sum(1 for shape in shape_list if len(shape) > 0))
+
+  return polygonized, shape_list
+
+
+def _svg_paths(shape_type, shape_list, colour, viewport, svg_scale, precision):
+  paths = []
+  for shape in shape_list:
+    if len(shape) == 0:
+      continue
+    if shape_type == 2:
+      paths.append(f"    <path d=\"{path_data(shape, viewport[0], svg_scale, precision)}\" style=\"fill:none;stroke:{colour}\" />\n")
+    if shape_type == 3:
+      paths.append(f"    <path d=\"{path_data(shape, viewport[0], svg_scale, precision, True)}\" style=\"fill:{colour};stroke:none\" />\n")
+  return ''.join(paths)
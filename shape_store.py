@@ -0,0 +1,204 @@
+from collections.abc import Sequence
+import numpy as np
+
+# columnar container of shapes: the coordinates of all shapes are kept in one flat (n, 2) array
+# and the shapes are delimited by an offsets array (shape i is coords[offsets[i]:offsets[i + 1]]);
+# per shape, the feature type and the ids of its layer, its tag set, and its tile are kept in
+# small integer arrays, the layer names, tag sets (tuples of key and value pairs), and tile boxes
+# themselves are interned in lists; shapes are appended one at a time or a store at a time and are
+# consolidated into the flat arrays on first access; as a sequence, a store holds the coordinate
+# arrays of its shapes (views of the flat array)
+class ShapeStore(Sequence):
+  def __init__(self, dtype=np.float64):
+    self.dtype      = np.dtype(dtype)
+    self.layers     = []
+    self.tag_sets   = []
+    self.tile_boxes = []
+    self._interned  = ({}, {}, {}) # layer name, tag set, and tile box -> id
+    self._pending   = []           # blocks of shapes not consolidated yet
+    self._shapes    = []           # shapes appended one at a time, not yet in a block
+    self._arrays    = None         # coords, offsets, types, layer ids, tag ids, tile ids
+
+  # shapes of coordinate sequences without any further attributes (e.g., as input of the
+  # geometry functions)
+  @classmethod
+  def from_shapes(cls, shapes, dtype=np.float64):
+    store = cls(dtype)
+    for coords in shapes:
+      store.append(0, coords)
+    return store
+
+  def _intern(self, table, values, value):
+    idx = self._interned[table].get(value)
+    if idx is None:
+      idx = self._interned[table][value] = len(values)
+      values.append(value)
+    return idx
+
+  def append(self, shape_type, coords, layer_name=None, tags=(), tile_box=None):
+    self._shapes.append((
+      np.asarray(coords, dtype=self.dtype).reshape(-1, 2), shape_type,
+      self._intern(0, self.layers, layer_name), self._intern(1, self.tag_sets, tuple(tags)),
+      self._intern(2, self.tile_boxes, tile_box)
+    ))
+    self._arrays = None
+
+  # append all shapes of another store
+  def extend(self, other):
+    coords, offsets, types, layer_ids, tag_ids, tile_ids = other._consolidate()
+    self._flush()
+    remap = [
+      np.array([self._intern(table, values, value) for value in other_values], dtype=np.int32)
+      for table, values, other_values in (
+        (0, self.layers, other.layers), (1, self.tag_sets, other.tag_sets), (2, self.tile_boxes, other.tile_boxes)
+      )
+    ]
+    self._pending.append((
+      coords.astype(self.dtype, copy=False), np.diff(offsets), types,
+      remap[0][layer_ids], remap[1][tag_ids], remap[2][tile_ids]
+    ))
+    self._arrays = None
+
+  # move the shapes appended one at a time into a block
+  def _flush(self):
+    if len(self._shapes) == 0:
+      return
+    coords, types, layer_ids, tag_ids, tile_ids = zip(*self._shapes)
+    self._pending.append((
+      np.concatenate(coords), np.array([len(shape) for shape in coords], dtype=np.int64),
+      np.array(types, dtype=np.uint8), np.array(layer_ids, dtype=np.int32),
+      np.array(tag_ids, dtype=np.int32), np.array(tile_ids, dtype=np.int32)
+    ))
+    self._shapes = []
+
+  def _consolidate(self):
+    if self._arrays is None:
+      self._flush()
+      if len(self._pending) == 0:
+        self._pending.append((
+          np.zeros((0, 2), dtype=self.dtype), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8),
+          np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        ))
+      columns       = [np.concatenate(column) if len(self._pending) > 1 else column[0] for column in zip(*self._pending)]
+      self._pending = [tuple(columns)]
+      offsets       = np.zeros(len(columns[1]) + 1, dtype=np.int64)
+      np.cumsum(columns[1], out=offsets[1:])
+      self._arrays  = (columns[0], offsets, *columns[2:])
+    return self._arrays
+
+  @property
+  def coords(self):
+    return self._consolidate()[0]
+
+  @property
+  def offsets(self):
+    return self._consolidate()[1]
+
+  @property
+  def types(self):
+    return self._consolidate()[2]
+
+  @property
+  def layer_ids(self):
+    return self._consolidate()[3]
+
+  @property
+  def tag_ids(self):
+    return self._consolidate()[4]
+
+  @property
+  def tile_ids(self):
+    return self._consolidate()[5]
+
+  @property
+  def lengths(self):
+    return np.diff(self.offsets)
+
+  @property
+  def nbytes(self):
+    return sum(array.nbytes for array in self._consolidate())
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, idx):
+    coords, offsets = self._consolidate()[:2]
+    if isinstance(idx, slice):
+      return [coords[offsets[pos]:offsets[pos + 1]] for pos in range(*idx.indices(len(self)))]
+    if idx < 0:
+      idx += len(self)
+    if not 0 <= idx < len(self):
+      raise IndexError(idx)
+    return coords[offsets[idx]:offsets[idx + 1]]
+
+  def __iter__(self):
+    coords, offsets = self._consolidate()[:2]
+    bounds          = offsets.tolist()
+    return (coords[start:end] for start, end in zip(bounds[:-1], bounds[1:]))
+
+  # shapes in the format of VectorTileMap.query_shape_arrays (with tags as dictionaries)
+  def shapes(self):
+    attributes = zip(self.types.tolist(), self.layer_ids.tolist(), self.tag_ids.tolist(), self.tile_ids.tolist())
+    for coords, (shape_type, layer_id, tag_id, tile_id) in zip(self, attributes):
+      yield (shape_type, coords, self.layers[layer_id], dict(self.tag_sets[tag_id]), self.tile_boxes[tile_id])
+
+  # whether each shape ends where it starts
+  def closed(self):
+    coords, offsets = self._consolidate()[:2]
+    nonempty        = offsets[1:] > offsets[:-1]
+    closed          = np.zeros(len(self), dtype=bool)
+    closed[nonempty] = np.all(coords[offsets[:-1][nonempty]] == coords[offsets[1:][nonempty] - 1], axis=1)
+    return closed
+
+  # store with the shapes at the given indices (or where the given mask is set), in that order
+  def subset(self, indices):
+    coords, offsets, types, layer_ids, tag_ids, tile_ids = self._consolidate()
+    indices = np.asarray(indices)
+    if indices.dtype == bool:
+      indices = np.flatnonzero(indices)
+    lengths = offsets[indices + 1] - offsets[indices]
+    # index of each point of the selected shapes in the coordinate array
+    points  = np.repeat(offsets[indices] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return self._derive(coords[points], lengths, types[indices], layer_ids[indices], tag_ids[indices], tile_ids[indices])
+
+  # store with the same attributes of each shape, but other coordinates (e.g., after simplifying
+  # the shapes); lengths is the number of points of each shape
+  def with_coords(self, coords, lengths):
+    _, _, types, layer_ids, tag_ids, tile_ids = self._consolidate()
+    return self._derive(np.asarray(coords, dtype=self.dtype).reshape(-1, 2), np.asarray(lengths, dtype=np.int64), types, layer_ids, tag_ids, tile_ids)
+
+  def _derive(self, *columns):
+    store            = ShapeStore(self.dtype)
+    store.layers     = list(self.layers)
+    store.tag_sets   = list(self.tag_sets)
+    store.tile_boxes = list(self.tile_boxes)
+    store._interned  = tuple(dict(interned) for interned in self._interned)
+    store._pending   = [columns]
+    return store
+
+  # indices of the shapes of each shape class (feature type, layer name, and tag set), in the
+  # order of their first shapes
+  def shape_classes(self):
+    _, _, types, layer_ids, tag_ids, _ = self._consolidate()
+    keys    = (types.astype(np.int64) * len(self.layers) + layer_ids) * len(self.tag_sets) + tag_ids
+    uniq, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    # shape indices sorted by class (stably, such that the shapes of a class keep their order)
+    order   = np.argsort(inverse.ravel(), kind='stable')
+    ends    = np.cumsum(np.bincount(inverse.ravel(), minlength=len(uniq))).tolist()
+    starts  = [0] + ends[:-1]
+    classes = {}
+    for cls in np.argsort(first).tolist():
+      idx = first[cls]
+      classes[(int(types[idx]), self.layers[layer_ids[idx]], self.tag_sets[tag_ids[idx]])] = order[starts[cls]:ends[cls]]
+    return classes
+
+  # shapes of each tile box (lists of coordinate arrays), in the order of their first shapes
+  def tile_buckets(self):
+    buckets = {}
+    for coords, tile_id in zip(self, self.tile_ids.tolist()):
+      buckets.setdefault(self.tile_boxes[tile_id], []).append(coords)
+    return buckets
+
+  def __getstate__(self):
+    self._consolidate()
+    return self.__dict__
@@ -0,0 +1,119 @@
+import math
+import numpy as np
+
+# uniform grid hash over several sets of points (e.g., the points of several lines); the grid cells
+# are as large as the search radius, hence all points closer than that radius to a given point lie
+# in the 3x3 cells around the cell of that point
+class PointGrid:
+  def __init__(self, point_sets, cell_size=1.):
+    self.cell_size = cell_size
+    self.points    = []
+    self.cells     = {} # (set index, cell x, cell y) -> list of point indices
+    for set_idx, points in enumerate(point_sets):
+      points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+      self.points.append(points.tolist())
+      cells  = np.floor(points / cell_size).astype(np.int64).tolist()
+      for pt_idx, (cx, cy) in enumerate(cells):
+        key = (set_idx, cx, cy)
+        if key in self.cells:
+          self.cells[key].append(pt_idx)
+        else:
+          self.cells[key] = [pt_idx]
+
+  # pairs of indices of points of set A and set B that are closer than margin (margin must not be
+  # larger than the cell size)
+  def close_pairs(self, set_A, set_B, margin=None):
+    margin   = self.cell_size if margin is None else margin
+    points_B = self.points[set_B]
+    cells    = self.cells
+    for idx_A, (x, y) in enumerate(self.points[set_A]):
+      cx, cy = math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+      for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+          for idx_B in cells.get((set_B, cx + dx, cy + dy), ()):
+            x_B, y_B = points_B[idx_B]
+            if (x - x_B)**2 + (y - y_B)**2 < margin**2:
+              yield (idx_A, idx_B)
+
+
+# R-tree packed with the sort-tile-recursive algorithm over an (n, 4) array of bounding boxes
+# (min x, min y, max x, max y); each level is stored as an array of node boxes together with the
+# ranges of their children in the level below, the lowest level holds the boxes themselves
+class STRTree:
+  def __init__(self, boxes, node_size=16):
+    boxes          = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    self.node_size = node_size
+    self.order     = self._str_order(boxes)
+    self.levels    = [(boxes[self.order], None, None)]
+    while len(self.levels[-1][0]) > 1:
+      level_boxes, child_start, child_end = self.levels[-1]
+      if len(self.levels) > 1:
+        # pack the nodes of the current level, such that each parent covers a contiguous range
+        order            = self._str_order(level_boxes)
+        level_boxes      = level_boxes[order]
+        child_start      = child_start[order]
+        child_end        = child_end[order]
+        self.levels[-1]  = (level_boxes, child_start, child_end)
+      starts = np.arange(0, len(level_boxes), node_size)
+      ends   = np.minimum(starts + node_size, len(level_boxes))
+      self.levels.append((np.stack([
+        np.minimum.reduceat(level_boxes[:, 0], starts), np.minimum.reduceat(level_boxes[:, 1], starts),
+        np.maximum.reduceat(level_boxes[:, 2], starts), np.maximum.reduceat(level_boxes[:, 3], starts)
+      ], axis=1), starts, ends))
+
+  # sort boxes into vertical slices by the x coordinate of their center, then by the y coordinate
+  # of their center within each slice
+  def _str_order(self, boxes):
+    cnt = len(boxes)
+    if cnt <= self.node_size:
+      return np.arange(cnt)
+    slice_size = self.node_size * math.ceil(math.sqrt(math.ceil(cnt / self.node_size)))
+    center_x   = boxes[:, 0] + boxes[:, 2]
+    center_y   = boxes[:, 1] + boxes[:, 3]
+    by_x       = np.argsort(center_x, kind='stable')
+    slice_idx  = np.empty(cnt, dtype=np.int64)
+    slice_idx[by_x] = np.arange(cnt) // slice_size
+    return np.lexsort((center_y, slice_idx))
+
+  # indices of the boxes overlapping each of the query boxes, as two arrays of query indices and
+  # box indices; the tree is traversed for all query boxes at once, one level at a time
+  def query_bulk(self, queries):
+    queries = np.asarray(queries, dtype=np.float64).reshape(-1, 4)
+    if len(self.levels[0][0]) == 0:
+      return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    query_idx = np.arange(len(queries))
+    node_idx  = np.zeros(len(queries), dtype=np.int64)
+    for level in range(len(self.levels) - 1, -1, -1):
+      level_boxes = self.levels[level][0]
+      if level < len(self.levels) - 1:
+        # expand each (query, node) pair of the level above into pairs with the node's children
+        _, child_start, child_end = self.levels[level + 1]
+        counts    = child_end[node_idx] - child_start[node_idx]
+        offsets   = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        query_idx = np.repeat(query_idx, counts)
+        node_idx  = np.repeat(child_start[node_idx], counts) + offsets
+      query_boxes = queries[query_idx]
+      node_boxes  = level_boxes[node_idx]
+      overlap     = (
+        (query_boxes[:, 0] <= node_boxes[:, 2]) & (node_boxes[:, 0] <= query_boxes[:, 2]) &
+        (query_boxes[:, 1] <= node_boxes[:, 3]) & (node_boxes[:, 1] <= query_boxes[:, 3])
+      )
+      query_idx   = query_idx[overlap]
+      node_idx    = node_idx[overlap]
+    return query_idx, self.order[node_idx]
+
+  # all pairs (i, j) with i < j of overlapping boxes of the tree, sorted lexicographically; the
+  # boxes are queried in batches to bound the size of the intermediate arrays
+  def overlapping_pairs(self, batch_size=4096):
+    boxes = np.empty_like(self.levels[0][0])
+    boxes[self.order] = self.levels[0][0]
+    pairs = []
+    for start in range(0, len(boxes), batch_size):
+      idx1, idx2 = self.query_bulk(boxes[start:start + batch_size])
+      idx1      += start
+      keep       = idx1 < idx2
+      pairs.append(np.stack([idx1[keep], idx2[keep]], axis=1))
+    if len(pairs) == 0:
+      return np.zeros((0, 2), dtype=np.int64)
+    pairs = np.concatenate(pairs)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
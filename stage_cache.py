@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import time
+import logging
+
+import numpy as np
+
+from cache_files import entry_files, scan_entries, write_atomic, touch, evict_lru
+
+# version of the cached data; bump it whenever decoding or processing shapes changes the results,
+# such that results of older versions are not reused
+FORMAT_VERSION = 1
+
+
+# on-disk cache of intermediate results of a run (decoded shapes per source, processed shapes per
+# group and shape class), such that a run that differs only in later stages (e.g., the styling of
+# the svg) skips the earlier ones; entries are addressed by a fingerprint of everything their
+# content depends on and hold buckets of shapes (lists of coordinate arrays) together with some
+# json metadata; the shapes are stored as flat arrays in a npz file, the metadata in a json file
+# next to it
+class StageCache:
+    def __init__(self, path, max_size=1 << 30, max_age=None, logger=None):
+        self.logger = logging.getLogger(
+            StageCache.__qualname__ if logger is None else logger
+        )
+        self.path     = path
+        self.max_size = max_size # size cap in bytes (None for no limit), enforced when opening the cache
+        self.max_age  = max_age  # seconds after which entries are ignored (None for never)
+        os.makedirs(path, exist_ok=True)
+        self._evict()
+
+
+    # key of an entry from the inputs it depends on (anything json can represent; sets need to be
+    # converted to sorted lists by the caller, since their order is not stable)
+    @staticmethod
+    def fingerprint(*inputs):
+        text = json.dumps([FORMAT_VERSION, *inputs], sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+
+    def _files(self, key):
+        return entry_files(self.path, key, '.npz')
+
+
+    # metadata of an entry, or None if there is no (current) entry
+    def get_meta(self, key):
+        meta_file, _ = self._files(key)
+        try:
+            with open(meta_file) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.max_age is not None and time.time() - meta['time'] >= self.max_age:
+            return None
+        return meta['meta']
+
+
+    def contains(self, key):
+        return self.get_meta(key) is not None
+
+
+    # look up an entry; returns (meta, buckets) or (None, None), the shapes of the buckets are
+    # views of a single coordinate array
+    def get(self, key):
+        meta = self.get_meta(key)
+        if meta is None:
+            return None, None
+        meta_file, data_file = self._files(key)
+        try:
+            with np.load(data_file) as data:
+                coords, shape_sizes, bucket_sizes = data['coords'], data['shape_sizes'], data['bucket_sizes']
+        except (OSError, ValueError, KeyError):
+            return None, None
+        shapes  = np.split(coords, np.cumsum(shape_sizes)[:-1]) if len(shape_sizes) > 0 else []
+        ends    = np.cumsum(bucket_sizes).tolist()
+        buckets = [shapes[end - size:end] for end, size in zip(ends, bucket_sizes.tolist())]
+        # mark entry as recently used
+        touch(meta_file)
+        return meta, buckets
+
+
+    # store an entry; buckets is a list of lists of shapes (sequences of coordinate pairs)
+    def put(self, key, meta, buckets):
+        shapes       = [np.asarray(shape, dtype=np.float64).reshape(-1, 2) for bucket in buckets for shape in bucket]
+        coords       = np.concatenate(shapes) if len(shapes) > 0 else np.zeros((0, 2))
+        shape_sizes  = np.array([len(shape) for shape in shapes], dtype=np.int64)
+        bucket_sizes = np.array([len(bucket) for bucket in buckets], dtype=np.int64)
+        meta_file, data_file = self._files(key)
+        os.makedirs(os.path.dirname(meta_file), exist_ok=True)
+        # the metadata is written last, an entry without it does not exist
+        write_atomic(
+            data_file, lambda f: np.savez(f, coords=coords, shape_sizes=shape_sizes, bucket_sizes=bucket_sizes), 'wb'
+        )
+        write_atomic(meta_file, lambda f: json.dump({'time': time.time(), 'meta': meta}, f))
+
+
+    # remove least recently used entries while the cache exceeds its size cap
+    def _evict(self):
+        if self.max_size is None:
+            return
+        entries = scan_entries(self.path, '.npz')
+        size    = sum(size for _, size in entries.values())
+        if size <= self.max_size:
+            return
+        size = evict_lru(entries, size, self.max_size, self._files)
+        self.logger.info(f"evicted stage cache entries, {size} bytes remaining")
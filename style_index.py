@@ -0,0 +1,81 @@
+import re
+from bisect import bisect_left
+
+from feature_filters import freeze_filter
+
+# zoom range of a style layer
+def _zoom_range(layer):
+    return layer.get('minzoom', 0), layer.get('maxzoom', 256)
+
+
+# index of the layers of a style (or the vector layers of a tile index) for looking up the layers
+# visible at a zoom level and the feature filters of the layers matching some id patterns; the
+# zoom axis is split into elementary intervals at the zoom range bounds of the layers (each bound
+# and each open interval between two bounds is one interval), for each of which the visible
+# layers are listed once; pattern matches are computed once per pattern and filters once per set
+# of patterns and zoom level
+class StyleIndex:
+    def __init__(self, layer_desc):
+        self.layers = layer_desc
+        ranges      = [_zoom_range(layer) for layer in layer_desc]
+        self.bounds = sorted(set(bound for zoom_range in ranges for bound in zoom_range))
+        # representative zoom level of each interval: below the first bound, each bound, between
+        # two bounds, and above the last bound
+        probes      = [self.bounds[0] - 1] if len(self.bounds) > 0 else [0]
+        for lower, upper in zip(self.bounds, self.bounds[1:] + [None]):
+            probes.append(lower)
+            probes.append(lower + 1 if upper is None else (lower + upper) / 2)
+        self.intervals = [
+            tuple(idx for idx, (minzoom, maxzoom) in enumerate(ranges) if minzoom <= zoom <= maxzoom)
+            for zoom in probes
+        ]
+        self.matches   = {} # pattern -> indices of the layers with matching id
+        self.filters   = {} # (patterns, zoom level) -> filters
+
+
+    # indices of the layers visible at a zoom level (all layers if zoom_level is None)
+    def layer_indices(self, zoom_level=None):
+        if zoom_level is None:
+            return range(len(self.layers))
+        pos = bisect_left(self.bounds, zoom_level)
+        if pos < len(self.bounds) and self.bounds[pos] == zoom_level:
+            return self.intervals[2 * pos + 1]
+        return self.intervals[2 * pos]
+
+
+    def get_layers(self, zoom_level=None):
+        return [self.layers[idx] for idx in self.layer_indices(zoom_level)]
+
+
+    def _matches(self, pattern):
+        matches = self.matches.get(pattern)
+        if matches is None:
+            regex   = re.compile(pattern)
+            matches = self.matches[pattern] = frozenset(
+                idx for idx, layer in enumerate(self.layers) if regex.match(layer['id'])
+            )
+        return matches
+
+
+    # filters of the source layers of the layers whose id matches any of the patterns and that are
+    # visible at the zoom level; a source layer maps to None if any such layer has no filter
+    def get_filters(self, patterns, zoom_level=None):
+        key     = (tuple(patterns), zoom_level)
+        filters = self.filters.get(key)
+        if filters is None:
+            matches = frozenset().union(*(self._matches(pattern) for pattern in key[0]))
+            filters = {}
+            for idx in self.layer_indices(zoom_level):
+                if idx not in matches:
+                    continue
+                layer        = self.layers[idx]
+                source_layer = layer.get('source-layer', None)
+                layer_filter = layer.get('filter', None)
+                if source_layer is not None:
+                    if layer_filter is None:
+                        filters[source_layer] = None
+                    elif filters.get(source_layer, set()) is not None:
+                        filters[source_layer] = filters.get(source_layer, frozenset()) | {freeze_filter(layer_filter)}
+            self.filters[key] = filters
+        # copies, such that callers may modify the result
+        return {source_layer: None if flts is None else set(flts) for source_layer, flts in filters.items()}
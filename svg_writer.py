@@ -0,0 +1,68 @@
+import gzip
+import numpy as np
+
+# writes an svg document incrementally: groups are written as soon as their paths are available,
+# such that nothing but the group currently being written needs to be held in memory; documents
+# with a file name ending in .svgz are gzip-compressed
+class SvgWriter:
+  def __init__(self, path, size, attributes=None):
+    self.file = gzip.open(path, 'wt', encoding='utf-8') if path.endswith('.svgz') else open(path, 'w')
+    svg_attr  = ' '.join(f"{key}=\"{val}\"" for key, val in (attributes or {}).items())
+    self.file.write(f"<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"no\"?>\n")
+    self.file.write(f"<svg width=\"{size[0]}\" height=\"{size[1]}\" xmlns=\"http://www.w3.org/2000/svg\" {svg_attr}>\n")
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  # write a group; paths is an iterable of strings of path elements, consumed one at a time
+  def group(self, attributes, paths):
+    grp_attr = ' '.join(f"{key}=\"{val}\"" for key, val in attributes.items())
+    self.file.write(f"  <g {grp_attr}>\n")
+    for text in paths:
+      self.file.write(text)
+    self.file.write(f"  </g>\n")
+
+  def close(self):
+    if not self.file.closed:
+      self.file.write("</svg>\n")
+      self.file.close()
+
+
+# shortest decimal representation of the integer value * 10**-precision (e.g., ".5" or "-12.25")
+def _format_fixed(value, precision):
+  sign   = '-' if value < 0 else ''
+  digits = str(abs(value))
+  if precision == 0:
+    return sign + digits
+  digits = digits.rjust(precision + 1, '0')
+  whole  = digits[:-precision].lstrip('0')
+  frac   = digits[-precision:].rstrip('0')
+  if frac == '':
+    return sign + (whole or '0')
+  return f"{sign}{whole}.{frac}"
+
+
+# path data of a shape with relative commands; the coordinates are rounded to the given number of
+# decimals (in svg units) first and the relative steps are taken between rounded positions, hence
+# rounding errors do not accumulate; points that round to the same position as their predecessor
+# are dropped and separators are omitted where the next number starts with a sign or a second
+# decimal point
+def path_data(coords, origin, scale, precision, closed=False):
+  points = np.rint((np.asarray(coords, dtype=np.float64) - origin) * (scale * 10**precision)).astype(np.int64)
+  steps  = np.diff(points, axis=0)
+  steps  = steps[np.any(steps != 0, axis=1)]
+  # a closed shape ends where it started, the last step is implied by the closepath command
+  if closed and len(steps) > 0 and not np.any(np.sum(steps, axis=0)):
+    steps = steps[:-1]
+  numbers = [_format_fixed(val, precision) for val in points[0].tolist() + steps.ravel().tolist()]
+  parts   = ['m', numbers[0]]
+  for prev, num in zip(numbers[:-1], numbers[1:]):
+    if not (num[0] == '-' or (num[0] == '.' and '.' in prev)):
+      parts.append(' ')
+    parts.append(num)
+  if closed:
+    parts.append('z')
+  return ''.join(parts)
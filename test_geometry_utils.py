@@ -0,0 +1,317 @@
+import math
+import random
+import numpy as np
+from geometry_utils import (
+  hull_perimeters, dissolve_lines, polygonize_clipped_lines, polygonize_clipped_tiles, clip_line_array,
+  clip_ring_array, stitch_tile_lines, stitch_tile_polygons
+)
+
+# randomized checks of the geometry functions against simple reference implementations (or inputs
+# whose expected result is known by construction); all inputs are generated from fixed seeds
+
+
+# empty shapes and single points have perimeter 0 and do not affect the perimeters of the others
+def test_hull_perimeters_of_degenerate_shapes():
+  rng    = np.random.default_rng(1)
+  shapes = [rng.uniform(0., 10., (rng.integers(0, 6), 2)) for _ in range(200)]
+  expected = [
+    0. if len(shape) < 2 else hull_perimeters([shape])[0] for shape in shapes
+  ]
+  assert np.allclose(hull_perimeters(shapes), expected)
+  assert np.allclose(hull_perimeters([[(0., 0.), (3., 4.)], [], [(1., 1.)]]), [10., 0., 0.])
+
+
+# previous implementation of polygonize_clipped_lines (sorting the endpoints by angle and passing
+# the corners at multiples of 45 degrees), which is correct for square boxes
+def _polygonize_reference(lines, bbox, corner_outset=1.):
+  lines = [list(line) for line in lines]
+  outside_endpoints = [
+    (math.atan2(pt[1] - (bbox[0][1] + bbox[1][1]) / 2., pt[0] - (bbox[0][0] + bbox[1][0]) / 2), line_idx, start)
+    for line_idx, line in enumerate(lines) if line[0] != line[-1]
+    for pt, start in [(line[0], True), (line[-1], False)] if pt[0] < bbox[0][0] or pt[0] > bbox[1][0] or pt[1] < bbox[0][1] or pt[1] > bbox[1][1]
+  ]
+  outside_endpoints.sort(key=lambda elem: elem[0])
+  merged_lines = {}
+  for end_pt_idx, (end_angle, end_line_idx, _) in ((idx, pt) for idx, pt in enumerate(outside_endpoints) if not pt[2]):
+    start_pt_idx = end_pt_idx + 1
+    start_angle, start_line_idx, start_start = outside_endpoints[start_pt_idx % len(outside_endpoints)]
+    if start_start:
+      start_line_idx = merged_lines.get(start_line_idx, start_line_idx)
+      end_line_idx   = merged_lines.get(end_line_idx  , end_line_idx  )
+      line = lines[end_line_idx]
+      if start_pt_idx >= len(outside_endpoints):
+        start_angle += 2*math.pi
+      for corner_angle, corner_pt in [
+        (-( 3./4.)*math.pi, (bbox[0][0] - corner_outset, bbox[0][1] - corner_outset)),
+        (-( 1./4.)*math.pi, (bbox[1][0] + corner_outset, bbox[0][1] - corner_outset)),
+        (+( 1./4.)*math.pi, (bbox[1][0] + corner_outset, bbox[1][1] + corner_outset)),
+        (+( 3./4.)*math.pi, (bbox[0][0] - corner_outset, bbox[1][1] + corner_outset)),
+        (+( 5./4.)*math.pi, (bbox[0][0] - corner_outset, bbox[0][1] - corner_outset)),
+        (+( 7./4.)*math.pi, (bbox[1][0] + corner_outset, bbox[0][1] - corner_outset)),
+        (+( 9./4.)*math.pi, (bbox[1][0] + corner_outset, bbox[1][1] + corner_outset)),
+        (+(11./4.)*math.pi, (bbox[0][0] - corner_outset, bbox[1][1] + corner_outset))
+      ]:
+        if end_angle < corner_angle < start_angle:
+          line.append(corner_pt)
+      if start_line_idx == end_line_idx:
+        line.append(line[0])
+      else:
+        line.extend(lines[start_line_idx])
+        merged_lines[start_line_idx] = end_line_idx
+        merged_lines.update([(key, end_line_idx) for key, val in merged_lines.items() if val == start_line_idx])
+  return [line for idx, line in enumerate(lines) if idx not in merged_lines]
+
+
+# random point inside of a box or just outside of it
+def _box_point(rng, bbox, outside):
+  (x0, y0), (x1, y1) = bbox
+  if not outside:
+    return (rng.uniform(x0, x1), rng.uniform(y0, y1))
+  side, margin = rng.randrange(4), rng.uniform(.01, 2.)
+  if side == 0:
+    return (x0 - margin, rng.uniform(y0 - 1., y1 + 1.))
+  if side == 1:
+    return (x1 + margin, rng.uniform(y0 - 1., y1 + 1.))
+  if side == 2:
+    return (rng.uniform(x0 - 1., x1 + 1.), y0 - margin)
+  return (rng.uniform(x0 - 1., x1 + 1.), y1 + margin)
+
+
+# lines crossing a box (most of them entering and leaving it, some closed)
+def _clipped_lines(rng, bbox):
+  lines = []
+  for _ in range(rng.randint(0, 8)):
+    start, end = _box_point(rng, bbox, rng.random() < .8), _box_point(rng, bbox, rng.random() < .8)
+    lines.append([start, _box_point(rng, bbox, False), start if rng.random() < .1 else end])
+  return lines
+
+
+def test_polygonize_matches_reference_on_square_boxes():
+  rng = random.Random(5)
+  for _ in range(2000):
+    x0, y0, size = rng.uniform(-100., 100.), rng.uniform(-100., 100.), rng.uniform(10., 200.)
+    bbox  = ((x0, y0), (x0 + size, y0 + size))
+    lines = _clipped_lines(rng, bbox)
+    assert polygonize_clipped_lines(lines, bbox) == _polygonize_reference(lines, bbox)
+
+
+# the boundary is walked on the box scaled to a square, hence stretching the input stretches the
+# result (without corner outset); the reference fails this on non-square boxes
+def test_polygonize_is_invariant_to_stretching():
+  rng    = random.Random(7)
+  square = ((0., 0.), (100., 100.))
+  for _ in range(500):
+    scale = np.array([rng.uniform(.2, 5.), rng.uniform(.2, 5.)])
+    bbox  = tuple(tuple(np.array(corner) * scale) for corner in square)
+    lines = _clipped_lines(rng, square)
+    expected = polygonize_clipped_lines(lines, square, 0.)
+    result   = polygonize_clipped_lines([[tuple(np.array(pt) * scale) for pt in line] for line in lines], bbox, 0.)
+    assert len(result) == len(expected)
+    for polygon, expected_polygon in zip(result, expected):
+      assert len(polygon) == len(expected_polygon)
+      assert np.allclose(np.array(polygon), np.array(expected_polygon) * scale)
+
+
+def test_polygonize_tiles_matches_single_tiles():
+  rng   = random.Random(9)
+  tiles = []
+  for idx in range(50):
+    bbox = ((idx * 100., 0.), (idx * 100. + 100., 100. + idx))
+    tiles.append((bbox, _clipped_lines(rng, bbox)))
+  assert polygonize_clipped_tiles(tiles) == [polygonize_clipped_lines(lines, bbox) for bbox, lines in tiles]
+
+
+# random lines on separate rows, cut into fragments that connect (share an end point) or overlap
+# (share several points), as lines clipped at tile borders; with branches, further lines start at
+# some of the cut points (junctions where a line could be continued in two ways)
+def _fragmented_lines(rng, branches=False):
+  lines     = []
+  fragments = []
+  for row in range(rng.randint(1, 20)):
+    # points further apart than equal_dist
+    x, y = rng.uniform(0., 100.), row * 1000.
+    line = [(x, y)]
+    for _ in range(rng.randint(30, 60)):
+      x, y = x + rng.uniform(2., 10.), y + rng.uniform(-20., 20.)
+      line.append((x, y))
+    lines.append(line)
+    # fragments of at least 8 points, such that no fragment is covered by an overlap
+    cuts = [rng.randint(8, 16)]
+    while cuts[-1] + 24 < len(line):
+      cuts.append(cuts[-1] + rng.randint(8, 16))
+    for start, end in zip([0] + cuts, cuts + [len(line) - 1]):
+      overlap = 0 if start == 0 or rng.random() < .5 else rng.randint(2, 3)
+      fragments.append(line[start - overlap:end + 1])
+    for cut in cuts:
+      if branches and rng.random() < .5:
+        x, y   = line[cut]
+        branch = [(x, y)]
+        for _ in range(rng.randint(8, 12)):
+          x, y = x + rng.uniform(-5., 5.), y + rng.uniform(20., 40.)
+          branch.append((x, y))
+        fragments.append(branch)
+  rng.shuffle(fragments)
+  return lines, fragments
+
+
+def _segments(lines):
+  return set((tuple(pt_a), tuple(pt_b)) for line in lines for pt_a, pt_b in zip(line[:-1], line[1:]))
+
+
+# dissolving the shuffled fragments restores the lines, which includes appending chains that were
+# already extended
+def test_dissolve_restores_fragmented_lines():
+  rng = random.Random(3)
+  for _ in range(50):
+    lines, fragments = _fragmented_lines(rng)
+    result = [tuple(map(tuple, line)) for line in dissolve_lines(fragments)]
+    assert sorted(result) == sorted(tuple(line) for line in lines)
+
+
+# at junctions, a line is only continued at its actual end: the dissolved lines consist of exactly
+# the segments of the fragments (appending a chain that was already extended must not make the
+# inner end of its first line an end of the chain again)
+def test_dissolve_keeps_segments_at_junctions():
+  rng = random.Random(4)
+  for _ in range(50):
+    _, fragments = _fragmented_lines(rng, branches=True)
+    assert _segments(dissolve_lines(fragments)) == _segments(fragments)
+
+
+# distance of each point to the closest segment of any of the lines
+def _line_distances(points, lines):
+  dists = np.full(len(points), np.inf)
+  for line in lines:
+    line = np.asarray(line, dtype=np.float64)
+    if len(line) == 1:
+      dists = np.minimum(dists, np.hypot(*(points - line[0]).T))
+      continue
+    pt_a, delta = line[:-1], line[1:] - line[:-1]
+    rel = points[:, None] - pt_a[None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+      t = np.clip(np.nan_to_num(np.sum(rel * delta, axis=2) / np.sum(delta * delta, axis=1)), 0., 1.)
+    dists = np.minimum(dists, np.hypot(*(rel - t[:, :, None] * delta).transpose(2, 0, 1)).min(axis=1))
+  return dists
+
+
+def test_clip_line_matches_dense_sampling():
+  rng  = np.random.default_rng(11)
+  bbox = ((0., 0.), (10., 10.))
+  for _ in range(500):
+    line   = rng.uniform(-5., 15., (rng.integers(2, 12), 2))
+    pieces = clip_line_array(line, bbox)
+    # the pieces lie inside the box and on the line
+    for piece in pieces:
+      assert np.all((piece >= -1e-9) & (piece <= 10. + 1e-9))
+      assert np.all(_line_distances(piece, [line]) < 1e-9)
+    # every part of the line inside the box is covered by the pieces
+    t       = np.linspace(0., 1., 201)[None, :, None]
+    samples = (line[:-1, None] + t * (line[1:, None] - line[:-1, None])).reshape(-1, 2)
+    inside  = samples[np.all((samples > 1e-6) & (samples < 10. - 1e-6), axis=1)]
+    if len(inside) > 0:
+      assert len(pieces) > 0 and np.all(_line_distances(inside, pieces) < 1e-9)
+
+
+# even-odd rule
+def _inside_ring(points, ring):
+  ring   = np.asarray(ring, dtype=np.float64)
+  pt_a   = ring
+  pt_b   = np.roll(ring, -1, axis=0)
+  x, y   = points[:, 0, None], points[:, 1, None]
+  spans  = (pt_a[:, 1] > y) != (pt_b[:, 1] > y)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    cross_x = pt_a[:, 0] + (y - pt_a[:, 1]) * (pt_b[:, 0] - pt_a[:, 0]) / (pt_b[:, 1] - pt_a[:, 1])
+  return np.sum(spans & (x < cross_x), axis=1) % 2 == 1
+
+
+def test_clip_ring_matches_dense_sampling():
+  rng  = np.random.default_rng(13)
+  bbox = ((0., 0.), (10., 10.))
+  for _ in range(300):
+    # star-shaped (mostly concave) rings around random centers
+    center = rng.uniform(-5., 15., 2)
+    angles = np.sort(rng.uniform(0., 2 * math.pi, rng.integers(3, 30)))
+    radii  = rng.uniform(1., 10., len(angles))
+    ring   = center + radii[:, None] * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    ring   = np.concatenate([ring, ring[:1]])
+    points = rng.uniform(0., 10., (2000, 2))
+    expected = _inside_ring(points, ring[:-1])
+    clipped  = clip_ring_array(ring, bbox)
+    if len(clipped) == 0:
+      assert not np.any(expected)
+      continue
+    assert np.all(clipped[0] == clipped[-1])
+    assert np.all((clipped >= -1e-9) & (clipped <= 10. + 1e-9))
+    assert np.array_equal(_inside_ring(points, clipped[:-1]), expected)
+
+
+# a grid of 4 x 4 tiles of size 10, each holding the shapes clipped to the tile with a buffer of 1 (as
+# in vector tiles); clip returns the pieces of a shape in a box
+GRID = ((0., 0.), (40., 40.))
+
+def _tiles_of(shapes, clip):
+  tiles = {}
+  for tile_x in range(4):
+    for tile_y in range(4):
+      tile_box = ((tile_x * 10., tile_y * 10.), (tile_x * 10. + 10., tile_y * 10. + 10.))
+      buffered = ((tile_box[0][0] - 1., tile_box[0][1] - 1.), (tile_box[1][0] + 1., tile_box[1][1] + 1.))
+      pieces   = [piece for shape in shapes for piece in clip(shape, buffered)]
+      if len(pieces) > 0:
+        tiles[tile_box] = pieces
+  return tiles
+
+
+# random walks across the tiles are stitched back into the pieces of the walks inside of the grid
+def test_stitch_tile_lines_restores_lines():
+  rng = np.random.default_rng(17)
+  for _ in range(100):
+    line     = np.cumsum(rng.uniform(-2., 3., (rng.integers(10, 60), 2)), axis=0) + rng.uniform(0., 20., 2)
+    expected = clip_line_array(line, GRID)
+    stitched = list(stitch_tile_lines(_tiles_of([line], clip_line_array)))
+    assert len(stitched) == len(expected)
+    for piece in stitched:
+      assert np.all(_line_distances(np.asarray(piece), [line]) < 1e-9)
+    for piece in expected:
+      assert np.all(_line_distances(piece, stitched) < 1e-9)
+
+
+# star-shaped (mostly concave) rings, optionally with a hole, spanning several tiles; clipping them
+# to the tiles inserts bridges along the tile sides, which must not prevent merging the pieces
+def _star(rng, center, min_radius, max_radius, reverse=False):
+  angles = np.sort(rng.uniform(0., 2 * math.pi, rng.integers(5, 40)))
+  radii  = rng.uniform(min_radius, max_radius, len(angles))
+  ring   = center + radii[:, None] * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+  ring   = ring[::-1] if reverse else ring
+  return np.concatenate([ring, ring[:1]])
+
+
+def _clip_ring(ring, bbox):
+  clipped = clip_ring_array(ring, bbox)
+  return [clipped] if len(clipped) > 0 else []
+
+
+def test_stitch_tile_polygons_merges_concave_rings():
+  rng = np.random.default_rng(19)
+  for _ in range(100):
+    center   = rng.uniform(15., 25., 2)
+    rings    = [_star(rng, center, 6., 14.)]
+    if rng.uniform() < .5:
+      rings.append(_star(rng, center, 1., 5., reverse=True))
+    stitched = list(stitch_tile_polygons(_tiles_of(rings, _clip_ring)))
+    assert len(stitched) == len(rings)
+    points   = rng.uniform(0., 40., (2000, 2))
+    expected = np.logical_xor.reduce([_inside_ring(points, ring[:-1]) for ring in rings])
+    assert np.array_equal(np.logical_xor.reduce([_inside_ring(points, ring[:-1]) for ring in stitched]), expected)
+
+
+# rings reaching beyond the tiles are merged into the part of the ring inside of the grid
+def test_stitch_tile_polygons_keeps_the_border_of_the_tiles():
+  rng = np.random.default_rng(23)
+  for _ in range(100):
+    ring     = _star(rng, rng.uniform(-5., 10., 2), 10., 40.)
+    stitched = list(stitch_tile_polygons(_tiles_of([ring], _clip_ring)))
+    for piece in stitched:
+      assert piece[0] == piece[-1]
+    points   = rng.uniform(0., 40., (2000, 2))
+    expected = _inside_ring(points, clip_ring_array(ring, GRID)[:-1])
+    assert np.array_equal(np.logical_xor.reduce([_inside_ring(points, piece[:-1]) for piece in stitched]), expected)
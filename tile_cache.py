@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import logging
+
+from cache_files import entry_files, scan_entries, write_atomic, touch, evict_lru
+
+# seconds before a cache entry is revalidated by default
+DEFAULT_MAX_AGE = 24 * 3600
+
+class TileCache:
+    def __init__(self, path, max_size=1 << 30, max_age=DEFAULT_MAX_AGE, offline=False,
+                 logger=None):
+        self.logger = logging.getLogger(
+            TileCache.__qualname__ if logger is None else logger
+        )
+        self.path     = path
+        self.max_size = max_size # size cap in bytes (None for no limit)
+        self.max_age  = max_age  # seconds before an entry is revalidated (None for never)
+        self.offline  = offline  # never touch the network, serve only what is cached
+        self.lock     = threading.Lock()
+
+        # scan existing entries (see cache_files)
+        os.makedirs(path, exist_ok=True)
+        self.entries = scan_entries(path, '.bin')
+        self.size    = sum(size for _, size in self.entries.values())
+
+
+    # content address of a resource (or probe result); tiles are addressed by their url, i.e. the
+    # url template with the tile coordinates filled in
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
+
+    # file of the tile index (see TileIndex) of a tileset, kept next to the entry directories such
+    # that it is not taken for an entry
+    def index_path(self, index_url):
+        return os.path.join(self.path, f"tile_index_{self.key(index_url)}.json")
+
+
+    def _files(self, key):
+        return entry_files(self.path, key, '.bin')
+
+
+    # look up an entry; returns (meta, content) or (None, None), content is None for probe results
+    # and unless need_content is set (the content is only read from disk if it is needed)
+    def get(self, key, need_content=False):
+        meta_file, data_file = self._files(key)
+        try:
+            with open(meta_file) as f:
+                meta = json.load(f)
+            if need_content and not meta['has_content']:
+                return meta, None
+            content = None
+            if need_content:
+                with open(data_file, 'rb') as f:
+                    content = f.read()
+        except (OSError, ValueError):
+            return None, None
+        # mark entry as recently used
+        now = touch(meta_file)
+        with self.lock:
+            if key in self.entries:
+                self.entries[key] = (now, self.entries[key][1])
+        return meta, content
+
+
+    # whether an entry can be used without asking the server
+    def is_fresh(self, meta):
+        return self.offline or self.max_age is None or time.time() - meta['time'] < self.max_age
+
+
+    # headers for revalidating an entry with a conditional request
+    @staticmethod
+    def conditional_headers(meta):
+        headers = {}
+        if meta.get('etag') is not None:
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified') is not None:
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+
+    def put(self, key, status, content=None, headers=None):
+        headers   = {} if headers is None else headers
+        meta      = {
+            'status'       : status,
+            'time'         : time.time(),
+            'etag'         : headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'has_content'  : content is not None,
+        }
+        meta_file, data_file = self._files(key)
+        os.makedirs(os.path.dirname(meta_file), exist_ok=True)
+        size = 0
+        if content is not None:
+            write_atomic(data_file, lambda f: f.write(content), 'wb')
+            size += len(content)
+        elif os.path.exists(data_file):
+            os.remove(data_file)
+        write_atomic(meta_file, lambda f: json.dump(meta, f))
+        size += os.path.getsize(meta_file)
+        with self.lock:
+            self.size += size - self.entries.get(key, (0, 0))[1]
+            self.entries[key] = (meta['time'], size)
+            self._evict()
+
+
+    # refresh the timestamp of an entry after the server confirmed it is unchanged (304)
+    def refresh(self, key, meta):
+        meta         = dict(meta, time=time.time())
+        meta_file, _ = self._files(key)
+        write_atomic(meta_file, lambda f: json.dump(meta, f))
+        with self.lock:
+            if key in self.entries:
+                self.entries[key] = (meta['time'], self.entries[key][1])
+
+
+    # remove least recently used entries once the cache exceeds its size cap (lock held)
+    def _evict(self):
+        if self.max_size is None or self.size <= self.max_size:
+            return
+        self.size = evict_lru(self.entries, self.size, self.max_size, self._files)
+        self.logger.info(f"evicted cache entries, {len(self.entries)} remaining")
+
+
+# sparse quadtree of tiles known to be present or absent in a tileset; a tile is known to be
+# absent if any of its ancestors is absent, and recording a present tile marks its ancestors;
+# entries older than max_age seconds are no longer known (like the entries of a TileCache, which
+# are revalidated after max_age)
+class TileIndex:
+    def __init__(self, path=None, max_age=None):
+        self.path    = path    # file for persisting the index (None for an in-memory index)
+        self.max_age = max_age # seconds after which entries are ignored (None for never)
+        self.lock    = threading.Lock()
+        self.tiles   = {}      # (z, x, y) -> (present, time recorded)
+        self.dirty   = False
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.tiles = {
+                    tuple(int(val) for val in key.split('/')): tuple(entry)
+                    for key, entry in json.load(f).items()
+                }
+
+
+    def add(self, z, x, y, present):
+        now = time.time()
+        with self.lock:
+            while self._state(z, x, y, now) != present:
+                self.tiles[(z, x, y)] = (present, now)
+                self.dirty            = True
+                if not present or z == 0:
+                    break
+                z, x, y = z - 1, x >> 1, y >> 1
+
+
+    # recorded state of a single tile (None if unknown or expired)
+    def _state(self, z, x, y, now):
+        entry = self.tiles.get((z, x, y))
+        if entry is None or (self.max_age is not None and now - entry[1] >= self.max_age):
+            return None
+        return entry[0]
+
+
+    # returns True if the tile is known to be present, False if it is known to be absent and None
+    # if nothing is known about it
+    def lookup(self, z, x, y):
+        now   = time.time()
+        state = self._state(z, x, y, now)
+        if state is not None:
+            return state
+        while z > 0:
+            z, x, y = z - 1, x >> 1, y >> 1
+            if self._state(z, x, y, now) is False:
+                return False
+        return None
+
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+        with self.lock:
+            data       = {f"{z}/{x}/{y}": list(entry) for (z, x, y), entry in self.tiles.items()}
+            self.dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_atomic(self.path, lambda f: json.dump(data, f))
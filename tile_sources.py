@@ -0,0 +1,311 @@
+import gzip
+import json
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import threading
+import zlib
+from bisect import bisect_right
+
+# extent of the web mercator tiling scheme used by MBTiles and PMTiles
+WEB_MERCATOR_EXTENT = [-20037508.342789244, -20037508.342789244,
+                        20037508.342789244,  20037508.342789244]
+
+# tile data is frequently stored gzip-compressed
+def _decompress(data):
+    if data is not None and data[:2] == b'\x1f\x8b':
+        return gzip.decompress(data)
+    return data
+
+
+# build an index dictionary in the format of a TileJSON / ArcGIS index from tileset metadata
+def _make_index(minzoom, maxzoom, vector_layers=None):
+    index = {
+        'minzoom': int(minzoom),
+        'maxzoom': int(maxzoom),
+        'extent' : WEB_MERCATOR_EXTENT,
+    }
+    if vector_layers is not None:
+        index['vector_layers'] = vector_layers
+    return index
+
+
+# base class for local tile sources: provides an index and tile data, and resolves the tiles
+# that exist at a zoom level from local metadata instead of probing; sources hold open files or
+# connections, which are released by close (or by using the source as a context manager)
+class TileSource:
+    index = None
+
+    # raw (decompressed) tile data or None if the tile does not exist
+    def get_tile(self, z, x, y):
+        raise NotImplementedError
+
+    # set of (x, y) coordinates of the tiles present at zoom level z, restricted to the tile range
+    # ((x0, y0), (x1, y1)) (bounds included) if given
+    def tile_coords(self, z, tile_range=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MBTilesSource(TileSource):
+    def __init__(self, path):
+        self.path  = path
+        self.local = threading.local() # sqlite connections cannot be shared between threads
+        metadata   = dict(self._db().execute('SELECT name, value FROM metadata').fetchall())
+        layers     = json.loads(metadata['json']).get('vector_layers') if 'json' in metadata else None
+        zooms      = self._db().execute('SELECT MIN(zoom_level), MAX(zoom_level) FROM tiles').fetchone()
+        self.index = _make_index(
+            metadata.get('minzoom', zooms[0]), metadata.get('maxzoom', zooms[1]), layers
+        )
+
+    def _db(self):
+        if getattr(self.local, 'db', None) is None:
+            self.local.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        return self.local.db
+
+    # MBTiles uses the TMS scheme, i.e., rows are counted from the bottom
+    def get_tile(self, z, x, y):
+        row = self._db().execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+            (z, x, (1 << z) - 1 - y)
+        ).fetchone()
+        return _decompress(row[0]) if row is not None else None
+
+    def tile_coords(self, z, tile_range=None):
+        if tile_range is None:
+            rows = self._db().execute(
+                'SELECT tile_column, tile_row FROM tiles WHERE zoom_level=?', (z,)
+            )
+        else:
+            (x0, y0), (x1, y1) = tile_range
+            rows = self._db().execute(
+                'SELECT tile_column, tile_row FROM tiles WHERE zoom_level=? AND '
+                'tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?',
+                (z, x0, x1, (1 << z) - 1 - y1, (1 << z) - 1 - y0)
+            )
+        return set((x, (1 << z) - 1 - row) for x, row in rows)
+
+    # only the connection of the calling thread can be closed, those of other threads are closed
+    # when their threads end
+    def close(self):
+        if getattr(self.local, 'db', None) is not None:
+            self.local.db.close()
+            self.local.db = None
+
+
+class PMTilesSource(TileSource):
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        assert self.data[0:7] == b'PMTiles' and self.data[7] == 3, f"{path}: not a PMTiles v3 archive"
+        (self.root_offset, self.root_length, self.meta_offset, self.meta_length,
+         self.leaf_offset, self.leaf_length, self.tile_offset, self.tile_length) = struct.unpack_from('<8Q', self.data, 8)
+        self.internal_compression = self.data[97]
+        minzoom, maxzoom          = self.data[100], self.data[101]
+        metadata                  = json.loads(self._read(self.meta_offset, self.meta_length, True) or b'{}')
+        self.index                = _make_index(minzoom, maxzoom, metadata.get('vector_layers'))
+        self.dirs                 = {} # parsed directories by offset
+        self.lock                 = threading.Lock()
+
+    # read a range of bytes from the memory-mapped archive
+    def _read(self, offset, length, internal=False):
+        data = self.data[offset:offset + length]
+        if internal and self.internal_compression == 2:
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        return data
+
+    @staticmethod
+    def _varints(data):
+        val, shift = 0, 0
+        for byte in data:
+            val   |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                yield val
+                val, shift = 0, 0
+
+    # parse a directory into sorted lists of tile ids, run lengths, lengths and offsets
+    def _directory(self, offset, length):
+        with self.lock:
+            if offset in self.dirs:
+                return self.dirs[offset]
+        values  = self._varints(self._read(offset, length, True))
+        count   = next(values)
+        tile_id = 0
+        ids     = []
+        for _ in range(count):
+            tile_id += next(values)
+            ids.append(tile_id)
+        runs    = [next(values) for _ in range(count)]
+        lengths = [next(values) for _ in range(count)]
+        offsets = []
+        for idx in range(count):
+            val = next(values)
+            offsets.append(offsets[-1] + lengths[idx - 1] if val == 0 and idx > 0 else val - 1)
+        directory = (ids, runs, lengths, offsets)
+        with self.lock:
+            self.dirs[offset] = directory
+        return directory
+
+    # position of a tile along the Hilbert curve, counting the tiles of all lower zoom levels first
+    @staticmethod
+    def tile_id(z, x, y):
+        tile_id = ((1 << (2 * z)) - 1) // 3
+        s       = (1 << z) >> 1
+        while s > 0:
+            rx       = 1 if x & s else 0
+            ry       = 1 if y & s else 0
+            tile_id += s * s * ((3 * rx) ^ ry)
+            if ry == 0:
+                if rx == 1:
+                    x, y = s - 1 - x, s - 1 - y
+                x, y = y, x
+            s >>= 1
+        return tile_id
+
+    # inverse of tile_id
+    @staticmethod
+    def tile_zxy(tile_id):
+        z, acc = 0, 0
+        while acc + (1 << (2 * z)) <= tile_id:
+            acc += 1 << (2 * z)
+            z   += 1
+        d, x, y, s = tile_id - acc, 0, 0, 1
+        while s < (1 << z):
+            rx = 1 & (d >> 1)
+            ry = 1 & (d ^ rx)
+            if ry == 0:
+                if rx == 1:
+                    x, y = s - 1 - x, s - 1 - y
+                x, y = y, x
+            x  += s * rx
+            y  += s * ry
+            d >>= 2
+            s <<= 1
+        return z, x, y
+
+    # locate a tile (or a run of tiles) in the archive, descending into leaf directories
+    def _find(self, tile_id):
+        offset, length = self.root_offset, self.root_length
+        for _ in range(4): # the specification allows at most three levels of leaf directories
+            ids, runs, lengths, offsets = self._directory(offset, length)
+            idx = bisect_right(ids, tile_id) - 1
+            if idx < 0:
+                return None
+            if runs[idx] == 0:
+                offset, length = self.leaf_offset + offsets[idx], lengths[idx]
+            elif tile_id < ids[idx] + runs[idx]:
+                return self.tile_offset + offsets[idx], lengths[idx]
+            else:
+                return None
+        return None
+
+    def get_tile(self, z, x, y):
+        entry = self._find(self.tile_id(z, x, y))
+        return _decompress(self._read(*entry)) if entry is not None else None
+
+    # tiles within a tile range are looked up one by one, otherwise all directories are walked to
+    # collect the tiles of a zoom level (tile ids of one zoom level are contiguous, hence entries
+    # outside that range are skipped)
+    def tile_coords(self, z, tile_range=None):
+        if tile_range is not None:
+            # tile ids of coordinates beyond the zoom level belong to other zoom levels
+            (x0, y0), (x1, y1) = tile_range
+            last = (1 << z) - 1
+            return set(
+                (x, y) for x in range(max(x0, 0), min(x1, last) + 1) for y in range(max(y0, 0), min(y1, last) + 1)
+                if self._find(self.tile_id(z, x, y)) is not None
+            )
+        first, last = ((1 << (2 * z)) - 1) // 3, ((1 << (2 * (z + 1))) - 1) // 3
+        coords      = set()
+        stack       = [(self.root_offset, self.root_length)]
+        while len(stack) > 0:
+            ids, runs, lengths, offsets = self._directory(*stack.pop())
+            for idx, (tile_id, run) in enumerate(zip(ids, runs)):
+                next_id = ids[idx + 1] if idx + 1 < len(ids) else last
+                if next_id <= first or tile_id >= last:
+                    continue
+                if run == 0:
+                    stack.append((self.leaf_offset + offsets[idx], lengths[idx]))
+                else:
+                    for run_id in range(max(tile_id, first), min(tile_id + run, last)):
+                        coords.add(self.tile_zxy(run_id)[1:])
+        return coords
+
+    def close(self):
+        if not self.data.closed:
+            self.data.close()
+            self.file.close()
+
+
+class DirectoryTileSource(TileSource):
+    def __init__(self, path, template='{z}/{x}/{y}.pbf'):
+        self.path     = path
+        self.template = template
+        # regular expression matching relative paths of tiles
+        self.pattern  = re.compile(
+            re.sub(r'\\\{([zxy])\\\}', r'(?P<\1>[0-9]+)', re.escape(template)) + '$'
+        )
+        self.coords   = None
+        metadata      = {}
+        if os.path.exists(os.path.join(path, 'metadata.json')):
+            with open(os.path.join(path, 'metadata.json')) as f:
+                metadata = json.load(f)
+            if isinstance(metadata.get('json'), str): # metadata exported from MBTiles
+                metadata.update(json.loads(metadata['json']))
+        if 'minzoom' not in metadata or 'maxzoom' not in metadata:
+            zooms = [int(name) for name in os.listdir(path) if name.isdigit()]
+            metadata.setdefault('minzoom', min(zooms))
+            metadata.setdefault('maxzoom', max(zooms))
+        self.index    = _make_index(metadata['minzoom'], metadata['maxzoom'], metadata.get('vector_layers'))
+
+    def get_tile(self, z, x, y):
+        try:
+            with open(os.path.join(self.path, self.template.format(z=z, x=x, y=y)), 'rb') as f:
+                return _decompress(f.read())
+        except FileNotFoundError:
+            return None
+
+    # tiles within a tile range are checked one by one, otherwise the directory tree is scanned once
+    # and the coordinates of all tiles are kept per zoom level
+    def tile_coords(self, z, tile_range=None):
+        if tile_range is not None:
+            (x0, y0), (x1, y1) = tile_range
+            return set(
+                (x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)
+                if os.path.exists(os.path.join(self.path, self.template.format(z=z, x=x, y=y)))
+            )
+        if self.coords is None:
+            self.coords = {}
+            for root, _, files in os.walk(self.path):
+                for name in files:
+                    rel   = os.path.relpath(os.path.join(root, name), self.path).replace(os.sep, '/')
+                    match = self.pattern.match(rel)
+                    if match is not None:
+                        self.coords.setdefault(int(match['z']), set()).add(
+                            (int(match['x']), int(match['y']))
+                        )
+        return self.coords.get(z, set())
+
+
+# open a local tile source for a path, or return None for http(s) urls
+def open_tile_source(location):
+    if re.match(r'https?://', location):
+        return None
+    if os.path.isdir(location):
+        return DirectoryTileSource(location)
+    if location.endswith('.mbtiles'):
+        return MBTilesSource(location)
+    if location.endswith('.pmtiles'):
+        return PMTilesSource(location)
+    raise ValueError(f"{location}: unknown tile source")
@@ -1,32 +1,77 @@
-
 from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import re
-import time
+import json
 import logging
+import math
+import numpy as np
 
 import vector_tile_pb2
+import metrics
+from tile_sources import open_tile_source
+from tile_cache import TileIndex
+from request_scheduler import default_scheduler
+from feature_filters import FeatureFilter
+from layer_tables import LayerTable
+from style_index import StyleIndex
+from parallel import bounded_map
+from geometry_utils import clip_shape_array
+from shape_store import ShapeStore
+
+# parsed styles and their indices by url (see style_index.StyleIndex)
+_style_cache = {}
 
 class VectorTileMap:
-    def __init__(self, index_url, style_url=None, logger=None):
+    # index_url is either the url of a tile index or the path of a local tile source (MBTiles or
+    # PMTiles archive, or z/x/y directory tree); requests are scheduled by the given scheduler
+    # (see request_scheduler.RequestScheduler), by default one shared by all instances
+    def __init__(self, index_url, style_url=None, logger=None, max_workers=8, cache=None, scheduler=None):
         self.logger = logging.getLogger(
             VectorTileMap.__qualname__ if logger is None else logger
         )
 
+        # local tile source (None when tiles are fetched over http)
+        self.source = open_tile_source(index_url)
+
+        # optional persistent tile cache (see tile_cache.TileCache)
+        self.cache = cache
+
+        # shared keep-alive session, with one pooled connection per worker
+        self.scheduler   = default_scheduler if scheduler is None else scheduler
+        self.max_workers = max_workers
+        self.session     = requests.Session()
+        adapter          = requests.adapters.HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers
+        )
+        self.session.mount('http://' , adapter)
+        self.session.mount('https://', adapter)
+
         # load index
-        req = requests.get(index_url)
-        assert req.status_code == 200, f"{index_url}: status {req.status_code}"
-        self.index = req.json()
+        if self.source is not None:
+            self.index = self.source.index
+        else:
+            self.index = self._load_json(index_url)
+
+        # sparse index of known present and absent tiles, persisted alongside the tile cache; its
+        # entries expire like those of the cache (except in offline mode, where nothing expires)
+        self.tile_index = TileIndex(
+            None if cache is None or self.source is not None else cache.index_path(index_url),
+            None if cache is None or cache.offline else cache.max_age
+        )
 
         # load style
         self.style = None
         if style_url is None and 'defaultStyles' in self.index:
             style_url  = urljoin(index_url, self.index['defaultStyles'])
             style_url += '/root.json'
+        self.style_index = None
         if style_url is not None:
-            req = requests.get(style_url)
-            assert req.status_code == 200, f"{style_url}: status {req.status_code}"
-            self.style = req.json()
+            # styles are parsed and indexed once per url and shared by all instances using them
+            if style_url not in _style_cache:
+                style = self._load_json(style_url)
+                _style_cache[style_url] = style, StyleIndex(style['layers'])
+            self.style, self.style_index = _style_cache[style_url]
 
         # layer description
         self.layer_desc = None
@@ -34,13 +79,17 @@ class VectorTileMap:
             self.layer_desc = self.style['layers']
         elif 'vector_layers' in self.index:
             self.layer_desc = self.index['vector_layers']
+            self.style_index = StyleIndex(self.layer_desc)
 
         # extract information from index
-        self.tile_url = urljoin(index_url, self.index['tiles'][0])
-        self.crs      = None
-        self.orig     = (0, 0)
-        self.size     = (1, 1)
-        self.lods     = []
+        self.tile_url    = urljoin(index_url, self.index['tiles'][0]) if self.source is None else None
+        self.tilemap_url = None
+        if self.source is None and 'tileMap' in self.index:
+            self.tilemap_url = urljoin(index_url, self.index['tileMap']) + '/{z}/{y}/{x}/{w}/{h}'
+        self.crs         = None
+        self.orig        = (0, 0)
+        self.size        = (1, 1)
+        self.lods        = []
         if 'extent' in self.index:
             extent    = self.index['extent']
             self.orig = (min(extent[0], extent[1]), min(extent[0], extent[1]))
@@ -60,179 +109,374 @@ class VectorTileMap:
                 self.lods.append((lod['level'], lod['resolution'] * 512))
 
 
+    # release the connections of the session and the local tile source, if any
+    def close(self):
+        self.session.close()
+        if self.source is not None:
+            self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    # load a json document from a url or a local file
+    def _load_json(self, url):
+        if not re.match(r'https?://', url):
+            with open(url) as f:
+                return json.load(f)
+        status, content = self._request('GET', url)
+        assert status == 200, f"{url}: status {status}"
+        return json.loads(content)
+
+
     def get_style_layers(self, zoom_level=None):
-        for layer in self.layer_desc:
-            zoom_range = layer.get('minzoom', 0), layer.get('maxzoom', 256)
-            zoom_match = zoom_level is None or (
-                zoom_level >= zoom_range[0] and zoom_level <= zoom_range[1]
-            )
-            if zoom_match:
-                yield layer
+        yield from self.style_index.get_layers(zoom_level)
 
 
     # convert style layers to filters (dictionary for filtering features)
     def get_style_filters(self, style_layer_patterns, zoom_level=None):
-        filters = {}
-        for layer in self.layer_desc:
-            for pattern in style_layer_patterns:
-                zoom_range = layer.get('minzoom', 0), layer.get('maxzoom', 256)
-                zoom_match = zoom_level is None or (
-                    zoom_level >= zoom_range[0] and zoom_level <= zoom_range[1]
-                )
-                if zoom_match and re.match(pattern, layer['id']):
-                    source_layer = layer.get('source-layer', None)
-                    layer_filter = layer.get('filter', None)
-                    if source_layer is not None:
-                        if layer_filter is None:
-                            filters[source_layer] = None
-                        else:
-                            layer_filter = set([tuple(layer_filter)])
-                            prev_filters = filters.get(source_layer, set())
-                            if prev_filters is not None:
-                                filters[source_layer] = prev_filters | layer_filter
-        return filters
-
-
-    # binary search to find locations of tiles (avoid trying all urls)
-    def _get_tile_coords(self, lod_seq, view=None, coords=None):
-        self.logger.info(f"probing tile coordinates for LOD {lod_seq[0][0]}")
+        return self.style_index.get_filters(style_layer_patterns, zoom_level)
+
+
+    # binary search to find locations of tiles (avoid trying all urls); tiles whose presence is
+    # already recorded in the tile index are not probed again, remaining probes run concurrently;
+    # tiles that could not be probed are added to unresolved (see query_tiles)
+    def _get_tile_coords(self, lod_seq, view=None, coords=None, unresolved=None):
+        level, scale = lod_seq[0]
         if coords is None:
-            extent = 2**lod_seq[0][0]
+            extent = 2**level
             coords = [(x, y) for x in range(extent) for y in range(extent)]
+        # only tiles that overlap the view port are of interest
+        coords  = [(x, y) for x, y in coords if self._in_view(x, y, scale, view)]
+        unknown = [(x, y) for x, y in coords if self.tile_index.lookup(level, x, y) is None]
+        if len(unknown) > 0 and self.tilemap_url is not None:
+            self._seed_tile_index(level, unknown)
+            unknown = [(x, y) for x, y in unknown if self.tile_index.lookup(level, x, y) is None]
+        if len(unknown) > 0:
+            self.logger.info(f"probing {len(unknown)} of {len(coords)} tiles for LOD {level}")
+            urls = [self.tile_url.format(z=level, y=y, x=x) for x, y in unknown]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for (x, y), (status, _) in zip(unknown, pool.map(lambda url: self._request('HEAD', url), urls)):
+                    self._record_tile(level, x, y, status)
+                    if status is None and unresolved is not None:
+                        unresolved.append((level, x, y))
+            self.tile_index.save()
         next_coords = []
-        for cnt, (x, y) in enumerate(coords):
-            # extent of this tile
-            scale  = lod_seq[0][1]
-            x0, y0 = (self.orig[0] +  x      * scale, self.orig[1] +  y      * scale)
-            x1, y1 = (self.orig[0] + (x + 1) * scale, self.orig[1] + (y + 1) * scale)
-            # probe tile if it overlaps view port
-            if view is None or (view[0][0] < x1 and view[0][1] < y1 and
-                                view[1][0] > x0 and view[1][1] > y0):
-                self.logger.info(f"probing tile {cnt} of {len(coords)}")
-                while True:
-                    try:
-                        req = requests.head(
-                            self.tile_url.format(z=lod_seq[0][0], y=y, x=x)
-                        )
-                    except requests.exceptions.ConnectionError:
-                        self.logger.info(f"connection error, trying again")
-                        pass
-                    else:
-                        if req.status_code in [429, 500, 502, 503, 504]:
-                            self.logger.info(f"server error, trying again")
-                        else:
-                            break
-                if req.status_code == 200:
-                    x, y = x * 2, y * 2
-                    next_coords += [(x, y), (x + 1, y), (x, y + 1), (x + 1, y + 1)]
+        for x, y in coords:
+            if self.tile_index.lookup(level, x, y):
+                x, y = x * 2, y * 2
+                next_coords += [(x, y), (x + 1, y), (x, y + 1), (x + 1, y + 1)]
         if len(lod_seq) == 1:
             return next_coords
-        return self._get_tile_coords(lod_seq[1:], view, next_coords)
+        return self._get_tile_coords(lod_seq[1:], view, next_coords, unresolved)
+
+
+    def _in_view(self, x, y, scale, view):
+        # extent of this tile
+        x0, y0 = (self.orig[0] +  x      * scale, self.orig[1] +  y      * scale)
+        x1, y1 = (self.orig[0] + (x + 1) * scale, self.orig[1] + (y + 1) * scale)
+        return view is None or (view[0][0] < x1 and view[0][1] < y1 and
+                                view[1][0] > x0 and view[1][1] > y0)
+
+
+    # range ((x0, y0), (x1, y1)) of the tiles of a zoom level overlapping the view port (bounds
+    # included), or None without a view port; the range is widened such that rounding cannot
+    # exclude tiles that touch its edges (the tiles are filtered with _in_view anyway)
+    def _tile_range(self, level, scale, view):
+        if view is None:
+            return None
+        last = 2**level - 1
+        return (
+            (max(math.floor((view[0][0] - self.orig[0]) / scale) - 1, 0),
+             max(math.floor((view[0][1] - self.orig[1]) / scale) - 1, 0)),
+            (min(math.floor((view[1][0] - self.orig[0]) / scale), last),
+             min(math.floor((view[1][1] - self.orig[1]) / scale), last))
+        )
+
+
+    # remember the outcome of a probe or fetch (other status codes are not conclusive, nor are
+    # offline misses, which have no status)
+    def _record_tile(self, level, x, y, status):
+        if status in (200, 404):
+            self.tile_index.add(level, x, y, status == 200)
+
+
+    # seed the tile index from the tilemap resource of an ArcGIS tile server, which reports the
+    # presence of a whole block of tiles with a single request; seeding is only an optimization,
+    # if the resource fails the remaining tiles are probed one by one
+    def _seed_tile_index(self, level, coords, block=128):
+        left, top     = min(x for x, _ in coords), min(y for _, y in coords)
+        right, bottom = max(x for x, _ in coords), max(y for _, y in coords)
+        for block_top in range(top, bottom + 1, block):
+            for block_left in range(left, right + 1, block):
+                width  = min(block, right  - block_left + 1)
+                height = min(block, bottom - block_top  + 1)
+                try:
+                    status, content = self._request('GET', self.tilemap_url.format(
+                        z=level, y=block_top, x=block_left, w=width, h=height
+                    ))
+                except requests.exceptions.RequestException as exc:
+                    self.logger.warning(f"tilemap failed for LOD {level} ({exc}), probing tiles instead")
+                    return
+                if status != 200:
+                    self.logger.info(f"tilemap not available for LOD {level}")
+                    return
+                tilemap  = json.loads(content)
+                location = tilemap['location']
+                for idx, present in enumerate(tilemap['data']):
+                    self.tile_index.add(
+                        level,
+                        location['left'] + idx % location['width'],
+                        location['top']  + idx // location['width'],
+                        present != 0
+                    )
+
+
+    # request a resource (method 'GET') or probe for its existence (method 'HEAD'), retrying on
+    # connection and server errors as the scheduler permits; returns the status code and the content
+    # (None for probes); raises if retrying was given up (see RequestScheduler.request); the status
+    # is None for resources that are not cached in offline mode
+    def _request(self, method, url):
+        cache_key, meta = None, None
+        if self.cache is not None:
+            cache_key     = self.cache.key(url)
+            meta, content = self.cache.get(cache_key, need_content=(method == 'GET'))
+            # probe results are answered by any entry, fetches only by entries with content
+            usable        = meta is not None and (
+                method == 'HEAD' or content is not None or meta['status'] != 200
+            )
+            if usable and self.cache.is_fresh(meta):
+                metrics.count('cache_hits')
+                return meta['status'], content
+            if self.cache.offline:
+                self.logger.info(f"{url} not cached, treating it as absent")
+                return None, None
+            if not usable:
+                meta = None
+        headers = {} if meta is None else self.cache.conditional_headers(meta)
+        def send():
+            metrics.count(f"http_{method.lower()}_requests")
+            return self.session.request(method, url, headers=headers, timeout=self.scheduler.timeout)
+        req = self.scheduler.request(url, send)
+        if req.status_code == 304:
+            metrics.count('cache_revalidated')
+            self.cache.refresh(cache_key, meta)
+            return meta['status'], content
+        content = req.content if method == 'GET' and req.status_code == 200 else None
+        if content is not None:
+            metrics.count('bytes_fetched', len(content))
+        # a probe must not replace a cached entry that holds content
+        if self.cache is not None and (method == 'GET' or meta is None or not meta['has_content']):
+            self.cache.put(cache_key, req.status_code, content, req.headers)
+        return req.status_code, content
+
 
+    # fetch the raw data of a single tile, returns None if the tile does not exist (or could not be
+    # fetched, in which case it is added to unresolved)
+    def _fetch_tile_data(self, level, x, y, unresolved=None):
+        if self.source is not None:
+            return self.source.get_tile(level, x, y)
+        status, content = self._request('GET', self.tile_url.format(z=level, y=y, x=x))
+        self._record_tile(level, x, y, status)
+        if status is None and unresolved is not None:
+            unresolved.append((level, x, y))
+        metrics.count('tiles_fetched' if status == 200 else 'tiles_missing')
+        return content if status == 200 else None
 
-    def _get_tiles(self, lod_idx, view=None, bufcnt=10):
+
+    # fetch and parse a single tile
+    def _fetch_tile(self, level, x, y, unresolved=None):
+        content = self._fetch_tile_data(level, x, y, unresolved)
+        if content is None:
+            return None
+        tile = vector_tile_pb2.Tile()
+        tile.ParseFromString(content)
+        return tile
+
+
+    # fetch tiles concurrently, yielding them in order if ordered is True and as they finish
+    # otherwise; at most bufcnt tiles are in flight or waiting to be consumed at any time; tiles
+    # are parsed unless parse is False, in which case their raw data is yielded
+    def _get_tiles(self, lod_idx, view=None, bufcnt=10, ordered=False, parse=True, unresolved=None):
         level, scale = self.lods[lod_idx]
-        coords       = (
-            self._get_tile_coords(self.lods[0:lod_idx], view) if lod_idx > 0 else
-            [(x, y) for x in range(2**level) for y in range(2**level)]
+        if self.source is not None:
+            # local sources know which tiles exist, no need for probing
+            coords = sorted(self.source.tile_coords(level, self._tile_range(level, scale, view)))
+        else:
+            coords = (
+                self._get_tile_coords(self.lods[0:lod_idx], view, unresolved=unresolved) if lod_idx > 0 else
+                [(x, y) for x in range(2**level) for y in range(2**level)]
+            )
+            # skip tiles that are already known to be absent
+            coords = [(x, y) for x, y in coords if self.tile_index.lookup(level, x, y) is not False]
+        fetch = self._fetch_tile if parse else self._fetch_tile_data
+        def fetch_args():
+            for cnt, (x, y) in enumerate(coords):
+                # fetch tile if it overlaps view port
+                if self._in_view(x, y, scale, view):
+                    self.logger.info(f"fetching tile {cnt} of {len(coords)}")
+                    yield (x, y)
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(bufcnt, 1))) as pool:
+            for tile, tile_pos in bounded_map(
+                pool, lambda x, y: (fetch(level, x, y, unresolved), (x, y)), fetch_args(), bufcnt, ordered
+            ):
+                if tile is not None:
+                    yield (tile, tile_pos)
+        self.tile_index.save()
+
+
+    # extent of a tile
+    def _tile_box(self, lod_idx, tile_pos):
+        lod_scale = self.lods[lod_idx][1]
+        x0, y0    = (
+            self.orig[0] + tile_pos[0] * lod_scale,
+            self.orig[1] + tile_pos[1] * lod_scale
         )
-        tilebuf      = []
-        for cnt, (x, y) in enumerate(coords):
-            # extent of this tile
-            x0, y0 = (self.orig[0] +  x      * scale, self.orig[1] +  y      * scale)
-            x1, y1 = (self.orig[0] + (x + 1) * scale, self.orig[1] + (y + 1) * scale)
-            # fetch tile if it overlaps view port
-            if view is None or (view[0][0] < x1 and view[0][1] < y1 and
-                                view[1][0] > x0 and view[1][1] > y0):
-                self.logger.info(f"fetching tile {cnt} of {len(coords)}")
-                while True:
-                    try:
-                        req = requests.get(self.tile_url.format(z=level, y=y, x=x))
-                    except requests.exceptions.ConnectionError:
-                        self.logger.info(f"connection error, trying again")
-                        pass
-                    else:
-                        if req.status_code in [429, 500, 502, 503, 504]:
-                            self.logger.info(f"server error, trying again")
-                        else:
-                            break
-                    time.sleep(5)
-                if req.status_code == 200:
-                    tile = vector_tile_pb2.Tile()
-                    tile.ParseFromString(req.content)
-                    tilebuf.append((tile, (x, y)))
-                if len(tilebuf) > bufcnt:
-                    for tile in tilebuf:
-                        yield tile
-                    tilebuf = []
-        for tile in tilebuf:
-            yield tile
-
-
-    def _query_features(self, lod_idx, view=None, filters=None):
-        for tile, tile_pos in self._get_tiles(lod_idx, view):
-            for layer in tile.layers:
-                if filters is None or layer.name in filters:
-                    for feature in layer.features:
-                        # get tags for this feature
-                        tags = {
-                            layer.keys[key]: layer.values[val].ListFields()[0][1]
-                            for key, val
-                            in zip(feature.tags[::2], feature.tags[1::2])
-                        }
-                        if filters is None or filters[layer.name] is None:
-                            yield (feature, tile_pos, layer.extent, layer.name, tags)
-                        else:
-                            # evaluate filters
-                            for op, val1, val2 in filters[layer.name]:
-                                if isinstance(val1, str) and val1 in tags:
-                                    val1 = tags[val1]
-                                if isinstance(val2, str) and val2 in tags:
-                                    val2 = tags[val2]
-                                if eval(f"{val1} {op} {val2}"):
-                                    yield (feature, tile_pos, layer.extent, layer.name, tags)
-                                    break
-
-
-    def query_shapes(self, level, view=None, filters=None):
+        return ((x0, y0), (x0 + lod_scale, y0 + lod_scale))
+
+
+    def _query_features(self, lod_idx, view=None, filters=None, ordered=False):
+        layer_filters = _compile_layer_filters(filters)
+        for tile, tile_pos in self._get_tiles(lod_idx, view, ordered=ordered):
+            for feature, layer_extent, layer_name, tags in _tile_features(tile, layer_filters):
+                yield (feature, tile_pos, layer_extent, layer_name, tags)
+
+
+    # raw data of the tiles overlapping the view port, along with their extents and sizes, for
+    # decoding them elsewhere (e.g., in worker processes with decode_tile); the (level, x, y) of
+    # tiles that were neither fetched nor confirmed to be absent (tiles that are not cached in
+    # offline mode) are appended to the list unresolved, if given, such that callers can tell
+    # whether the result is complete
+    def query_tiles(self, level, view=None, ordered=False, unresolved=None):
         lod_idx = next(idx for idx, lod in enumerate(self.lods) if lod[0] == level)
-        for feature, tile_pos, layer_extent, layer_name, tags in self._query_features(lod_idx, view, filters):
-            # origin and scale for this tile
-            lod_scale  = self.lods[lod_idx][1]
-            x0, y0     = (
-                self.orig[0] + tile_pos[0] * lod_scale,
-                self.orig[1] + tile_pos[1] * lod_scale
-            )
-            tile_box   = ((x0, y0), (x0 + lod_scale, y0 + lod_scale))
-            tile_scale = lod_scale / layer_extent
-            shape = None
-            pos   = (0, 0)
-            op    = None
-            cnt   = 0
-            for geometry in feature.geometry:
-                if op is None:
-                    op  = geometry & 0x7
-                    cnt = (geometry >> 3) * 2
-                else:
-                    val = (geometry >> 1) ^ (-(geometry & 1))
-                    if (cnt & 1) == 0:
-                        pos = (pos[0] + val, pos[1])
-                    else:
-                        pos = (pos[0], pos[1] + val)
-                        if op == 1:
-                            # yield the current shape (if any)
-                            if shape is not None:
-                                yield (feature.type, shape, layer_name, tags, tile_box)
-                            # start a new shape
-                            shape = [(x0 + pos[0] * tile_scale, y0 + pos[1] * tile_scale)]
-                        elif op == 2:
-                            # append to the current line
-                            shape.append((x0 + pos[0] * tile_scale, y0 + pos[1] * tile_scale))
-                        else:
-                            raise ValueError("invalid geometry command")
-                    cnt -= 1
-                if op == 7 or cnt == 0:
-                    op = None
-            # yield the last shape (if any)
-            if shape is not None:
-                yield (feature.type, shape, layer_name, tags, tile_box)
+        for content, tile_pos in self._get_tiles(lod_idx, view, ordered=ordered, parse=False, unresolved=unresolved):
+            yield (content, self._tile_box(lod_idx, tile_pos), self.lods[lod_idx][1])
+
+
+    # like query_shapes, but the coordinates of each shape are an (n, 2) NumPy array
+    def query_shape_arrays(self, level, view=None, filters=None, ordered=False, clip=False):
+        lod_idx   = next(idx for idx, lod in enumerate(self.lods) if lod[0] == level)
+        lod_scale = self.lods[lod_idx][1]
+        for feature, tile_pos, layer_extent, layer_name, tags in self._query_features(lod_idx, view, filters, ordered):
+            tile_box = self._tile_box(lod_idx, tile_pos)
+            for shape in _feature_shape_arrays(feature, tile_box[0], lod_scale / layer_extent):
+                for clipped in (clip_shape_array(feature.type, shape, view) if clip and view is not None else (shape,)):
+                    yield (feature.type, clipped, layer_name, tags, tile_box)
+
+
+    # shapes of the features in the tiles overlapping the view port; with clip, the shapes are
+    # clipped to the view port itself (lines may be split into several shapes)
+    def query_shapes(self, level, view=None, filters=None, ordered=False, clip=False):
+        for shape_type, coords, layer_name, tags, tile_box in self.query_shape_arrays(level, view, filters, ordered, clip):
+            yield (shape_type, list(map(tuple, coords.tolist())), layer_name, tags, tile_box)
+
+
+# filters map layer names to sets of filter expressions (see feature_filters.FeatureFilter); the
+# filters are compiled once (compiled filters are kept for repeated calls, e.g., in worker processes)
+_layer_filter_cache = {}
+
+def _compile_layer_filters(filters):
+    if filters is None:
+        return None
+    key = tuple(sorted(
+        (layer_name, None if layer_filter is None else frozenset(layer_filter))
+        for layer_name, layer_filter in filters.items()
+    ))
+    if key not in _layer_filter_cache:
+        _layer_filter_cache[key] = {
+            layer_name: FeatureFilter(layer_filter) for layer_name, layer_filter in filters.items()
+        }
+    return _layer_filter_cache[key]
+
+
+# the compiled filters are bound to the key and value tables of each tile layer, such that features
+# can be rejected before their tags are decoded; the tags of the yielded features are lazy mappings
+# (see layer_tables.FeatureTags) that only decode the values that are read
+def _tile_features(tile, layer_filters):
+    for layer in tile.layers:
+        if layer_filters is None or layer.name in layer_filters:
+            table = LayerTable(layer)
+            pred  = True if layer_filters is None else layer_filters[layer.name].bind(table)
+            metrics.count('features_in_tiles', len(layer.features))
+            if pred is False:
+                continue
+            for feature in layer.features:
+                tags = table.tags(feature)
+                if pred is not True and not pred(tags.indices(), feature.type):
+                    continue
+                yield (feature, layer.extent, layer.name, tags)
+
+
+# decode the command and zigzag encoded parameter integers of a feature geometry; returns the
+# vertices (relative to the tile origin, in tile units) and the indices of those vertices that
+# start a new shape (one for each MoveTo parameter pair)
+def _decode_geometry(geometry):
+    params = np.zeros(len(geometry), dtype=bool) # mask of parameter integers
+    starts = []
+    idx    = 0
+    vtx    = 0
+    while idx < len(geometry):
+        op, cnt = geometry[idx] & 0x7, geometry[idx] >> 3
+        idx    += 1
+        if op == 7 or cnt == 0:
+            continue
+        if op == 1:
+            starts.extend(range(vtx, vtx + cnt))
+        elif op != 2:
+            raise ValueError("invalid geometry command")
+        params[idx:idx + 2 * cnt] = True
+        idx += 2 * cnt
+        vtx += cnt
+    vals = np.fromiter(geometry, dtype=np.int64, count=len(geometry))[params]
+    vals = (vals >> 1) ^ -(vals & 1)
+    # positions are encoded as deltas to the previous position (across all shapes)
+    return np.cumsum(vals.reshape(-1, 2), axis=0), starts
+
+
+# shapes of a feature as (n, 2) arrays of coordinates, with the tile transform (translation to the
+# tile origin and scaling from tile units) applied
+def _feature_shape_arrays(feature, tile_orig, tile_scale):
+    pos, starts = _decode_geometry(feature.geometry)
+    if len(starts) == 0:
+        return []
+    coords = pos * tile_scale + tile_orig
+    return np.split(coords[starts[0]:], np.array(starts[1:]) - starts[0])
+
+
+# decode the raw data of a tile (see VectorTileMap.query_tiles) into a shape store (see
+# shape_store.ShapeStore) with coordinates of the given dtype; the tags of features with the same
+# raw tags in a layer are decoded only once; the shapes are clipped to clip_box if given
+def decode_tile_store(content, tile_box, tile_size, filters=None, clip_box=None, dtype=np.float64):
+    tile = vector_tile_pb2.Tile()
+    tile.ParseFromString(content)
+    store    = ShapeStore(dtype)
+    tag_sets = {}
+    for feature, layer_extent, layer_name, tags in _tile_features(tile, _compile_layer_filters(filters)):
+        tag_key = (layer_name, tuple(tags.raw))
+        tag_set = tag_sets.get(tag_key)
+        if tag_set is None:
+            tag_set = tag_sets[tag_key] = tuple(tags.materialize().items())
+        for shape in _feature_shape_arrays(feature, tile_box[0], tile_size / layer_extent):
+            for clipped in (clip_shape_array(feature.type, shape, clip_box) if clip_box is not None else (shape,)):
+                store.append(feature.type, clipped, layer_name, tag_set, tile_box)
+    metrics.count('tiles_decoded')
+    metrics.count('shapes_decoded', len(store))
+    metrics.count('vertices_decoded', len(store.coords))
+    return store
+
+
+# decode the raw data of a tile into a list of shapes in the format of
+# VectorTileMap.query_shape_arrays, with tags as regular dictionaries such that the result can be
+# passed between processes; the shapes are clipped to clip_box if given
+def decode_tile(content, tile_box, tile_size, filters=None, clip_box=None):
+    return list(decode_tile_store(content, tile_box, tile_size, filters, clip_box).shapes())
+
+# decode_tile_store along with the report of the metrics recorded while decoding, such that the
+# metrics of tiles decoded in worker processes are not lost
+def decode_tile_with_metrics(content, tile_box, tile_size, filters=None, clip_box=None, dtype=np.float64):
+    with metrics.collect() as collector:
+        store = decode_tile_store(content, tile_box, tile_size, filters, clip_box, dtype)
+    return store, collector.report()